@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+import brotli
+from fastapi import Request, status
+from fastapi.responses import Response
+
+
+IMMUTABLE = "public, max-age=31536000, immutable"  # for urls with the content hash in them
+REVALIDATE = "no-cache"  # stored by browsers, but checked with the ETag on every use
+BROTLI_MAX_BEST = 1 << 20  # largest body compressed at the best brotli quality
+
+
+class Asset:
+    """A static body compressed once, up front, in every supported encoding,
+    and served with an ETag, answering conditional requests with a 304.
+    """
+
+    __slots__ = ("bodies", "digest", "media_type", "cache_control")
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str = REVALIDATE):
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.bodies = {"identity": body}
+
+        # Encodings are only kept when they actually save bytes.
+        compressed = {
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+            # Quality 11 takes seconds per megabyte, too slow at startup for large files.
+            "br": brotli.compress(body, quality=11 if len(body) <= BROTLI_MAX_BEST else 9),
+        }
+        for encoding, data in compressed.items():
+            if len(data) < len(body):
+                self.bodies[encoding] = data
+
+    def etag(self, encoding: str) -> str:
+        # Each encoding is a different representation, so it gets its own tag.
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+    def is_fresh(self, if_none_match: str) -> bool:
+        tags = {tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")}
+        return "*" in tags or any(tag.partition("-")[0] == self.digest for tag in tags)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        accepted = {}
+
+        for item in accept_encoding.lower().split(","):
+            name, _, params = item.strip().partition(";")
+            try:
+                quality = float(params.strip().removeprefix("q=")) if params else 1.0
+            except ValueError:
+                quality = 0.0
+            accepted[name.strip()] = quality
+
+        # Smallest first: brotli, then gzip, then the plain body.
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return "identity"
+
+    def response(self, request: Request) -> Response:
+        encoding = self.negotiate(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": self.etag(encoding),
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if self.is_fresh(request.headers.get("if-none-match", "")):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], media_type=self.media_type, headers=headers)
+
+
+class StaticAssets:
+    """Files of a directory, loaded and compressed at startup. They are served
+    under names with their content hash in them, so that browsers may cache
+    them forever: a changed file gets a new url.
+    """
+
+    def __init__(self, directory: Path, prefix: str = "/static"):
+        self.prefix = prefix
+        self._urls: dict[str, str] = {}
+        self._assets: dict[str, Asset] = {}
+
+        for path in sorted(directory.rglob("*")):
+            if not path.is_file():
+                continue
+
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            if media_type.startswith("text/") or media_type.endswith("javascript"):
+                media_type += "; charset=utf-8"
+
+            asset = Asset(path.read_bytes(), media_type, cache_control=IMMUTABLE)
+            relative = path.relative_to(directory)
+            name = relative.with_name(f"{path.stem}.{asset.digest[:10]}{path.suffix}").as_posix()
+            self._urls[relative.as_posix()] = f"{prefix}/{name}"
+            self._assets[name] = asset
+
+    def url(self, path: str) -> str:
+        """Url of the current version of `path`, relative to the directory."""
+        return self._urls[path]
+
+    def get(self, name: str) -> Asset | None:
+        return self._assets.get(name)
@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """In-memory LRU cache with per-entry time-to-live and single-flight loads.
+
+    The cache is bounded by entry count, by total `sizeof` of values, or both.
+    Concurrent `get_or_load` calls missing on the same key share one loader
+    call, cancelled once all of them are; failed loads are not cached.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+        on_evict: Callable[[Hashable, Any], None] | None = None,  # on evictions for room
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.bytes = 0
+        self._entries: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self._waiters: dict[asyncio.Task, int] = {}  # callers awaiting each load
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return default
+
+        expires_at, _, value = entry
+
+        if expires_at <= time.monotonic():
+            self.pop(key)
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+        # Dropped even when the new value is not stored, so it can't go stale.
+        self.pop(key)
+
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.bytes += size
+
+        while self._is_over_limit():
+            evicted_key, (_, evicted_size, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def _is_over_limit(self) -> bool:
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        value = self.get(key, _MISSING)
+
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        task = self._in_flight.get(key)
+
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(loader())
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._on_loaded, key))
+        else:
+            self.coalesced += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+
+        try:
+            # Shielded, so a cancelled caller doesn't cancel the load for the others.
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The last caller to leave cancels the load, nobody is left to use it.
+            if self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _on_loaded(self, key: Hashable, task: asyncio.Task) -> None:
+        del self._in_flight[key]
+
+        if not task.cancelled() and task.exception() is None:
+            self.set(key, task.result())
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
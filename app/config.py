@@ -1,36 +1,202 @@
+import tempfile
 from pathlib import Path
+from typing import Literal
 
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
 BASE_PATH = Path(__file__).resolve().parent
 
 
+class LLMBackend(BaseModel):
+    name: str
+    base_url: str
+    api_key: str | None = None  # defaults to `OPENAI_API_KEY`
+    model: str | None = None  # defaults to `MODEL`
+    weight: float = 1.0
+
+
 class LLMSettings(BaseSettings):
     CONTEXT_WINDOW: int = 16000
     MAX_TOKENS: int = 128
+    TOKENIZER_ENCODING: str = "o200k_base"  # `tiktoken` encoding, loaded at startup
+    TOKENIZER_LOAD_TIMEOUT: float = 10.0  # counts are estimated if it takes longer
+    TRUNCATE_OVERSIZED_PROMPTS: bool = False  # otherwise they are rejected
     TEMPERATURE: float = 0.7
     MODEL: str = "openai/gpt-5-nano" # "meta-llama/Llama-4-Scout-17B-16E-Instruct"
     # TOGETHER_API_KEY: str  # will be read from env variable
-    OPENAI_API_KEY: str  # will be read from env variable
+    OPENAI_API_KEY: str | None = None  # needed unless every backend has its own key
     BASE_URL: str = "https://api.openai.com"
+    # shared http connection pool of the llm client
+    POOL_MAX_CONNECTIONS: int = 100
+    POOL_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    POOL_KEEPALIVE_EXPIRY: float = 30.0
+    POOL_WARMUP_CONNECTIONS: int = 2
+    CONNECT_TIMEOUT: float = 5.0
+    READ_TIMEOUT: float = 60.0
+    MAX_RETRIES: int = 2
+    HTTP2: bool = False  # multiplexes requests over one connection per host
+    # Optional pool of OpenAI-compatible backends, given as json, e.g.
+    # '[{"name": "together", "base_url": "https://api.together.xyz/v1",
+    #    "api_key": "...", "model": "meta-llama/Llama-4-Scout-17B-16E-Instruct"}]'
+    BACKENDS: list[LLMBackend] = []
+    LATENCY_EWMA_ALPHA: float = 0.3
+    EXPLORE_RATIO: float = 0.05  # requests routed off the least-latency backend
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_COOLDOWN: float = 30.0  # seconds before a half-open trial request
+    HEALTH_CHECK_INTERVAL: float = 15.0
+    HEDGE_REQUESTS: bool = False  # second backend after the first misses its p95
+    HEDGE_MIN_SAMPLES: int = 20
+    # admission control of upstream calls, per worker
+    MAX_IN_FLIGHT: int = 32
+    MAX_QUEUED: int = 256
+    MAX_QUEUE_WAIT: float = 10.0  # seconds of projected wait before shedding with 503
 
 
 class WeatherAPISettings(BaseSettings):
-    OWM_API_KEY: str  # openweathermap api key
+    OWM_API_KEY: str | None = None  # openweathermap api key, only needed by /weather
     BASE_URL: str = "https://api.openweathermap.org/data/2.5/weather?"
     MAX_TOKENS: int = 128
+    OWM_REQUEST_TIMEOUT: float = 5.0  # per single location lookup
+    OWM_POOL_MAX_CONNECTIONS: int = 20
+    MAX_CONCURRENT_LOOKUPS: int = 8
+    CACHE_TTL: float = 300.0  # seconds, weather barely changes within minutes
+    CACHE_MAX_ENTRIES: int = 1024
+
+
+class ToolSettings(BaseSettings):
+    MAX_ROUNDS: int = 3  # model turns that may call tools, before the final answer
+    DEFAULT_TIMEOUT: float = 10.0  # seconds, per tool call
+    # results of cacheable tools, per tool and arguments
+    CACHE_TTL: float = 300.0
+    CACHE_MAX_ENTRIES: int = 1024
+    # tools whose output is the answer, without another LLM call to phrase it
+    RETURN_DIRECT: list[str] = []
+
+    class Config:
+        env_prefix = "TOOLS_"
+
+
+class PromptSettings(BaseSettings):
+    AUTO_RELOAD: bool | None = None  # recompile changed templates, on in development
+    INCLUDE_DATE: bool = False  # today's date in the prompt context, renews cached completions daily
+
+    class Config:
+        env_prefix = "PROMPT_"
+
+
+class CompletionCacheSettings(BaseSettings):
+    ENABLED: bool = True
+    MAX_BYTES: int = 32 * 1024 * 1024  # in-memory tier, by completion text size
+    TTL: float = 3600.0
+    DISK_PATH: str | None = None  # e.g. "cache/completions.sqlite3", shared by workers
+    DISK_MAX_ENTRIES: int = 100_000
+    CACHE_SAMPLED: bool = True  # set False to skip caching when temperature > 0
+
+    class Config:
+        env_prefix = "COMPLETION_CACHE_"
+
+
+class NearDuplicateCacheSettings(BaseSettings):
+    ENABLED: bool = False
+    THRESHOLD: float = 0.9  # estimated Jaccard similarity of prompt shingles
+    MAX_ENTRIES: int = 10_000
+    NUM_PERM: int = 64
+    BANDS: int = 8
+
+    class Config:
+        env_prefix = "NEAR_DUPLICATE_CACHE_"
+
+
+class RateLimitSettings(BaseSettings):
+    ENABLED: bool = True  # turned off for local load tests
+    # token bucket per client, charged with estimated prompt + output tokens
+    TOKENS_PER_MINUTE: int = 20_000
+    BURST_TOKENS: int = 8_000
+    CLIENT_ID_HEADER: str = "X-API-Key"  # falls back to bearer token, then ip
+    # sha256 hex digests of known client keys, other keys are limited by ip
+    API_KEY_HASHES: set[str] = set()
+    # memory-mapped bucket table shared by all workers on the host
+    SHM_PATH: str = str(Path(tempfile.gettempdir()) / "inferllamachat-ratelimit")
+    SLOTS: int = 65536
+
+    class Config:
+        env_prefix = "RATE_LIMIT_"
+
+
+class SessionSettings(BaseSettings):
+    # multi-turn conversations, kept in memory of each worker
+    MAX_BYTES: int = 64 * 1024 * 1024
+    TTL: float = 3600.0  # seconds of inactivity
+    # histories over the context window drop their oldest turns, or summarize them
+    COMPACTION: Literal["trim", "summarize"] = "trim"
+    SUMMARY_MAX_TOKENS: int = 256
+
+    class Config:
+        env_prefix = "SESSION_"
+
+
+class ReplaySettings(BaseSettings):
+    # `/stream` answers kept per worker, for clients resuming with `Last-Event-ID`
+    ENABLED: bool = True
+    MAX_BYTES: int = 32 * 1024 * 1024  # across all streams
+    TTL: float = 300.0  # seconds after the last frame
+    GRACE: float = 10.0  # seconds generation goes on with nobody reading, for a resume
+
+    class Config:
+        env_prefix = "REPLAY_"
+
 
 class ChatSettings(BaseSettings):
     OUTPUT_MIN_TOKENS: int = 0
     OUTPUT_MAX_TOKENS: int = 768
+    MAX_REQUEST_TIMEOUT: float = 120.0  # seconds, requests may only ask for less
+    DEDUPLICATE_STREAMS: bool = True  # identical concurrent streams share upstream
+    # deltas are coalesced into one SSE frame until either threshold is reached
+    SSE_FLUSH_BYTES: int = 64
+    SSE_FLUSH_INTERVAL: float = 0.05  # seconds
+    MULTI_PROMPT_MAX_PROMPTS: int = 32
+    MULTI_PROMPT_CONCURRENCY: int = 4  # prompts of one request run in parallel
+    WS_MAX_IN_FLIGHT: int = 8  # concurrent requests per WebSocket connection
+    WS_SEND_QUEUE: int = 64  # replies buffered per connection before streams pause
+
+
+class LoggingSettings(BaseSettings):
+    PROFILE: Literal["development", "production"] = "development"
+    LEVEL: str | None = None  # defaults to DEBUG in development, INFO in production
+    REQUEST_SAMPLE_RATE: float = 1.0  # share of requests whose debug logs are kept
+    REQUEST_ID_HEADER: str = "X-Request-ID"  # taken from the client or generated
+    FILE_PATH: str | None = "logs/app.log"  # warnings and errors, as json
+
+    class Config:
+        env_prefix = "LOG_"
+
+
+class ServerSettings(BaseSettings):
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    WORKERS: int = 1
+    DRAIN_TIMEOUT: float = 30.0  # seconds in-flight requests get to finish on SIGTERM
+    KEEP_ALIVE_TIMEOUT: int = 5
+
+    class Config:
+        env_prefix = "SERVER_"
 
 
 class Settings(BaseSettings):
     llm: LLMSettings = LLMSettings()
-    # TODO: fix the key error
     weather_api: WeatherAPISettings = WeatherAPISettings()
+    tools: ToolSettings = ToolSettings()
+    prompts: PromptSettings = PromptSettings()
     chat: ChatSettings = ChatSettings()
+    completion_cache: CompletionCacheSettings = CompletionCacheSettings()
+    near_duplicate_cache: NearDuplicateCacheSettings = NearDuplicateCacheSettings()
+    rate_limit: RateLimitSettings = RateLimitSettings()
+    logging: LoggingSettings = LoggingSettings()
+    sessions: SessionSettings = SessionSettings()
+    replay: ReplaySettings = ReplaySettings()
+    server: ServerSettings = ServerSettings()
 
     class Config:
         case_sensitive = True
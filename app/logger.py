@@ -1,21 +1,54 @@
+import logging
 import sys
 
 from loguru import logger
 
+from app.config import settings
+
+
+CONSOLE_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "{extra[request_id]} | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+    "<level>{message}</level>"
+)
+
+
+def _keep_record(record: dict) -> bool:
+    # Debug logs of requests left out of the sample are dropped.
+    return record["level"].no >= logging.INFO or record["extra"]["sampled"]
+
+
+def init_logging(profile: str = settings.logging.PROFILE):
+    # Production drops variable values from tracebacks (`diagnose`), as they
+    # may hold secrets, and formats messages only for records that get logged.
+    production = profile == "production"
+    level = settings.logging.LEVEL or ("INFO" if production else "DEBUG")
 
-def init_logging():
     logger.remove()
-    logger.add(sys.stdout, level="DEBUG", colorize=True, backtrace=True, diagnose=True)
+    logger.configure(extra={"request_id": "-", "sampled": True})
+    # All sinks are enqueued, so requests never wait on a write.
     logger.add(
-        "logs/app.log",
-        rotation="30 MB",
-        retention="14 days",
-        serialize=True, # Store logs in JSON format for better structure and parsing
+        sys.stdout,
+        level=level,
+        format=CONSOLE_FORMAT,
+        filter=_keep_record,
+        colorize=not production,
+        backtrace=not production,
+        diagnose=not production,
         enqueue=True,
-        compression="zip",
-        level="WARNING",
-        backtrace=True,
-        diagnose=True,
-        format="{time:MMMM D, YYYY > HH:mm:ss!UTC} | {level} | {message} | {extra}",
     )
-    logger.info("Logging has been set up successfully.")
+
+    if settings.logging.FILE_PATH:
+        logger.add(
+            settings.logging.FILE_PATH,
+            rotation="30 MB",
+            retention="14 days",
+            serialize=True, # Store logs in JSON format for better structure and parsing
+            enqueue=True,
+            compression="zip",
+            level="WARNING",
+            backtrace=True,
+            diagnose=not production,
+            format="{time:MMMM D, YYYY > HH:mm:ss!UTC} | {level} | {message} | {extra}",
+        )
+    logger.info("Logging has been set up successfully ({} profile).", profile)
@@ -1,20 +1,66 @@
-from fastapi import FastAPI, status
-from fastapi.responses import RedirectResponse
+import asyncio
+import random
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, status
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
+from app import metrics
+from app.assets import Asset, StaticAssets
 from app.logger import init_logging, logger
 from app.rate_limiting import limiter
 from app.config import settings, BASE_PATH
 from app.api import register_routes
+from app.predict import deps
+from app.predict.backends import BackendPool, create_backend_pool
+from app.predict.broadcast import stream_fanout
+from app.predict.cache import completion_cache, near_duplicate_index
+from app.predict.scheduler import ScheduledLLMClient, upstream_scheduler
+from app.predict.replay import replay_store
+from app.predict.sessions import session_store
+from app.tools.functions import weather_cache
+from app.tokens import token_counter
+from app.tools.registry import tool_registry
 
 
 TEMPLATES = Jinja2Templates(directory=str(BASE_PATH / "templates"))
+STATIC_ASSETS = StaticAssets(BASE_PATH / "static")
+REQUEST_ID = re.compile(r"[\w.-]{1,64}")  # client ids are reused only when log-safe
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.llm.BACKENDS:
+        llm_client = create_backend_pool()
+        warm_up = llm_client.start()
+    else:
+        llm_client = deps.create_llm_client()
+        warm_up = deps.warm_up_llm_client(llm_client)
+    # Connections are warmed up in the background, so startup never waits on
+    # the network. The OWM client is created on first use of the weather tool.
+    warm_up_task = asyncio.create_task(warm_up)
+    app.state.llm_client = ScheduledLLMClient(llm_client, upstream_scheduler)
+    app.state.owm_client = None
+    await token_counter.load(settings.llm.TOKENIZER_LOAD_TIMEOUT)
+    yield
+    warm_up_task.cancel()
+    await app.state.llm_client.close()
+    if app.state.owm_client is not None:
+        await app.state.owm_client.aclose()
+    completion_cache.close()
+    logger.info("LLM and OWM clients closed.")
+    await logger.complete()
+    logger.remove()  # stops the sink queues of this worker
 
-app: FastAPI = FastAPI(title="Llama4Infer ChatApp")
+
+app: FastAPI = FastAPI(title="Llama4Infer ChatApp", lifespan=lifespan)
 init_logging()
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
@@ -23,10 +69,46 @@ register_routes(app)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next: callable):
-    logger.debug(f"{request.method} {request.url}")
-    logger.debug(f"Headers: {dict(request.headers)}")
+    # The id is bound to every log record of the request, down to the tools.
+    request_id = request.headers.get(settings.logging.REQUEST_ID_HEADER, "")
+    if not REQUEST_ID.fullmatch(request_id):
+        request_id = uuid.uuid4().hex
+    sampled = random.random() < settings.logging.REQUEST_SAMPLE_RATE
+
+    with logger.contextualize(request_id=request_id, sampled=sampled):
+        if sampled:
+            logger.debug("{} {}", request.method, request.url.path)
+        response = await call_next(request)
+        if sampled:
+            logger.debug("Completed with status {}", response.status_code)
+
+    response.headers[settings.logging.REQUEST_ID_HEADER] = request_id
+    return response
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next: callable):
+    timings = {}
+    metrics.request_timings.set(timings)
+    started = time.monotonic()
     response = await call_next(request)
-    logger.debug(f"Completed with status {response.status_code}")
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+
+    # Streamed bodies are still to come, so timings only cover the time until
+    # the response started, while the duration metric waits for the body.
+    metrics.record_timing("app", time.monotonic() - started)
+    response.headers["Server-Timing"] = metrics.format_server_timing(timings)
+    metrics.HTTP_REQUESTS.labels(route, response.status_code).inc()
+    body_iterator = response.body_iterator
+
+    async def observed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            metrics.HTTP_REQUEST_DURATION.labels(route).observe(time.monotonic() - started)
+
+    response.body_iterator = observed_body()
     return response
 
 
@@ -36,17 +118,110 @@ async def root(request: Request):
     return RedirectResponse(url="/ui")
 
 
+@app.get("/health", status_code=status.HTTP_200_OK)
+async def health(request: Request):
+    return {
+        "status": "ok",
+        "llm_pool": (
+            llm_client.stats()
+            if isinstance(llm_client := request.app.state.llm_client.client, BackendPool)
+            else deps.get_llm_pool_stats(llm_client)
+        ),
+        "weather_cache": weather_cache.stats(),
+        "completion_cache": completion_cache.stats(),
+        "near_duplicate_index": near_duplicate_index and near_duplicate_index.stats(),
+        "stream_fanout": stream_fanout.stats(),
+        "upstream_scheduler": upstream_scheduler.stats(),
+        "sessions": session_store.stats(),
+        "replay": replay_store.stats(),
+        "tool_cache": tool_registry.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(request: Request):
+    # Metrics are kept per worker process, each one is scraped on its own.
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def _collect_caches(field: str) -> dict:
+    caches = {
+        "weather": weather_cache,
+        "completion": completion_cache,
+        "replay": replay_store.buffers,
+    }
+    return {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+
+for field, kind in (
+    ("hits", "counter"),
+    ("misses", "counter"),
+    ("coalesced", "counter"),
+    ("evictions", "counter"),
+    ("entries", "gauge"),
+    ("bytes", "gauge"),
+):
+    metrics.StatsCollector(
+        f"cache_{field}_total" if kind == "counter" else f"cache_{field}",
+        f"Cache {field}, of the in-memory tier.",
+        kind,
+        lambda field=field: _collect_caches(field),
+        ("cache",),
+    )
+
+metrics.StatsCollector(
+    "llm_scheduler_in_flight",
+    "Upstream LLM calls holding a slot.",
+    "gauge",
+    lambda: {(): upstream_scheduler.in_flight},
+)
+metrics.StatsCollector(
+    "llm_scheduler_queued",
+    "Upstream LLM calls waiting for a slot.",
+    "gauge",
+    lambda: {(name,): count for name, count in upstream_scheduler.stats()["queued"].items()},
+    ("priority",),
+)
+metrics.StatsCollector(
+    "llm_scheduler_shed_total",
+    "Requests shed with 503 by admission control.",
+    "counter",
+    lambda: {(): upstream_scheduler.shed},
+)
+metrics.StatsCollector(
+    "stream_fanout_attached_total",
+    "Streams attached to an upstream stream opened by an identical request.",
+    "counter",
+    lambda: {(): stream_fanout.attached},
+)
+
+
+# The page only depends on settings, so it is rendered and compressed once.
+UI_PAGE = Asset(
+    TEMPLATES.get_template("index.html")
+    .render(
+        asset=STATIC_ASSETS.url,
+        minOutTokens=settings.chat.OUTPUT_MIN_TOKENS,
+        maxOutTokens=settings.chat.OUTPUT_MAX_TOKENS,
+    )
+    .encode(),
+    "text/html; charset=utf-8",
+)
+
+
 @app.get("/ui", status_code=status.HTTP_200_OK)
 @limiter.limit("30/minute")
 async def ui(request: Request):
-    return TEMPLATES.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "minOutTokens": settings.chat.OUTPUT_MIN_TOKENS,
-            "maxOutTokens": settings.chat.OUTPUT_MAX_TOKENS,
-        },
-    )
+    return UI_PAGE.response(request)
+
+
+@app.get("/static/{name:path}", status_code=status.HTTP_200_OK)
+async def static(request: Request, name: str):
+    asset = STATIC_ASSETS.get(name)
+
+    if asset is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found.")
+    return asset.response(request)
 
 
 if "__main__" == __name__:
@@ -0,0 +1,156 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator
+
+from prometheus_client import (
+    REGISTRY,
+    Counter,
+    Histogram,
+    disable_created_metrics,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+THROUGHPUT_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Timings of the current request, sent back in its `Server-Timing` header.
+request_timings: ContextVar[dict[str, list] | None] = ContextVar(
+    "request_timings", default=None
+)
+
+# Counters are exposed without their `_created` timestamps.
+disable_created_metrics()
+
+
+class StatsCollector(Collector):
+    """Exposes values kept elsewhere, e.g. in `stats()` of caches, read at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        kind: str,
+        collect: Callable[[], dict[tuple, float]],
+        labelnames: tuple[str, ...] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.family = CounterMetricFamily if kind == "counter" else GaugeMetricFamily
+        self.read = collect
+        self.labelnames = labelnames
+        REGISTRY.register(self)
+
+    def describe(self) -> Iterator:
+        # Lets the registry check names without reading the values.
+        yield self.family(self.name, self.documentation, labels=self.labelnames)
+
+    def collect(self) -> Iterator:
+        family = self.family(self.name, self.documentation, labels=self.labelnames)
+
+        for values, value in self.read().items():
+            family.add_metric(values, value or 0)
+        yield family
+
+
+def render() -> str:
+    return generate_latest(REGISTRY).decode()
+
+
+def record_timing(name: str, seconds: float | None = None, desc: str | None = None) -> None:
+    timings = request_timings.get()
+
+    if timings is None:
+        return
+
+    # Repeated timings, e.g. two upstream calls of one request, add up.
+    entry = timings.setdefault(name, [None, None])
+    if seconds is not None:
+        entry[0] = (entry[0] or 0.0) + seconds
+    if desc is not None:
+        entry[1] = desc
+
+
+def format_server_timing(timings: dict[str, list]) -> str:
+    entries = []
+
+    for name, (seconds, desc) in timings.items():
+        entry = name
+        if seconds is not None:
+            entry += f";dur={seconds * 1000:.1f}"
+        if desc is not None:
+            entry += f';desc="{desc}"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+@contextmanager
+def timed(histogram, timing: str | None = None) -> Iterator[None]:
+    """Observe the duration of the block, and add it to the request's timings."""
+    started = time.monotonic()
+
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - started
+        histogram.observe(elapsed)
+
+        if timing is not None:
+            record_timing(timing, elapsed)
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests.", ("route", "status"))
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response body is fully sent.",
+    ("route",),
+    buckets=LATENCY_BUCKETS,
+)
+WS_REQUESTS = Counter(
+    "ws_requests_total", "Requests over WebSocket connections.", ("type", "outcome")
+)
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time spent waiting for an upstream LLM call slot.",
+    buckets=LATENCY_BUCKETS,
+)
+LLM_UPSTREAM_LATENCY = Histogram(
+    "llm_upstream_latency_seconds",
+    "Duration of upstream LLM calls, until the response headers for streams.",
+    ("stream",),
+    buckets=LATENCY_BUCKETS,
+)
+LLM_UPSTREAM_ERRORS = Counter("llm_upstream_errors_total", "Failed upstream LLM calls.", ("error",))
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from a stream request until its first delta.",
+    buckets=LATENCY_BUCKETS,
+)
+LLM_STREAM_TOKENS_PER_SECOND = Histogram(
+    "llm_stream_tokens_per_second",
+    "Output tokens per second of streams, after the first delta.",
+    buckets=THROUGHPUT_BUCKETS,
+)
+LLM_STREAMED_TOKENS = Counter("llm_streamed_tokens_total", "Output tokens streamed to clients.")
+LLM_INPUT_TOKENS = Counter(
+    "llm_input_tokens_total", "Input tokens of upstream LLM calls, by prompt template.", ("template",)
+)
+LLM_CACHED_INPUT_TOKENS = Counter(
+    "llm_cached_input_tokens_total",
+    "Input tokens served from the provider's prompt prefix cache, by prompt template.",
+    ("template",),
+)
+COMPLETION_CACHE_REQUESTS = Counter(
+    "completion_cache_requests_total",
+    "Completion cache lookups by result: hit, near_duplicate, miss or bypass.",
+    ("result",),
+)
+OWM_REQUEST_DURATION = Histogram(
+    "owm_request_duration_seconds",
+    "Duration of OpenWeatherMap calls.",
+    ("outcome",),
+    buckets=LATENCY_BUCKETS,
+)
@@ -0,0 +1,255 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Collection
+
+from fastapi import HTTPException, status
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    AsyncOpenAI,
+    AsyncStream,
+    InternalServerError,
+    RateLimitError,
+)
+
+from app.config import settings, LLMBackend
+from app.logger import logger
+from app.predict import deps
+
+
+# Errors worth failing over on; client errors would fail on any backend.
+RETRIABLE_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+
+class Backend:
+    """One OpenAI-compatible endpoint with latency tracking and a circuit breaker."""
+
+    def __init__(self, config: LLMBackend, client: AsyncOpenAI):
+        self.name = config.name
+        self.model = config.model or settings.llm.MODEL
+        self.weight = config.weight
+        self.client = client
+        self.ewma: float | None = None
+        self.latencies: deque[float] = deque(maxlen=100)
+        self.failures = 0
+        self.opened_at: float | None = None  # circuit open since
+        self.trial_in_flight = False
+        self.requests = 0
+
+    @property
+    def circuit(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < settings.llm.CIRCUIT_COOLDOWN:
+            return "open"
+        return "half-open"
+
+    def is_available(self) -> bool:
+        circuit = self.circuit
+        # A half-open circuit lets a single trial request through.
+        return circuit == "closed" or (circuit == "half-open" and not self.trial_in_flight)
+
+    def score(self) -> float:
+        # Unmeasured backends score best, so each gets explored first.
+        return (self.ewma or 0.0) / self.weight
+
+    def p95(self) -> float | None:
+        if len(self.latencies) < settings.llm.HEDGE_MIN_SAMPLES:
+            return None
+        return sorted(self.latencies)[int(len(self.latencies) * 0.95)]
+
+    def record_success(self, latency: float) -> None:
+        alpha = settings.llm.LATENCY_EWMA_ALPHA
+        self.ewma = latency if self.ewma is None else alpha * latency + (1 - alpha) * self.ewma
+        self.latencies.append(latency)
+        self.record_healthy()
+
+    def record_healthy(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+
+        if self.circuit == "half-open" or self.failures >= settings.llm.CIRCUIT_FAILURE_THRESHOLD:
+            if self.opened_at is None or self.circuit == "half-open":
+                logger.warning("Circuit of LLM backend {!r} opened.", self.name)
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "weight": self.weight,
+            "circuit": self.circuit,
+            "ewma_latency": self.ewma,
+            "p95_latency": self.p95(),
+            "requests": self.requests,
+            "consecutive_failures": self.failures,
+            "pool": deps.get_llm_pool_stats(self.client),
+        }
+
+
+class _PooledResponses:
+    def __init__(self, pool: "BackendPool"):
+        self._pool = pool
+
+    async def create(self, **kwargs) -> Any:
+        return await self._pool.create_response(**kwargs)
+
+
+class BackendPool:
+    """Routes Responses API calls over several OpenAI-compatible backends.
+
+    Picks the available backend with the lowest weighted EWMA latency (with
+    occasional weighted-random exploration), fails
+    over once on retriable errors and, when enabled, hedges a request to a
+    second backend once the first misses its p95 latency. Exposes
+    `responses.create` so it can stand in for an `AsyncOpenAI` client.
+    """
+
+    def __init__(self, backends: list[Backend]):
+        self.backends = backends
+        self.responses = _PooledResponses(self)
+        self.hedged = 0
+        self.failovers = 0
+        self._health_task: asyncio.Task | None = None
+
+    def select(self, exclude: Collection[Backend] = ()) -> Backend | None:
+        candidates = [b for b in self.backends if b not in exclude and b.is_available()]
+
+        # A small share of weighted-random picks keeps the other latencies fresh.
+        if len(candidates) > 1 and random.random() < settings.llm.EXPLORE_RATIO:
+            return random.choices(candidates, weights=[b.weight for b in candidates])[0]
+        return min(candidates, key=Backend.score, default=None)
+
+    async def _call(self, backend: Backend, kwargs: dict) -> Any:
+        half_open = backend.circuit == "half-open"
+        backend.trial_in_flight = half_open
+        backend.requests += 1
+        started = time.monotonic()
+
+        try:
+            # For streams this measures the time until the response headers.
+            result = await backend.client.responses.create(**{**kwargs, "model": backend.model})
+        except RETRIABLE_ERRORS:
+            backend.record_failure()
+            raise
+        finally:
+            if half_open:
+                backend.trial_in_flight = False
+
+        backend.record_success(time.monotonic() - started)
+        return result
+
+    async def create_response(self, **kwargs) -> Any:
+        primary = self.select()
+
+        if primary is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="No LLM backend available.",
+            )
+
+        # Backends called so far, the hedged one included, none is tried twice.
+        tried = [primary]
+
+        try:
+            return await self._call_hedged(tried, kwargs)
+        except RETRIABLE_ERRORS as exc:
+            secondary = self.select(exclude=tried)
+
+            if secondary is None:
+                raise
+            logger.warning("LLM backend {!r} failed ({!r}), failing over.", primary.name, exc)
+            self.failovers += 1
+            return await self._call(secondary, kwargs)
+
+    async def _call_hedged(self, tried: list[Backend], kwargs: dict) -> Any:
+        primary = tried[0]
+        deadline = primary.p95() if settings.llm.HEDGE_REQUESTS else None
+
+        if deadline is None:
+            return await self._call(primary, kwargs)
+
+        first = asyncio.create_task(self._call(primary, kwargs))
+        done, _ = await asyncio.wait((first,), timeout=deadline)
+        secondary = None if done else self.select(exclude=tried)
+
+        if secondary is None:
+            return await first
+
+        tried.append(secondary)
+        self.hedged += 1
+        second = asyncio.create_task(self._call(secondary, kwargs))
+        pending, winner = {first, second}, None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if not task.exception()), None)
+
+                if winner is not None:
+                    return winner.result()
+            # Both failed, report the primary's error.
+            return first.result()
+        finally:
+            for task in (first, second):
+                if task is not winner:
+                    await self._discard(task)
+
+    @staticmethod
+    async def _discard(task: asyncio.Task) -> None:
+        # The losing request is cancelled, or closed if its stream already opened.
+        task.cancel()
+
+        try:
+            result = await task
+        except (asyncio.CancelledError, Exception):
+            return
+
+        if isinstance(result, AsyncStream):
+            await result.close()
+
+    async def _check_health(self) -> None:
+        while True:
+            await asyncio.sleep(settings.llm.HEALTH_CHECK_INTERVAL)
+
+            for backend in self.backends:
+                try:
+                    await backend.client.models.list(timeout=settings.llm.CONNECT_TIMEOUT)
+                except (APIConnectionError, APIStatusError) as exc:
+                    logger.warning(
+                        "Health check of LLM backend {!r} failed: {!r}", backend.name, exc
+                    )
+                    backend.record_failure()
+                else:
+                    backend.record_healthy()
+
+    async def start(self) -> None:
+        await asyncio.gather(*(deps.warm_up_llm_client(b.client) for b in self.backends))
+        self._health_task = asyncio.create_task(self._check_health())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+
+        for backend in self.backends:
+            await backend.client.close()
+
+    def stats(self) -> dict:
+        return {
+            "hedged": self.hedged,
+            "failovers": self.failovers,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
+
+
+def create_backend_pool() -> BackendPool:
+    return BackendPool(
+        [
+            Backend(config, deps.create_llm_client(config.base_url, config.api_key))
+            for config in settings.llm.BACKENDS
+        ]
+    )
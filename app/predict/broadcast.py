@@ -0,0 +1,176 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from app.logger import logger
+
+
+class StreamBroadcast:
+    """One upstream event stream fanned out to any number of subscribers.
+
+    Events are kept in a shared history and every subscriber reads it through
+    its own cursor, so late joiners replay the already emitted prefix and a
+    slow subscriber only lags behind itself instead of stalling the others.
+    The history is bounded by the output token limit of the upstream request.
+    """
+
+    def __init__(self, open_source: Callable[[], Awaitable[AsyncIterator]]):
+        self._history: list[Any] = []
+        self._new_events = asyncio.Event()
+        self._finished = False
+        self._error: BaseException | None = None
+        self.subscribers = 0
+        self._cancelled = False  # all subscribers left, the upstream is being cancelled
+        self.started: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._run(open_source))
+
+    @property
+    def finished(self) -> bool:
+        return self._finished or self._cancelled
+
+    async def _run(self, open_source: Callable[[], Awaitable[AsyncIterator]]) -> None:
+        try:
+            source = await open_source()
+        except asyncio.CancelledError:
+            self.started.cancel()
+            self._finish(RuntimeError("Upstream stream cancelled."))
+            raise
+        except Exception as exc:
+            self.started.set_exception(exc)
+            self._finish(exc)
+            return
+
+        self.started.set_result(None)
+
+        try:
+            async with source:
+                async for event in source:
+                    self._history.append(event)
+                    self._notify()
+        except asyncio.CancelledError:
+            # Readers attached meanwhile must not take the cut-off stream for a whole one.
+            self._finish(RuntimeError("Upstream stream cancelled."))
+            raise
+        except Exception as exc:
+            logger.error("Upstream stream failed: {!r}", exc)
+            self._finish(exc)
+        else:
+            self._finish(None)
+
+    def _notify(self) -> None:
+        self._new_events.set()
+        self._new_events = asyncio.Event()
+
+    def _finish(self, error: BaseException | None) -> None:
+        self._finished = True
+        self._error = error
+        self._notify()
+
+    def subscribe(self) -> "Subscription":
+        return Subscription(self)
+
+    def _release(self) -> None:
+        self.subscribers -= 1
+
+        # Nobody is reading anymore, so stop paying for upstream tokens.
+        if self.subscribers == 0 and not self._finished:
+            self._cancelled = True
+            self._task.cancel()
+
+
+class Subscription:
+    """A subscriber's cursor into a `StreamBroadcast`.
+
+    Counted from its creation rather than from its first read, so that the
+    upstream outlives no subscription: each is released explicitly, by its
+    reader on `aclose`, or by its owner with `release_unread` when no reader
+    took it over, e.g. when the client left before the response started.
+    """
+
+    def __init__(self, broadcast: StreamBroadcast):
+        self._broadcast = broadcast
+        self._cursor = 0
+        self._released = False
+        self._claimed = False  # iterated, so closed by its reader
+        broadcast.subscribers += 1
+
+    def __aiter__(self) -> "Subscription":
+        self._claimed = True
+        return self
+
+    async def __anext__(self) -> Any:
+        broadcast = self._broadcast
+
+        while True:
+            new_events = broadcast._new_events
+
+            if self._cursor < len(broadcast._history):
+                self._cursor += 1
+                return broadcast._history[self._cursor - 1]
+
+            if broadcast._finished:
+                self.release()
+                if broadcast._error is not None:
+                    raise broadcast._error
+                raise StopAsyncIteration
+
+            await new_events.wait()
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._broadcast._release()
+
+    async def aclose(self) -> None:
+        self.release()
+
+    async def release_unread(self) -> None:
+        if not self._claimed:
+            self.release()
+
+
+class StreamFanout:
+    """Registry attaching identical concurrent requests to one `StreamBroadcast`."""
+
+    def __init__(self):
+        self._broadcasts: dict[str, StreamBroadcast] = {}
+        self.opened = 0
+        self.attached = 0
+
+    async def subscribe(
+        self, key: str, open_source: Callable[[], Awaitable[AsyncIterator]]
+    ) -> Subscription:
+        broadcast = self._broadcasts.get(key)
+
+        if broadcast is None or broadcast.finished:
+            broadcast = StreamBroadcast(open_source)
+            self._broadcasts[key] = broadcast
+            broadcast._task.add_done_callback(lambda _: self._discard(key, broadcast))
+            self.opened += 1
+        else:
+            self.attached += 1
+
+        # Counted at once, so that the upstream outlives neither a caller cancelled
+        # while it opens nor a subscription never read.
+        subscription = broadcast.subscribe()
+
+        try:
+            # Errors opening the upstream stream are raised before the response starts.
+            await asyncio.shield(broadcast.started)
+        except BaseException:
+            subscription.release()
+            raise
+        return subscription
+
+    def _discard(self, key: str, broadcast: StreamBroadcast) -> None:
+        if self._broadcasts.get(key) is broadcast:
+            del self._broadcasts[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._broadcasts),
+            "opened": self.opened,
+            "attached": self.attached,
+        }
+
+
+stream_fanout = StreamFanout()
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from app.cache import TTLCache
+from app.config import settings
+from app.logger import logger
+from app.predict.similarity import MinHashLSHIndex
+
+
+class SQLiteStore:
+    """Persistent key-value tier shared by all workers on one host.
+
+    WAL journaling lets several processes read while one writes. Methods are
+    blocking and meant to be run in a worker thread.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM completions WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl),
+            )
+            self._writes += 1
+
+            if self._writes % 100 == 0:
+                self._prune()
+
+            self._conn.commit()
+
+    def _prune(self) -> None:
+        # Drop expired rows, then the soonest-expiring ones above the size limit.
+        self._conn.execute("DELETE FROM completions WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM completions WHERE key IN ("
+            "SELECT key FROM completions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CompletionCache:
+    """Exact-match cache of model completions: in-memory LRU over optional SQLite."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: float,
+        disk_path: str | None = None,
+        disk_max_entries: int = 100_000,
+    ):
+        # Bounded by the UTF-8 size of completions, not their length in characters.
+        self.memory = TTLCache(
+            ttl=ttl, max_bytes=max_bytes, sizeof=lambda value: len(value.encode())
+        )
+        self.disk = SQLiteStore(disk_path, ttl, disk_max_entries) if disk_path else None
+        self.disk_hits = 0
+
+    @staticmethod
+    def make_key(
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        temperature: float,
+    ) -> str:
+        payload = json.dumps(
+            [model, system_prompt, user_prompt, max_tokens, temperature],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def _disk_get(self, key: str) -> str | None:
+        # A failed read is a miss, the completion is then created again.
+        try:
+            return await asyncio.to_thread(self.disk.get, key)
+        except sqlite3.Error as exc:
+            logger.warning("Completion cache disk read failed: {!r}", exc)
+            return None
+
+    async def get(self, key: str) -> str | None:
+        value = self.memory.get(key)
+
+        if value is None and self.disk is not None:
+            value = await self._disk_get(key)
+
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        return value
+
+    async def get_or_create(
+        self, key: str, create: Callable[[], Awaitable[str]]
+    ) -> str:
+        async def load() -> str:
+            if self.disk is not None:
+                value = await self._disk_get(key)
+
+                if value is not None:
+                    self.disk_hits += 1
+                    return value
+
+            value = await create()
+
+            if self.disk is not None:
+                try:
+                    await asyncio.to_thread(self.disk.set, key, value)
+                except sqlite3.Error as exc:
+                    logger.warning("Completion cache disk write failed: {!r}", exc)
+            return value
+
+        # Identical concurrent requests share one upstream call.
+        return await self.memory.get_or_load(key, load)
+
+    def stats(self) -> dict:
+        return {
+            **self.memory.stats(),
+            "disk_enabled": self.disk is not None,
+            "disk_hits": self.disk_hits,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+
+completion_cache = CompletionCache(
+    max_bytes=settings.completion_cache.MAX_BYTES,
+    ttl=settings.completion_cache.TTL,
+    disk_path=settings.completion_cache.DISK_PATH,
+    disk_max_entries=settings.completion_cache.DISK_MAX_ENTRIES,
+)
+
+near_duplicate_index = (
+    MinHashLSHIndex(
+        threshold=settings.near_duplicate_cache.THRESHOLD,
+        max_entries=settings.near_duplicate_cache.MAX_ENTRIES,
+        num_perm=settings.near_duplicate_cache.NUM_PERM,
+        bands=settings.near_duplicate_cache.BANDS,
+    )
+    if settings.near_duplicate_cache.ENABLED
+    else None
+)
@@ -0,0 +1,263 @@
+import asyncio
+import contextlib
+import json
+import uuid
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import BaseModel, ValidationError
+
+from app import metrics
+from app.config import settings
+from app.logger import logger
+from app.predict import deps
+from app.predict.deps import HTTP_499_CLIENT_CLOSED_REQUEST
+from app.predict.scheduler import Priority, upstream_context
+from app.predict.schemas import ChatInput, StructuredInput, WeatherInput
+from app.predict.service import (
+    get_chat_inference_batch,
+    get_chat_inference_stream,
+    get_chat_inference_weather_stream,
+    get_structured_inference_stream,
+)
+from app.predict.structured import schema_registry
+from app.rate_limiting import charge_tokens, get_client_id
+from app.tokens import token_counter
+
+
+INPUTS: dict[str, type[BaseModel]] = {
+    "batch": ChatInput,
+    "stream": ChatInput,
+    "weather": WeatherInput,
+    "structured": StructuredInput,
+}
+
+
+def parse_sse(frame: str) -> tuple[str, str]:
+    # Frames come from `format_sse`: one event line, one line of JSON data.
+    event, _, data = frame.partition("\n")
+    return event.removeprefix("event: "), data.removeprefix("data: ").rstrip("\n")
+
+
+class ChatChannel:
+    """Many concurrent chat requests multiplexed over one WebSocket.
+
+    Clients send `{"id", "type", "input"}` messages, with `type` one of
+    `batch`, `stream`, `weather` or `structured` and `input` the body of the
+    matching endpoint, and `{"id", "type": "cancel"}` to cancel one. Every
+    reply is tagged with its request id: `{"id", "event", "data"}`, with the
+    same events as the SSE endpoints, `result` for batch answers and
+    `cancelled` for cancelled requests.
+
+    Flow control: a connection runs at most `WS_MAX_IN_FLIGHT` requests at a
+    time. Backpressure: replies go through a bounded queue drained by one
+    writer, so a client that reads slowly pauses the upstream streams that
+    feed it instead of having replies pile up in memory.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.connection_id = uuid.uuid4().hex[:12]
+        self.client_id = get_client_id(websocket)
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.chat.WS_SEND_QUEUE)
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._started: set[str] = set()  # requests whose handler began running
+        self._closing = False
+
+    async def run(self) -> None:
+        await self.websocket.accept()
+        writer = asyncio.create_task(self._write())
+
+        try:
+            with logger.contextualize(request_id=self.connection_id):
+                logger.debug("WebSocket connected")
+                await self._read()
+        except WebSocketDisconnect:
+            logger.debug("WebSocket {} disconnected", self.connection_id)
+        finally:
+            # Requests cancelled here have no one left to tell.
+            self._closing = True
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            # The writer may have failed already, sending to a client that was gone.
+            writer.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await writer
+
+    async def _write(self) -> None:
+        while True:
+            await self.websocket.send_text(await self._outbox.get())
+
+    async def send(self, request_id: str, event: str, data: dict | str) -> None:
+        # Data already serialized, as from SSE frames, is passed through as is.
+        data = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        await self._outbox.put(
+            f'{{"id": {json.dumps(request_id)}, "event": "{event}", "data": {data}}}'
+        )
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = json.loads(await self.websocket.receive_text())
+                request_id = str(message["id"])
+                kind = message["type"]
+            except (ValueError, KeyError, TypeError):
+                await self.send("", "error", {"status_code": 400, "message": "Malformed message."})
+                continue
+
+            if kind == "cancel":
+                task = self._tasks.get(request_id)
+                if task is not None:
+                    task.cancel()
+
+                    # A task cancelled before its first step never runs `_handle`,
+                    # so the reply is sent from here.
+                    if request_id not in self._started:
+                        metrics.WS_REQUESTS.labels(task.get_name(), "cancelled").inc()
+                        await self.send(
+                            request_id, "cancelled", {"status_code": HTTP_499_CLIENT_CLOSED_REQUEST}
+                        )
+            elif request_id in self._tasks:
+                await self.send(
+                    request_id, "error", {"status_code": 409, "message": "Duplicate request id."}
+                )
+            elif len(self._tasks) >= settings.chat.WS_MAX_IN_FLIGHT:
+                await self.send(
+                    request_id,
+                    "error",
+                    {
+                        "status_code": status.HTTP_429_TOO_MANY_REQUESTS,
+                        "message": "Too many concurrent requests on this connection.",
+                    },
+                )
+            elif kind not in INPUTS:
+                await self.send(
+                    request_id, "error", {"status_code": 400, "message": "Unknown request type."}
+                )
+            else:
+                task = asyncio.create_task(
+                    self._handle(request_id, kind, message.get("input", {})), name=kind
+                )
+                self._tasks[request_id] = task
+                task.add_done_callback(lambda _, request_id=request_id: self._done(request_id))
+
+    def _done(self, request_id: str) -> None:
+        self._tasks.pop(request_id)
+        self._started.discard(request_id)
+
+    async def _handle(self, request_id: str, kind: str, payload: dict) -> None:
+        self._started.add(request_id)
+        outcome = "ok"
+
+        with logger.contextualize(request_id=f"{self.connection_id}:{request_id}"):
+            try:
+                chat_input = INPUTS[kind].model_validate(payload)
+
+                async with asyncio.timeout(chat_input.timeout):
+                    await self._dispatch(request_id, kind, chat_input)
+            except ValidationError as exc:
+                outcome = "invalid"
+                await self.send(
+                    request_id,
+                    "error",
+                    {
+                        "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        "message": "Invalid input.",
+                        "errors": exc.errors(
+                            include_url=False, include_context=False, include_input=False
+                        ),
+                    },
+                )
+            except HTTPException as exc:
+                outcome = "error"
+                await self.send(
+                    request_id, "error", {"status_code": exc.status_code, "message": exc.detail}
+                )
+            except TimeoutError:
+                outcome = "timeout"
+                await self.send(
+                    request_id,
+                    "error",
+                    {"status_code": status.HTTP_504_GATEWAY_TIMEOUT, "message": "Request timed out."},
+                )
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                if not self._closing:
+                    await self.send(
+                        request_id, "cancelled", {"status_code": HTTP_499_CLIENT_CLOSED_REQUEST}
+                    )
+                raise
+            except Exception as exc:
+                outcome = "error"
+                logger.error("Error occured during WebSocket request: {!r}", exc)
+                await self.send(
+                    request_id,
+                    "error",
+                    {"status_code": status.HTTP_502_BAD_GATEWAY, "message": "Generation failed."},
+                )
+            finally:
+                metrics.WS_REQUESTS.labels(kind, outcome).inc()
+
+    async def _dispatch(self, request_id: str, kind: str, chat_input: BaseModel) -> None:
+        # Same admission as the HTTP endpoints, minus the per-request overhead.
+        llm_client = self.websocket.app.state.llm_client
+        priority = Priority.BATCH if kind == "batch" else Priority.INTERACTIVE
+        upstream_context.set((self.client_id, priority))
+
+        if kind == "batch":
+            session = deps.get_session(self.websocket, chat_input.session_id)
+            charge_tokens(
+                self.websocket, token_counter.count(chat_input.user_prompt) + chat_input.max_tokens
+            )
+            output = await get_chat_inference_batch(
+                chat_input.user_prompt,
+                chat_input.max_tokens,
+                llm_client=llm_client,
+                use_cache=chat_input.use_cache,
+                session=session,
+            )
+            await self.send(request_id, "result", {"output": output})
+            return
+
+        if kind == "stream":
+            session = deps.get_session(self.websocket, chat_input.session_id)
+            charge_tokens(
+                self.websocket, token_counter.count(chat_input.user_prompt) + chat_input.max_tokens
+            )
+            response = await get_chat_inference_stream(
+                chat_input.user_prompt,
+                chat_input.max_tokens,
+                llm_client=llm_client,
+                use_cache=chat_input.use_cache,
+                session=session,
+            )
+        elif kind == "weather":
+            owm_client = deps.get_owm_client(self.websocket)
+            charge_tokens(
+                self.websocket,
+                2 * token_counter.count(chat_input.user_prompt)
+                + settings.weather_api.MAX_TOKENS
+                + chat_input.max_tokens,
+            )
+            response = await get_chat_inference_weather_stream(
+                chat_input.user_prompt,
+                chat_input.max_tokens,
+                llm_client=llm_client,
+                owm_client=owm_client,
+            )
+        else:
+            schema = schema_registry.get(chat_input.schema_name)
+            if schema is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Schema not found.")
+            charge_tokens(
+                self.websocket, token_counter.count(chat_input.user_prompt) + chat_input.max_tokens
+            )
+            response = await get_structured_inference_stream(
+                chat_input.user_prompt, schema, chat_input.max_tokens, llm_client=llm_client
+            )
+
+        # The SSE frames of the HTTP endpoints, re-tagged with the request id.
+        async with contextlib.aclosing(response.body_iterator) as frames:
+            async for frame in frames:
+                event, data = parse_sse(frame)
+                await self.send(request_id, event, data)
@@ -1,47 +1,170 @@
-from fastapi import APIRouter, Request, Depends, status, HTTPException
+import json
+import time
+
+from fastapi import APIRouter, Request, Depends, Header, status, HTTPException, WebSocket
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
 from openai import AsyncOpenAI
 
-from app.rate_limiting import limiter
+from app.config import settings
+from app.rate_limiting import charge_tokens, get_client_id, limiter
 from app.predict import deps
-from app.predict.schemas import ChatInput, WeatherInput
+from app.predict.channel import ChatChannel
+from app.predict.replay import replay_store
+from app.predict.scheduler import Priority, upstream_context
+from app.predict.schemas import ChatInput, MultiChatInput, StructuredInput, WeatherInput
 from app.predict.service import (
     get_chat_inference_batch,
+    get_chat_inference_multi,
     get_chat_inference_stream,
     get_chat_inference_weather,
+    get_chat_inference_weather_stream,
+    get_structured_inference_stream,
 )
+from app.predict.sessions import session_store
+from app.predict.structured import schema_registry
 from app.logger import logger
+from app.tokens import token_counter
 
 
 router = APIRouter()
 
 
+@router.post("/sessions", status_code=status.HTTP_201_CREATED)
+@limiter.limit("10/minute")
+async def create_session(request: Request):
+    session = session_store.create(get_client_id(request))
+    return {"session_id": session.id}
+
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_session(request: Request, session_id: str):
+    if not session_store.delete(session_id, get_client_id(request)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found.")
+
+
 @router.post("/batch", status_code=status.HTTP_200_OK, response_model=str)
 @limiter.limit("6/minute")
 async def run_chat_inference_batch(
     request: Request,
     chat_input: ChatInput,
-    llm_client: AsyncOpenAI | None = Depends(deps.get_llm_client),
+    llm_client: AsyncOpenAI = Depends(deps.get_llm_client),
 ):
+    session = deps.get_session(request, chat_input.session_id)
+    charge_tokens(
+        request, token_counter.count(chat_input.user_prompt) + chat_input.max_tokens
+    )
+    upstream_context.set((get_client_id(request), Priority.BATCH))
+    deadline = time.monotonic() + chat_input.timeout
+
     try:
-        model_response = await get_chat_inference_batch(
-            chat_input.user_prompt, chat_input.max_tokens, llm_client=llm_client
+        model_response = await deps.run_until_disconnected(
+            request,
+            get_chat_inference_batch(
+                chat_input.user_prompt,
+                chat_input.max_tokens,
+                llm_client=llm_client,
+                use_cache=chat_input.use_cache,
+                session=session,
+            ),
+            deadline,
         )
     except HTTPException as exc:
-        logger.error(f"Error occured during batch inference: {exc.detail}")
+        logger.error("Error occured during batch inference: {}", exc.detail)
         raise exc
 
     return model_response
 
 
+@router.post("/multi", status_code=status.HTTP_200_OK, response_model=str)
+@limiter.limit("2/minute")
+async def run_chat_inference_multi(
+    request: Request,
+    multi_input: MultiChatInput,
+    llm_client: AsyncOpenAI = Depends(deps.get_llm_client),
+):
+    charge_tokens(
+        request,
+        sum(token_counter.count(prompt) for prompt in multi_input.user_prompts)
+        + len(multi_input.user_prompts) * multi_input.max_tokens,
+    )
+    upstream_context.set((get_client_id(request), Priority.BATCH))
+    deadline = time.monotonic() + multi_input.timeout
+    response = await get_chat_inference_multi(
+        multi_input.user_prompts,
+        multi_input.max_tokens,
+        llm_client=llm_client,
+        use_cache=multi_input.use_cache,
+    )
+    # Results go out as ndjson lines, in the order the prompts complete.
+    response.body_iterator = deps.guard_stream(
+        request,
+        response.body_iterator,
+        deadline,
+        timeout_frame=json.dumps(
+            {"status_code": status.HTTP_504_GATEWAY_TIMEOUT, "error": "Request timed out."}
+        )
+        + "\n",
+    )
+
+    return response
+
+
 @router.post("/stream", status_code=status.HTTP_200_OK, response_model=str)
 @limiter.limit("6/minute")
 async def run_chat_inference_stream(
     request: Request,
     chat_input: ChatInput,
-    llm_client: AsyncOpenAI | None = Depends(deps.get_llm_client),
+    llm_client: AsyncOpenAI = Depends(deps.get_llm_client),
 ):
-    return await get_chat_inference_stream(
-        chat_input.user_prompt, chat_input.max_tokens, llm_client=llm_client
+    session = deps.get_session(request, chat_input.session_id)
+    charge_tokens(
+        request, token_counter.count(chat_input.user_prompt) + chat_input.max_tokens
+    )
+    upstream_context.set((get_client_id(request), Priority.INTERACTIVE))
+    deadline = time.monotonic() + chat_input.timeout
+    response = await deps.run_until_disconnected(
+        request,
+        get_chat_inference_stream(
+            chat_input.user_prompt,
+            chat_input.max_tokens,
+            llm_client=llm_client,
+            use_cache=chat_input.use_cache,
+            session=session,
+        ),
+        deadline,
+    )
+
+    if settings.replay.ENABLED:
+        # Generated in the background from here on, whether the client stays or not.
+        buffer = replay_store.start(get_client_id(request), response.body_iterator, deadline)
+        response.body_iterator = buffer.subscribe()
+        response.headers["X-Stream-ID"] = buffer.id
+
+    # The deadline and disconnects keep applying while the answer streams.
+    response.body_iterator = deps.guard_stream(request, response.body_iterator, deadline)
+
+    return response
+
+
+@router.get("/stream/{stream_id}", status_code=status.HTTP_200_OK, response_model=str)
+@limiter.limit("30/minute")
+async def resume_chat_inference_stream(
+    request: Request,
+    stream_id: str,
+    last_event_id: str | None = Header(None),
+):
+    # Frames after `Last-Event-ID`, replayed then followed live; nothing is generated again.
+    frames = replay_store.resume(stream_id, get_client_id(request), last_event_id)
+
+    if frames is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found.")
+
+    deadline = time.monotonic() + settings.chat.MAX_REQUEST_TIMEOUT
+    return StreamingResponse(
+        deps.guard_stream(request, frames, deadline),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Stream-ID": stream_id},
     )
 
 
@@ -50,16 +173,112 @@ async def run_chat_inference_stream(
 async def run_chat_inference_weather(
     request: Request,
     weather_input: WeatherInput,
-    llm_client: AsyncOpenAI | None = Depends(deps.get_llm_client),
+    llm_client: AsyncOpenAI = Depends(deps.get_llm_client),
+    owm_client: AsyncClient = Depends(deps.get_owm_client),
 ):
+    # Tool calling usually takes two llm round-trips, the first one capped separately.
+    charge_tokens(
+        request,
+        2 * token_counter.count(weather_input.user_prompt)
+        + settings.weather_api.MAX_TOKENS
+        + weather_input.max_tokens,
+    )
+    upstream_context.set((get_client_id(request), Priority.BATCH))
+    deadline = time.monotonic() + weather_input.timeout
+
     try:
-        model_response =  await get_chat_inference_weather(
-            weather_input.user_prompt,
-            weather_input.max_tokens,
-            llm_client=llm_client,
+        # The deadline covers all LLM calls and the tool calls in between.
+        model_response = await deps.run_until_disconnected(
+            request,
+            get_chat_inference_weather(
+                weather_input.user_prompt,
+                weather_input.max_tokens,
+                llm_client=llm_client,
+                owm_client=owm_client,
+            ),
+            deadline,
         )
     except HTTPException as exc:
-        logger.error(f"Error occured during weather inference: {exc.detail}")
+        logger.error("Error occured during weather inference: {}", exc.detail)
         raise exc
 
     return model_response
+
+
+@router.post("/weather/stream", status_code=status.HTTP_200_OK, response_model=str)
+@limiter.limit("4/minute")
+async def run_chat_inference_weather_stream(
+    request: Request,
+    weather_input: WeatherInput,
+    llm_client: AsyncOpenAI = Depends(deps.get_llm_client),
+    owm_client: AsyncClient = Depends(deps.get_owm_client),
+):
+    charge_tokens(
+        request,
+        2 * token_counter.count(weather_input.user_prompt)
+        + settings.weather_api.MAX_TOKENS
+        + weather_input.max_tokens,
+    )
+    upstream_context.set((get_client_id(request), Priority.INTERACTIVE))
+    deadline = time.monotonic() + weather_input.timeout
+    response = await deps.run_until_disconnected(
+        request,
+        get_chat_inference_weather_stream(
+            weather_input.user_prompt,
+            weather_input.max_tokens,
+            llm_client=llm_client,
+            owm_client=owm_client,
+        ),
+        deadline,
+    )
+    # Tool progress is streamed as `tool` events, ahead of the answer deltas.
+    response.body_iterator = deps.guard_stream(request, response.body_iterator, deadline)
+
+    return response
+
+
+@router.get("/structured/schemas", status_code=status.HTTP_200_OK)
+async def list_structured_schemas():
+    return {
+        name: schema_registry.get(name).json_schema for name in schema_registry.names()
+    }
+
+
+@router.post("/structured", status_code=status.HTTP_200_OK, response_model=str)
+@limiter.limit("6/minute")
+async def run_structured_inference(
+    request: Request,
+    structured_input: StructuredInput,
+    llm_client: AsyncOpenAI = Depends(deps.get_llm_client),
+):
+    schema = schema_registry.get(structured_input.schema_name)
+
+    if schema is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Schema not found.")
+
+    charge_tokens(
+        request,
+        token_counter.count(structured_input.user_prompt) + structured_input.max_tokens,
+    )
+    upstream_context.set((get_client_id(request), Priority.INTERACTIVE))
+    deadline = time.monotonic() + structured_input.timeout
+    response = await deps.run_until_disconnected(
+        request,
+        get_structured_inference_stream(
+            structured_input.user_prompt,
+            schema,
+            structured_input.max_tokens,
+            llm_client=llm_client,
+        ),
+        deadline,
+    )
+    # Fields are sent as `field` events as soon as they close, then the whole object.
+    response.body_iterator = deps.guard_stream(request, response.body_iterator, deadline)
+
+    return response
+
+
+@router.websocket("/ws")
+async def chat_channel(websocket: WebSocket):
+    # One connection carries many concurrent requests, see `ChatChannel`.
+    await ChatChannel(websocket).run()
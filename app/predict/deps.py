@@ -1,35 +1,349 @@
-from typing import AsyncGenerator
-from openai import AsyncOpenAI
+import asyncio
+import json
+import time
+from typing import AsyncGenerator, Awaitable, Callable, TypeVar
+from fastapi import HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from openai import AsyncOpenAI, AsyncStream, DefaultAsyncHttpxClient
+from starlette.types import Receive, Scope, Send
 import contextlib
+import httpx
 
+from app import metrics
 from app.config import settings
 from app.logger import logger
+from app.predict.sessions import Session, session_store
+from app.rate_limiting import get_client_id
+from app.tokens import token_counter
+from app.tools.functions import create_owm_client
 
 
-async def get_llm_client() -> AsyncGenerator[AsyncOpenAI, None]:
+T = TypeVar("T")
+HTTP_499_CLIENT_CLOSED_REQUEST = 499  # nginx convention, the client is gone anyway
+
+
+def create_llm_client(
+    base_url: str | None = None, api_key: str | None = None
+) -> AsyncOpenAI:
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.llm.POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.llm.POOL_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.llm.POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            settings.llm.READ_TIMEOUT, connect=settings.llm.CONNECT_TIMEOUT
+        ),
+        http2=settings.llm.HTTP2,
+    )
     client = AsyncOpenAI(
-        api_key=settings.llm.OPENAI_API_KEY, base_url=settings.llm.BASE_URL
+        api_key=api_key or settings.llm.OPENAI_API_KEY,
+        base_url=base_url or settings.llm.BASE_URL,
+        http_client=http_client,
+        max_retries=settings.llm.MAX_RETRIES,
     )
     logger.info("LLM client initialized successfully.")
-    yield client
+    return client
+
+
+async def warm_up_llm_client(client: AsyncOpenAI) -> None:
+    # Concurrent requests force the pool to open (and TLS handshake) separate
+    # connections, which are then kept alive for the first real requests.
+    async def open_connection() -> None:
+        try:
+            await client._client.head(str(client.base_url))
+        except httpx.HTTPError as exc:
+            logger.warning("LLM connection warm-up failed: {!r}", exc)
+
+    await asyncio.gather(
+        *(open_connection() for _ in range(settings.llm.POOL_WARMUP_CONNECTIONS))
+    )
+    logger.opt(lazy=True).info("LLM client warmed up: {}", lambda: get_llm_pool_stats(client))
+
+
+def get_llm_pool_stats(client: AsyncOpenAI) -> dict:
+    # httpx does not expose pool state publicly, so read it from the transport.
+    pool = getattr(getattr(client._client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for conn in connections if conn.is_idle())
+
+    return {
+        "connections": len(connections),
+        "in_use": len(connections) - idle,
+        "idle": idle,
+        "max_connections": settings.llm.POOL_MAX_CONNECTIONS,
+        "max_keepalive_connections": settings.llm.POOL_MAX_KEEPALIVE_CONNECTIONS,
+        "http2": settings.llm.HTTP2,
+    }
+
+
+def get_llm_client(request: Request) -> AsyncOpenAI:
+    # The client is shared process-wide and owned by the app lifespan.
+    return request.app.state.llm_client
+
+
+def get_session(request: Request, session_id: str | None) -> Session | None:
+    if session_id is None:
+        return None
+
+    session = session_store.get(session_id, get_client_id(request))
+
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found.")
+    return session
+
+
+def get_owm_client(request: Request) -> httpx.AsyncClient:
+    # Created on first use, so the weather tool needs no configuration until then.
+    if not settings.weather_api.OWM_API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Weather tool is not configured.",
+        )
+
+    if getattr(request.app.state, "owm_client", None) is None:
+        request.app.state.owm_client = create_owm_client()
+    return request.app.state.owm_client
+
+
+async def stream_events(stream: AsyncStream) -> AsyncGenerator:
+    # Async generator wrapper, so that `aclosing` also closes the upstream stream.
+    async with stream:
+        async for event in stream:
+            yield event
+
+
+def format_sse(data: dict, event: str = "message") -> str:
+    # JSON keeps newlines in the model output from breaking the SSE framing.
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
 async def stream_generator(
     response: AsyncGenerator,
+    max_tokens: int = settings.chat.OUTPUT_MAX_TOKENS,  # as enforced upstream
+    flush_bytes: int = settings.chat.SSE_FLUSH_BYTES,
+    flush_interval: float = settings.chat.SSE_FLUSH_INTERVAL,
+    started: float | None = None,  # when the request came in, for time-to-first-token
+    on_done: Callable[[str, int], None] | None = None,  # gets the full text and tokens
 ) -> AsyncGenerator[str, None]:
+    started = time.monotonic() if started is None else started
+    text: list[str] = []
+    first_delta_at: float | None = None
     tokens_count = 0
+    counted_upstream = False  # the provider's count, rather than a local estimate
+    buffer: list[str] = []
+    buffered_bytes = 0
+    flush_at: float | None = None  # when the oldest buffered delta is due
+    first_delta = True
+    next_event: asyncio.Future | None = None
+
+    def flush() -> str:
+        nonlocal buffered_bytes, flush_at
+        frame = format_sse({"text": "".join(buffer)}, event="delta")
+        buffer.clear()
+        buffered_bytes, flush_at = 0, None
+        return frame
+
+    def finish() -> str:
+        nonlocal tokens_count
+
+        # The provider stops at `max_output_tokens`, estimates may overshoot it.
+        if not counted_upstream:
+            tokens_count = min(tokens_count, max_tokens)
+
+        if on_done is not None:
+            on_done("".join(text), tokens_count)
+
+        metrics.LLM_STREAMED_TOKENS.inc(tokens_count)
+        elapsed = time.monotonic() - (first_delta_at or started)
+
+        if first_delta_at is not None and elapsed > 0:
+            metrics.LLM_STREAM_TOKENS_PER_SECOND.observe(tokens_count / elapsed)
+        return format_sse({"output_tokens": tokens_count}, event="done")
 
     async with contextlib.aclosing(response) as resp:
         # Added extra `with` block for safety reasons - for generator cleanup.
         # It awaits generator's `aclose` method on the way out.
-        async for chunk in resp:
-            if not chunk.type == "response.completed":
-                break
+        events = aiter(resp)
+
+        try:
+            while True:
+                # The pending read is waited on rather than cancelled on timeout,
+                # so buffered deltas get flushed even when the upstream stalls.
+                if next_event is None:
+                    next_event = asyncio.ensure_future(anext(events))
+
+                timeout = None if flush_at is None else max(flush_at - time.monotonic(), 0)
+                done, _ = await asyncio.wait((next_event,), timeout=timeout)
+
+                if not done:
+                    yield flush()
+                    continue
+
+                read, next_event = next_event, None
+
+                try:
+                    chunk = read.result()
+                except StopAsyncIteration:
+                    break
+                except Exception as exc:
+                    logger.error("Error occured during streaming: {!r}", exc)
+                    chunk = None
+
+                if chunk is None or chunk.type in ("response.failed", "error"):
+                    if buffer:
+                        yield flush()
+                    yield format_sse({"message": "Generation failed."}, event="error")
+                    return
+
+                if chunk.type == "response.output_text.delta":
+                    content = chunk.delta
+                    # Only counted here: the output limit is enforced upstream, by
+                    # `max_output_tokens`, rather than by cutting the stream short.
+                    tokens_count += token_counter.count(content)
+                    buffer.append(content)
+                    buffered_bytes += len(content)
+                    if on_done is not None:
+                        text.append(content)
+
+                    if first_delta_at is None:
+                        first_delta_at = time.monotonic()
+                        metrics.LLM_TIME_TO_FIRST_TOKEN.observe(first_delta_at - started)
+
+                    # The first delta goes out at once to keep time-to-first-token low.
+                    if first_delta or buffered_bytes >= flush_bytes:
+                        first_delta = False
+                        yield flush()
+                    elif flush_at is None:
+                        flush_at = time.monotonic() + flush_interval
+
+                elif chunk.type == "tool.progress":
+                    # Tool calls made before the answer, reported as they happen.
+                    if buffer:
+                        yield flush()
+                    yield format_sse(chunk.data, event="tool")
+
+                elif chunk.type in ("response.completed", "response.incomplete"):
+                    # Prefer the provider's own count over the local one.
+                    usage = getattr(getattr(chunk, "response", None), "usage", None)
+                    if usage is not None:
+                        tokens_count = usage.output_tokens
+                        counted_upstream = True
+
+                    if buffer:
+                        yield flush()
+                    yield finish()
+                    return
+        finally:
+            if next_event is not None:
+                next_event.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await next_event
+
+        if buffer:
+            yield flush()
+        yield finish()
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """`StreamingResponse` awaiting `on_close` once sent, or failed to be.
+
+    A body never started, e.g. when the client left before the response did,
+    is never closed either, and so can't release what it reads from.
+    """
+
+    def __init__(self, *args, on_close: Callable[[], Awaitable[None]] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                await self.on_close()
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    while True:
+        message = await request.receive()
+
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnected(
+    request: Request, awaitable: Awaitable[T], deadline: float
+) -> T:
+    # Cancelling the task cancels whichever upstream or tool call is in flight.
+    task = asyncio.ensure_future(awaitable)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+
+    try:
+        done, _ = await asyncio.wait(
+            (task, disconnected),
+            timeout=max(deadline - time.monotonic(), 0),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    finally:
+        disconnected.cancel()
+
+    if task in done:
+        return task.result()
+
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+    if disconnected in done:
+        logger.info("Client disconnected, request cancelled.")
+        raise HTTPException(
+            status_code=HTTP_499_CLIENT_CLOSED_REQUEST, detail="Client closed request."
+        )
+    raise HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Request timed out."
+    )
+
+
+async def guard_stream(
+    request: Request,
+    frames: AsyncGenerator[str, None],
+    deadline: float,
+    timeout_frame: str = format_sse({"message": "Request timed out."}, event="error"),
+) -> AsyncGenerator[str, None]:
+    # Starlette notices a disconnect only on the next write, which may be long
+    # in coming while the upstream is busy, so the connection is watched here.
+    disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+    next_frame: asyncio.Future | None = None
+
+    async with contextlib.aclosing(frames):
+        try:
+            while True:
+                next_frame = asyncio.ensure_future(anext(frames))
+                done, _ = await asyncio.wait(
+                    (next_frame, disconnected),
+                    timeout=max(deadline - time.monotonic(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
 
-            content = chunk.delta
-            tokens_count += len(content.split())
+                if next_frame in done:
+                    read, next_frame = next_frame, None
 
-            if settings.chat.OUTPUT_MAX_TOKENS <= tokens_count:
-                break
+                    try:
+                        yield read.result()
+                    except StopAsyncIteration:
+                        return
+                elif disconnected in done:
+                    logger.info("Client disconnected, stream cancelled.")
+                    return
+                else:
+                    yield timeout_frame
+                    return
+        finally:
+            disconnected.cancel()
 
-            yield content
+            # The generator has to be idle before `aclosing` can close it.
+            if next_frame is not None:
+                next_frame.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await next_frame
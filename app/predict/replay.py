@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import secrets
+import sys
+import time
+from typing import AsyncGenerator
+
+from app.cache import TTLCache
+from app.config import settings
+from app.logger import logger
+from app.predict.deps import format_sse
+
+
+BUFFER_OVERHEAD_BYTES = 512
+
+
+class ReplayBuffer:
+    """SSE frames of one stream, generated in the background and kept for
+    replay, so that clients can reconnect and resume where they left off.
+
+    Frames are numbered from 1 and sent with `id: <stream id>:<number>`, the
+    value clients send back in `Last-Event-ID`. Generation goes on while no
+    client reads the stream for up to `grace` seconds, waiting for a resume.
+    Past that, and when the deadline passes or the buffer is evicted, it stops.
+    """
+
+    def __init__(
+        self,
+        stream_id: str,
+        owner: str,
+        frames: AsyncGenerator[str, None],
+        deadline: float,
+        store: "ReplayStore",
+    ):
+        self.id = stream_id
+        self.owner = owner
+        self.frames: list[str] = []
+        self.nbytes = BUFFER_OVERHEAD_BYTES
+        self.finished = False
+        self.evicted = False
+        self.readers = 0
+        self._store = store
+        self._new_frames = asyncio.Event()
+        self._cancel_message = "Stream cancelled."
+        self._task = asyncio.create_task(self._run(frames, deadline))
+        # Also armed here, in case the first reader never starts reading.
+        self._abandon_timer: asyncio.TimerHandle | None = None
+        self._arm_abandon_timer()
+
+    async def _run(self, frames: AsyncGenerator[str, None], deadline: float) -> None:
+        try:
+            async with contextlib.aclosing(frames):
+                async with asyncio.timeout(max(deadline - time.monotonic(), 0)):
+                    async for frame in frames:
+                        self._append(frame)
+        except TimeoutError:
+            self._append(format_sse({"message": "Request timed out."}, event="error"))
+        except asyncio.CancelledError:
+            # Readers still attached, or resuming later, are told why it ended.
+            self._append(format_sse({"message": self._cancel_message}, event="error"))
+            raise
+        except Exception as exc:
+            logger.error("Error occured during resumable stream: {!r}", exc)
+            self._append(format_sse({"message": "Generation failed."}, event="error"))
+        finally:
+            self.finished = True
+            self._disarm_abandon_timer()
+            self._notify()
+
+    def _append(self, frame: str) -> None:
+        self.frames.append(f"id: {self.id}:{len(self.frames) + 1}\n{frame}")
+        self.nbytes += sys.getsizeof(self.frames[-1])
+        self._store.resize(self)
+        self._notify()
+
+    def _notify(self) -> None:
+        self._new_frames.set()
+        self._new_frames = asyncio.Event()
+
+    def cancel(self, message: str = "Stream cancelled.") -> None:
+        if not self.finished:
+            self._cancel_message = message
+            self._task.cancel()
+
+    def _arm_abandon_timer(self) -> None:
+        self._disarm_abandon_timer()
+        self._abandon_timer = asyncio.get_running_loop().call_later(
+            self._store.grace, self._abandon
+        )
+
+    def _disarm_abandon_timer(self) -> None:
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+
+    def _abandon(self) -> None:
+        # Nobody came back for it, so stop paying for upstream tokens.
+        self._abandon_timer = None
+
+        if self.readers == 0 and not self.finished:
+            logger.info("Resumable stream {} abandoned, generation cancelled.", self.id)
+            self.cancel("Stream abandoned.")
+
+    async def subscribe(self, after: int = 0) -> AsyncGenerator[str, None]:
+        """Frames numbered above `after`, as they come."""
+        cursor = after
+        self.readers += 1
+        self._disarm_abandon_timer()
+
+        try:
+            while True:
+                new_frames = self._new_frames
+
+                while cursor < len(self.frames):
+                    cursor += 1
+                    yield self.frames[cursor - 1]
+
+                if self.finished:
+                    return
+
+                await new_frames.wait()
+        finally:
+            self.readers -= 1
+
+            if self.readers == 0 and not self.finished:
+                self._arm_abandon_timer()
+
+
+class ReplayStore:
+    """Replay buffers of resumable streams, bounded in total size across all
+    streams. Buffers expire `ttl` after their last frame; under memory
+    pressure the least recently active ones are evicted first, stopping
+    their generation if still running.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, grace: float):
+        self.grace = grace  # seconds a stream nobody reads keeps generating
+        self.buffers = TTLCache(
+            ttl=ttl,
+            max_bytes=max_bytes,
+            sizeof=lambda buffer: buffer.nbytes,
+            on_evict=self._on_evict,
+        )
+        self.resumed = 0
+
+    def start(self, owner: str, frames: AsyncGenerator[str, None], deadline: float) -> ReplayBuffer:
+        buffer = ReplayBuffer(secrets.token_urlsafe(12), owner, frames, deadline, self)
+        self.buffers.set(buffer.id, buffer)
+        return buffer
+
+    def get(self, stream_id: str, owner: str) -> ReplayBuffer | None:
+        buffer = self.buffers.get(stream_id)
+        # Other clients' streams are reported as missing.
+        return buffer if buffer is not None and buffer.owner == owner else None
+
+    def resume(self, stream_id: str, owner: str, last_event_id: str | None) -> AsyncGenerator[str, None] | None:
+        buffer = self.get(stream_id, owner)
+
+        if buffer is None:
+            return None
+
+        _, _, after = (last_event_id or "").rpartition(":")
+        self.resumed += 1
+        return buffer.subscribe(int(after) if after.isdigit() else 0)
+
+    def resize(self, buffer: ReplayBuffer) -> None:
+        # Stored again to account for its new size, unless it was evicted already.
+        if not buffer.evicted:
+            self.buffers.set(buffer.id, buffer)
+
+    def _on_evict(self, stream_id: str, buffer: ReplayBuffer) -> None:
+        buffer.evicted = True
+
+        if not buffer.finished:
+            logger.warning("Replay buffer of running stream {} evicted.", stream_id)
+            buffer.cancel("Stream evicted.")
+
+    def stats(self) -> dict:
+        return {**self.buffers.stats(), "resumed": self.resumed}
+
+
+replay_store = ReplayStore(
+    max_bytes=settings.replay.MAX_BYTES, ttl=settings.replay.TTL, grace=settings.replay.GRACE
+)
@@ -0,0 +1,237 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+from app import metrics
+from app.config import settings
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+# Set per request by the controller: client id for fairness, and priority.
+upstream_context: ContextVar[tuple[str, Priority]] = ContextVar(
+    "upstream_context", default=("anonymous", Priority.BATCH)
+)
+
+
+class UpstreamScheduler:
+    """Bounds concurrent upstream LLM calls, queueing the rest.
+
+    Waiters are served by priority, and round-robin across clients within a
+    priority level. Requests are shed with 503 when the queue is full or
+    their projected wait is above `max_queue_wait`.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, max_queue_wait: float):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self.queued = 0
+        self._waiters: list[OrderedDict[str, deque[asyncio.Future]]] = [
+            OrderedDict() for _ in Priority
+        ]
+        self.hold_time: float | None = None  # EWMA of how long a slot is held
+        self.wait_time = 0.0  # EWMA of queue wait
+        self.admitted = 0
+        self.shed = 0
+
+    def projected_wait(self, ahead: int) -> float:
+        if self.hold_time is None:
+            return 0.0
+        return (ahead + 1) * self.hold_time / self.max_in_flight
+
+    async def acquire(self, client_id: str, priority: Priority) -> None:
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        ahead = sum(
+            len(queue) for level in self._waiters[: priority + 1] for queue in level.values()
+        )
+        projected_wait = self.projected_wait(ahead)
+
+        if self.queued >= self.max_queued or projected_wait > self.max_queue_wait:
+            self.shed += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry later.",
+                headers={"Retry-After": str(math.ceil(projected_wait) or 1)},
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        level = self._waiters[priority]
+        level.setdefault(client_id, deque()).append(future)
+        self.queued += 1
+        started = time.monotonic()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the request got cancelled.
+                self.release()
+            else:
+                self._remove(level, client_id, future)
+            raise
+
+        self.admitted += 1
+        self.wait_time = 0.8 * self.wait_time + 0.2 * (time.monotonic() - started)
+
+    def _remove(self, level: OrderedDict, client_id: str, future: asyncio.Future) -> None:
+        queue = level.get(client_id)
+
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+
+            if not queue:
+                del level[client_id]
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        for level in self._waiters:
+            while level:
+                client_id, queue = next(iter(level.items()))
+                future = queue.popleft()
+                self.queued -= 1
+
+                # Round-robin: the client goes to the back of its level.
+                if queue:
+                    level.move_to_end(client_id)
+                else:
+                    del level[client_id]
+
+                if not future.done():
+                    return future
+        return None
+
+    def release(self, held: float | None = None) -> None:
+        if held is not None:
+            self.hold_time = held if self.hold_time is None else 0.8 * self.hold_time + 0.2 * held
+
+        waiter = self._next_waiter()
+
+        # The slot passes straight to the next waiter, otherwise it's freed.
+        if waiter is None:
+            self.in_flight -= 1
+        else:
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": {
+                priority.name.lower(): sum(len(q) for q in self._waiters[priority].values())
+                for priority in Priority
+            },
+            "max_queued": self.max_queued,
+            "avg_queue_wait": self.wait_time,
+            "avg_hold_time": self.hold_time,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+def record_usage(template: str, usage: Any) -> None:
+    # Cached input tokens over input tokens is the prefix cache hit rate.
+    if usage is None:
+        return
+
+    details = getattr(usage, "input_tokens_details", None)
+    metrics.LLM_INPUT_TOKENS.labels(template).inc(usage.input_tokens or 0)
+    metrics.LLM_CACHED_INPUT_TOKENS.labels(template).inc(getattr(details, "cached_tokens", 0) or 0)
+
+
+class _SlotStream:
+    """Upstream stream that holds its scheduler slot until it is closed."""
+
+    def __init__(self, stream: Any, release: Callable[[], None], template: str):
+        self._stream = stream
+        self._release = release
+        self._template = template
+        self._events = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def __aiter__(self):
+        self._events = self._stream.__aiter__()
+        return self
+
+    async def __anext__(self) -> Any:
+        event = await self._events.__anext__()
+
+        if event.type in ("response.completed", "response.incomplete"):
+            record_usage(self._template, getattr(event.response, "usage", None))
+        return event
+
+    async def close(self) -> None:
+        if self._release is not None:
+            self._release()
+            self._release = None
+        await self._stream.close()
+
+
+class _ScheduledResponses:
+    def __init__(self, client: Any, scheduler: UpstreamScheduler):
+        self._client = client
+        self._scheduler = scheduler
+
+    async def create(self, **kwargs) -> Any:
+        client_id, priority = upstream_context.get()
+
+        with metrics.timed(metrics.LLM_QUEUE_WAIT, "queue"):
+            await self._scheduler.acquire(client_id, priority)
+        stream = bool(kwargs.get("stream"))
+        # Cache keys are `<template>:<version>`, see `app.prompts`.
+        template = kwargs.get("prompt_cache_key", "none").partition(":")[0]
+        started = time.monotonic()
+
+        try:
+            with metrics.timed(metrics.LLM_UPSTREAM_LATENCY.labels(str(stream).lower()), "upstream"):
+                result = await self._client.responses.create(**kwargs)
+        except BaseException as exc:
+            metrics.LLM_UPSTREAM_ERRORS.labels(type(exc).__name__).inc()
+            self._scheduler.release(time.monotonic() - started)
+            raise
+
+        if stream:
+            return _SlotStream(
+                result, lambda: self._scheduler.release(time.monotonic() - started), template
+            )
+
+        self._scheduler.release(time.monotonic() - started)
+        record_usage(template, getattr(result, "usage", None))
+        return result
+
+
+class ScheduledLLMClient:
+    """Wraps an LLM client, so that every `responses` call goes through the scheduler."""
+
+    def __init__(self, client: Any, scheduler: UpstreamScheduler):
+        self.client = client
+        self.responses = _ScheduledResponses(client, scheduler)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+upstream_scheduler = UpstreamScheduler(
+    max_in_flight=settings.llm.MAX_IN_FLIGHT,
+    max_queued=settings.llm.MAX_QUEUED,
+    max_queue_wait=settings.llm.MAX_QUEUE_WAIT,
+)
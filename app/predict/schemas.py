@@ -5,9 +5,63 @@ from app.config import settings
 
 class ChatInput(BaseModel):
     user_prompt: str = Field("Tell me about Nicolas Cage.")
-    max_tokens: int = Field(settings.llm.MAX_TOKENS)
+    max_tokens: int = Field(
+        settings.llm.MAX_TOKENS,
+        ge=settings.chat.OUTPUT_MIN_TOKENS,
+        le=settings.chat.OUTPUT_MAX_TOKENS,
+    )
+    use_cache: bool = Field(True)  # per-request bypass of the completion cache
+    timeout: float = Field(
+        settings.chat.MAX_REQUEST_TIMEOUT, gt=0, le=settings.chat.MAX_REQUEST_TIMEOUT
+    )
+    session_id: str | None = Field(None)  # continues a conversation from `/sessions`
+
+
+class MultiChatInput(BaseModel):
+    user_prompts: list[str] = Field(
+        ["Tell me about Nicolas Cage.", "Tell me about Bergamo."],
+        min_length=1,
+        max_length=settings.chat.MULTI_PROMPT_MAX_PROMPTS,
+    )
+    max_tokens: int = Field(
+        settings.llm.MAX_TOKENS,
+        ge=settings.chat.OUTPUT_MIN_TOKENS,
+        le=settings.chat.OUTPUT_MAX_TOKENS,
+    )
+    use_cache: bool = Field(True)
+    timeout: float = Field(
+        settings.chat.MAX_REQUEST_TIMEOUT, gt=0, le=settings.chat.MAX_REQUEST_TIMEOUT
+    )
 
 
 class WeatherInput(BaseModel):
     user_prompt: str = Field("Bergamo, Italy")
-    max_tokens: int = Field(settings.weather_api.MAX_TOKENS)
+    max_tokens: int = Field(
+        settings.weather_api.MAX_TOKENS,
+        ge=settings.chat.OUTPUT_MIN_TOKENS,
+        le=settings.chat.OUTPUT_MAX_TOKENS,
+    )
+    timeout: float = Field(
+        settings.chat.MAX_REQUEST_TIMEOUT, gt=0, le=settings.chat.MAX_REQUEST_TIMEOUT
+    )
+
+
+class StructuredInput(BaseModel):
+    user_prompt: str = Field("Create a user named Jane Doe, who lives at 97, Smith Street.")
+    schema_name: str = Field("user")  # one of the schemas registered in `structured.py`
+    max_tokens: int = Field(
+        settings.llm.MAX_TOKENS,
+        ge=settings.chat.OUTPUT_MIN_TOKENS,
+        le=settings.chat.OUTPUT_MAX_TOKENS,
+    )
+    timeout: float = Field(
+        settings.chat.MAX_REQUEST_TIMEOUT, gt=0, le=settings.chat.MAX_REQUEST_TIMEOUT
+    )
+
+
+# Structured output schemas
+
+
+class User(BaseModel):
+    name: str = Field(..., description="The name of the user", examples=["John Doe"])
+    address: str = Field(..., description="The address of the user", examples=["123 Main St"])
@@ -1,112 +1,514 @@
+import asyncio
+import itertools
 import json
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncGenerator
+
 from fastapi import HTTPException, status
 from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
 from openai import AsyncOpenAI
 
+from app import metrics
 from app.config import settings
+from app.logger import logger
 from app.predict import deps
-from app.prompts import CUSTOM_SYSTEM_PROMPT, OWM_TOOL_SYSTEM_PROMPT
-from app.tools.definitions import GET_CURRENT_WEATHER_FROM_OWM
-from app.tools.functions import get_current_weather_from_owm
+from app.predict.broadcast import stream_fanout
+from app.predict.cache import CompletionCache, completion_cache, near_duplicate_index
+from app.predict.sessions import Session, session_store
+from app.predict.structured import CompiledSchema, stream_fields
+from app.prompts import (
+    CUSTOM_SYSTEM_PROMPT,
+    OWM_TOOL_SYSTEM_PROMPT,
+    STRUCTURED_OUTPUT_SYSTEM_PROMPT,
+    prompts,
+)
+from app.tools.registry import tool_registry
+from app.tokens import MESSAGE_TOKEN_OVERHEAD, token_counter
+
+
+def context_budget(system_prompt: str, max_tokens: int) -> int:
+    # Tokens left for the user prompt and any history, next to the system prompt.
+    return (
+        settings.llm.CONTEXT_WINDOW
+        - max_tokens
+        - token_counter.count_static(system_prompt)
+        - 2 * MESSAGE_TOKEN_OVERHEAD
+    )
+
+
+async def get_session_history(
+    session: Session,
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int,
+    llm_client: AsyncOpenAI,
+) -> tuple[list[dict], int]:
+    """Session messages to send before `user_prompt`, and its token count."""
+    user_tokens = token_counter.count(user_prompt)
+    budget = context_budget(system_prompt, max_tokens) - user_tokens
+    return await session_store.context(session, budget, llm_client), user_tokens
+
+
+def fit_context_window(system_prompt: str, user_prompt: str, max_tokens: int) -> str:
+    budget = context_budget(system_prompt, max_tokens)
+
+    if token_counter.count(user_prompt) <= budget:
+        return user_prompt
+
+    if settings.llm.TRUNCATE_OVERSIZED_PROMPTS and budget > 0:
+        logger.warning("Prompt truncated to {} tokens to fit the context window.", budget)
+        return token_counter.truncate(user_prompt, budget)
+
+    raise HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=(
+            f"Prompt with {max_tokens} output tokens exceeds "
+            f"the context window of {settings.llm.CONTEXT_WINDOW} tokens."
+        ),
+    )
+
+
+def record_cache_result(result: str) -> None:
+    metrics.COMPLETION_CACHE_REQUESTS.labels(result).inc()
+    metrics.record_timing("cache", desc=result)
 
 
 async def get_chat_inference_batch(
-    user_prompt: str, max_tokens: int, llm_client: AsyncOpenAI | None = None
+    user_prompt: str,
+    max_tokens: int,
+    llm_client: AsyncOpenAI | None = None,
+    use_cache: bool = True,
+    session: Session | None = None,
 ) -> str:
-    response = await llm_client.responses.create(
-        input=[
-            {
-                "role": "system",
-                "content": CUSTOM_SYSTEM_PROMPT,
-            },
-            {
-                "role": "user",
-                "content": user_prompt,
-            },
-        ],
-        model=settings.llm.MODEL,
-        max_output_tokens=max_tokens,
-        temperature=settings.llm.TEMPERATURE,
+    system_prompt = prompts.render(CUSTOM_SYSTEM_PROMPT)
+    user_prompt = fit_context_window(system_prompt, user_prompt, max_tokens)
+    history, user_tokens = [], 0
+    # Whatever is not loaded here came from the cache, or a coalesced call.
+    cache_result = "hit"
+
+    if session is not None:
+        history, user_tokens = await get_session_history(
+            session, system_prompt, user_prompt, max_tokens, llm_client
+        )
+
+    async def create() -> str:
+        nonlocal cache_result
+        cache_result = "miss"
+        response = await llm_client.responses.create(
+            input=[
+                {
+                    "role": "system",
+                    "content": system_prompt,
+                },
+                *history,
+                {
+                    "role": "user",
+                    "content": user_prompt,
+                },
+            ],
+            model=settings.llm.MODEL,
+            prompt_cache_key=prompts.cache_key(CUSTOM_SYSTEM_PROMPT),
+            max_output_tokens=max_tokens,
+            temperature=settings.llm.TEMPERATURE,
+        )
+
+        if not response:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Response is empty."
+            )
+
+        return response.output_text
+
+    use_cache = (
+        use_cache
+        and settings.completion_cache.ENABLED
+        and (settings.completion_cache.CACHE_SAMPLED or settings.llm.TEMPERATURE == 0)
     )
 
-    if not response:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Response is empty."
+    if session is not None:
+        # Answers depend on the whole history, so they are never cached.
+        record_cache_result("bypass")
+        answer = await create()
+        session_store.add_turn(
+            session, user_prompt, user_tokens, answer, token_counter.count(answer)
         )
+        return answer
 
-    return response.output_text
+    if not use_cache:
+        record_cache_result("bypass")
+        return await create()
 
+    key = CompletionCache.make_key(
+        settings.llm.MODEL,
+        system_prompt,
+        user_prompt,
+        max_tokens,
+        settings.llm.TEMPERATURE,
+    )
 
-async def get_chat_inference_stream(
-    user_prompt: str, max_tokens: int, llm_client: AsyncOpenAI | None = None
-) -> str:
-    response = await llm_client.responses.stream(
-        input=[
-            {"role": "system", "content": CUSTOM_SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": user_prompt,
-            },
-        ],
-        model=settings.llm.MODEL,
-        max_output_tokens=max_tokens,
-        temperature=settings.llm.TEMPERATURE,
+    if near_duplicate_index is None:
+        value = await completion_cache.get_or_create(key, create)
+        record_cache_result(cache_result)
+        return value
+
+    # Near duplicates are only matched among requests with the same parameters.
+    namespace = CompletionCache.make_key(
+        settings.llm.MODEL, system_prompt, "", max_tokens, settings.llm.TEMPERATURE
     )
 
+    async def create_or_reuse_near_duplicate() -> str:
+        nonlocal cache_result
+        similar_key = near_duplicate_index.lookup(user_prompt, namespace)
+
+        if similar_key is not None:
+            value = await completion_cache.get(similar_key)
+
+            if value is not None:
+                cache_result = "near_duplicate"
+                return value
+
+        value = await create()
+        near_duplicate_index.add(user_prompt, key, namespace)
+        return value
+
+    value = await completion_cache.get_or_create(key, create_or_reuse_near_duplicate)
+    record_cache_result(cache_result)
+    return value
+
+
+async def get_chat_inference_multi(
+    user_prompts: list[str],
+    max_tokens: int,
+    llm_client: AsyncOpenAI | None = None,
+    use_cache: bool = True,
+    concurrency: int = settings.chat.MULTI_PROMPT_CONCURRENCY,
+) -> StreamingResponse:
+    async def run(index: int, user_prompt: str) -> dict:
+        # A failed prompt is reported in its own line, the others carry on.
+        try:
+            output = await get_chat_inference_batch(
+                user_prompt, max_tokens, llm_client=llm_client, use_cache=use_cache
+            )
+        except HTTPException as exc:
+            return {"index": index, "status_code": exc.status_code, "error": exc.detail}
+        except Exception as exc:
+            logger.error("Error occured during multi-prompt inference: {!r}", exc)
+            return {
+                "index": index,
+                "status_code": status.HTTP_502_BAD_GATEWAY,
+                "error": "Generation failed.",
+            }
+        return {"index": index, "status_code": status.HTTP_200_OK, "output": output}
+
+    async def results() -> AsyncGenerator[str, None]:
+        prompts = enumerate(user_prompts)
+        pending: set[asyncio.Task] = set()
+
+        try:
+            while True:
+                # Only `concurrency` prompts are started at a time.
+                for index, user_prompt in itertools.islice(prompts, concurrency - len(pending)):
+                    pending.add(asyncio.ensure_future(run(index, user_prompt)))
+
+                if not pending:
+                    return
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    yield json.dumps(task.result(), ensure_ascii=False) + "\n"
+        finally:
+            for task in pending:
+                task.cancel()
+
     return StreamingResponse(
-        deps.stream_generator(response), media_type="text/event-stream"
+        results(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+async def get_chat_inference_stream(
+    user_prompt: str,
+    max_tokens: int,
+    llm_client: AsyncOpenAI | None = None,
+    use_cache: bool = True,
+    session: Session | None = None,
+) -> str:
+    started = time.monotonic()
+    system_prompt = prompts.render(CUSTOM_SYSTEM_PROMPT)
+    user_prompt = fit_context_window(system_prompt, user_prompt, max_tokens)
+    history, user_tokens, on_done = [], 0, None
+
+    if session is not None:
+        history, user_tokens = await get_session_history(
+            session, system_prompt, user_prompt, max_tokens, llm_client
+        )
+
+        # The turn is kept only once the answer streamed in full.
+        def on_done(answer: str, answer_tokens: int) -> None:
+            session_store.add_turn(session, user_prompt, user_tokens, answer, answer_tokens)
+
+    async def open_stream():
+        return await llm_client.responses.create(
+            input=[
+                {"role": "system", "content": system_prompt},
+                *history,
+                {
+                    "role": "user",
+                    "content": user_prompt,
+                },
+            ],
+            model=settings.llm.MODEL,
+            prompt_cache_key=prompts.cache_key(CUSTOM_SYSTEM_PROMPT),
+            max_output_tokens=max_tokens,
+            temperature=settings.llm.TEMPERATURE,
+            stream=True,
+        )
+
+    if use_cache and session is None and settings.chat.DEDUPLICATE_STREAMS:
+        # Identical concurrent requests attach to one upstream stream.
+        key = CompletionCache.make_key(
+            settings.llm.MODEL,
+            system_prompt,
+            user_prompt,
+            max_tokens,
+            settings.llm.TEMPERATURE,
+        )
+        subscription = await stream_fanout.subscribe(key, open_stream)
+        response, on_close = subscription, subscription.release_unread
+    else:
+        response, on_close = deps.stream_events(await open_stream()), None
+
+    return deps.ClosingStreamingResponse(
+        deps.stream_generator(
+            response, max_tokens=max_tokens, started=started, on_done=on_done
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        on_close=on_close,
     )
 
 
 async def get_chat_inference_weather(
-    user_prompt: str, max_tokens: int, llm_client: AsyncOpenAI | None = None
+    user_prompt: str,
+    max_tokens: int,
+    llm_client: AsyncOpenAI | None = None,
+    owm_client: AsyncClient | None = None,
 ) -> str:
-    tools = [GET_CURRENT_WEATHER_FROM_OWM]
+    system_prompt = prompts.render(OWM_TOOL_SYSTEM_PROMPT)
+    user_prompt = fit_context_window(
+        system_prompt,
+        user_prompt,
+        max(max_tokens, settings.weather_api.MAX_TOKENS),
+    )
+    tools = tool_registry.definitions()
     messages = [
         {
             "role": "system",
-            "content": OWM_TOOL_SYSTEM_PROMPT,
+            "content": system_prompt,
         },
         {"role": "user", "content": user_prompt},
     ]
 
-    response = await llm_client.responses.create(
+    for round_ in range(settings.tools.MAX_ROUNDS):
+        response = await llm_client.responses.create(
+            input=messages,
+            model=settings.llm.MODEL,
+            prompt_cache_key=prompts.cache_key(OWM_TOOL_SYSTEM_PROMPT),
+            # The first turn has to look the weather up, later ones may answer,
+            # so they get the client's limit.
+            max_output_tokens=settings.weather_api.MAX_TOKENS if round_ == 0 else max_tokens,
+            tools=tools,
+            tool_choice="required" if round_ == 0 else "auto",
+            parallel_tool_calls=True,
+        )
+
+        if not response.output:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Response output is empty."
+            )
+
+        tool_calls = [item for item in response.output if item.type == "function_call"]
+
+        if not tool_calls:
+            return response.output_text
+
+        # All tool calls of one turn run concurrently.
+        results = await tool_registry.call_many(
+            [(item.name, item.arguments) for item in tool_calls],
+            context={"owm_client": owm_client},
+        )
+
+        if all(
+            (tool := tool_registry.get(item.name)) and tool.return_direct for item in tool_calls
+        ):
+            return "\n".join(results)
+
+        for item, result in zip(tool_calls, results):
+            messages.append(item)
+            messages.append(
+                {
+                    "call_id": item.call_id,
+                    "type": "function_call_output",
+                    "output": result,
+                }
+            )
+
+    # Out of tool rounds, the model answers with what it has.
+    enriched_response = await llm_client.responses.create(
         input=messages,
         model=settings.llm.MODEL,
-        max_output_tokens=settings.weather_api.MAX_TOKENS,
-        tools=tools,
-        tool_choice="required",
+        prompt_cache_key=prompts.cache_key(OWM_TOOL_SYSTEM_PROMPT),
+        max_output_tokens=max_tokens,
     )
-    response_output = response.output
 
-    if not response_output:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Response output is empty."
-        )
-        
-    for item in response_output:
-        item_name = item.name
-        
-        if item.type != "function_call" or item_name != "get_current_weather_from_owm":
-            continue
-        
-        args = json.loads(item.arguments)
-        result = get_current_weather_from_owm(
-            args.get("location"), args.get("unit", "metric")
-        )
-        messages.append(
-            {
-                "call_id": item.call_id,
-                "type": "function_call_output",
-                "name": item_name,
-                "output": str(result),
+    return enriched_response.output_text
+
+
+def tool_progress(**data) -> SimpleNamespace:
+    # Shaped like an upstream event, so it flows through `stream_generator`.
+    return SimpleNamespace(type="tool.progress", data=data)
+
+
+async def get_chat_inference_weather_stream(
+    user_prompt: str,
+    max_tokens: int,
+    llm_client: AsyncOpenAI | None = None,
+    owm_client: AsyncClient | None = None,
+) -> StreamingResponse:
+    started = time.monotonic()
+    system_prompt = prompts.render(OWM_TOOL_SYSTEM_PROMPT)
+    user_prompt = fit_context_window(
+        system_prompt,
+        user_prompt,
+        max(max_tokens, settings.weather_api.MAX_TOKENS),
+    )
+    tools = tool_registry.definitions()
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+    async def open_stream(round_: int):
+        # Same rounds as `get_chat_inference_weather`, with the last one answering.
+        if round_ == settings.tools.MAX_ROUNDS:
+            tool_options = {}
+        else:
+            tool_options = {
+                "tools": tools,
+                "tool_choice": "required" if round_ == 0 else "auto",
+                "parallel_tool_calls": True,
             }
+
+        return await llm_client.responses.create(
+            input=messages,
+            model=settings.llm.MODEL,
+            prompt_cache_key=prompts.cache_key(OWM_TOOL_SYSTEM_PROMPT),
+            max_output_tokens=settings.weather_api.MAX_TOKENS if round_ == 0 else max_tokens,
+            stream=True,
+            **tool_options,
         )
 
-    enriched_response = await llm_client.responses.create(
-        input=messages,
+    async def call_tool(item) -> tuple[Any, str]:
+        # The call item goes along with its result, to report which one completed.
+        return item, await tool_registry.call(
+            item.name, item.arguments, context={"owm_client": owm_client}
+        )
+
+    async def events(stream) -> AsyncGenerator:
+        for round_ in range(settings.tools.MAX_ROUNDS + 1):
+            if round_:
+                stream = await open_stream(round_)
+
+            tool_calls, running = [], []
+
+            try:
+                async for event in deps.stream_events(stream):
+                    if event.type == "response.output_item.done" and event.item.type == "function_call":
+                        item = event.item
+                        # Each tool starts as soon as the model has decided on it.
+                        tool_calls.append(item)
+                        running.append(asyncio.ensure_future(call_tool(item)))
+                        yield tool_progress(
+                            call_id=item.call_id,
+                            name=item.name,
+                            status="started",
+                            message=tool_registry.describe(item.name, item.arguments),
+                        )
+                    elif event.type == "response.completed" and tool_calls:
+                        # Not the end of the answer, just of this round.
+                        continue
+                    else:
+                        yield event
+
+                if not tool_calls:
+                    return
+
+                for next_done in asyncio.as_completed(running):
+                    item, _ = await next_done
+                    yield tool_progress(call_id=item.call_id, name=item.name, status="done")
+            finally:
+                # Tool calls still running when the client goes away are dropped.
+                for task in running:
+                    task.cancel()
+
+            results = [task.result()[1] for task in running]
+
+            if all(
+                (tool := tool_registry.get(item.name)) and tool.return_direct
+                for item in tool_calls
+            ):
+                yield SimpleNamespace(type="response.output_text.delta", delta="\n".join(results))
+                return
+
+            for item, result in zip(tool_calls, results):
+                messages.append(item)
+                messages.append(
+                    {
+                        "call_id": item.call_id,
+                        "type": "function_call_output",
+                        "output": result,
+                    }
+                )
+
+    # The first round is opened here, so that failures to start still get a status code.
+    response = events(await open_stream(0))
+
+    return StreamingResponse(
+        deps.stream_generator(response, max_tokens=max_tokens, started=started),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def get_structured_inference_stream(
+    user_prompt: str,
+    schema: CompiledSchema,
+    max_tokens: int,
+    llm_client: AsyncOpenAI | None = None,
+) -> StreamingResponse:
+    started = time.monotonic()
+    system_prompt = prompts.render(STRUCTURED_OUTPUT_SYSTEM_PROMPT)
+    user_prompt = fit_context_window(system_prompt, user_prompt, max_tokens)
+
+    stream = await llm_client.responses.create(
+        input=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
         model=settings.llm.MODEL,
+        # The schema is part of the cached prefix too.
+        prompt_cache_key=f"{prompts.cache_key(STRUCTURED_OUTPUT_SYSTEM_PROMPT)}:{schema.name}",
         max_output_tokens=max_tokens,
+        text=schema.text_format,
+        stream=True,
     )
 
-    return enriched_response.output_text
+    return StreamingResponse(
+        stream_fields(deps.stream_events(stream), schema, started),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
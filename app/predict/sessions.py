@@ -0,0 +1,158 @@
+import secrets
+import sys
+from collections import deque
+
+from openai import AsyncOpenAI
+
+from app.cache import TTLCache
+from app.config import settings
+from app.logger import logger
+from app.tokens import MESSAGE_TOKEN_OVERHEAD, token_counter
+
+
+SESSION_OVERHEAD_BYTES = 256
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below in a few sentences, keeping names, facts and "
+    "open questions the assistant may need later. Extend the earlier summary, if given."
+)
+
+
+class Session:
+    """One conversation: its turns as ready-made API messages, with token
+    counts kept per message, so that fitting it into a budget never recounts.
+    """
+
+    __slots__ = (
+        "id", "owner", "messages", "tokens", "total_tokens", "summary", "summary_tokens", "nbytes"
+    )
+
+    def __init__(self, session_id: str, owner: str):
+        self.id = session_id
+        self.owner = owner
+        self.messages: deque[dict] = deque()
+        self.tokens: deque[int] = deque()
+        self.total_tokens = 0
+        self.summary: dict | None = None  # system message with a summary of dropped turns
+        self.summary_tokens = 0
+        self.nbytes = SESSION_OVERHEAD_BYTES
+
+    def append(self, role: str, content: str, tokens: int) -> None:
+        self.messages.append({"role": role, "content": content})
+        self.tokens.append(tokens + MESSAGE_TOKEN_OVERHEAD)
+        self.total_tokens += tokens + MESSAGE_TOKEN_OVERHEAD
+        self.nbytes += sys.getsizeof(content)
+
+    def pop_oldest(self) -> dict:
+        message = self.messages.popleft()
+        self.total_tokens -= self.tokens.popleft()
+        self.nbytes -= sys.getsizeof(message["content"])
+        return message
+
+    def set_summary(self, summary: str) -> None:
+        if self.summary is not None:
+            self.nbytes -= sys.getsizeof(self.summary["content"])
+
+        content = f"Summary of the earlier conversation: {summary}"
+        self.summary = {"role": "system", "content": content}
+        self.summary_tokens = token_counter.count(content) + MESSAGE_TOKEN_OVERHEAD
+        self.nbytes += sys.getsizeof(content)
+
+
+class SessionStore:
+    """Conversation sessions, bounded in total size, evicted LRU or after `ttl`
+    of inactivity. Sessions live in the memory of a single worker.
+
+    Histories that outgrow the context budget are compacted, by dropping the
+    oldest turns, or by folding them into a rolling summary.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, compaction: str, summary_max_tokens: int):
+        self.compaction = compaction
+        self.summary_max_tokens = summary_max_tokens
+        self._sessions = TTLCache(ttl=ttl, max_bytes=max_bytes, sizeof=lambda s: s.nbytes)
+        self.compactions = 0
+
+    def create(self, owner: str) -> Session:
+        session = Session(secrets.token_urlsafe(16), owner)
+        self._sessions.set(session.id, session)
+        return session
+
+    def get(self, session_id: str, owner: str) -> Session | None:
+        session = self._sessions.get(session_id)
+        # Other clients' sessions are reported as missing.
+        return session if session is not None and session.owner == owner else None
+
+    def delete(self, session_id: str, owner: str) -> bool:
+        if self.get(session_id, owner) is None:
+            return False
+        self._sessions.pop(session_id)
+        return True
+
+    def add_turn(
+        self, session: Session, user_prompt: str, user_tokens: int, answer: str, answer_tokens: int
+    ) -> None:
+        session.append("user", user_prompt, user_tokens)
+        session.append("assistant", answer, answer_tokens)
+        self._update(session)
+
+    def _update(self, session: Session) -> None:
+        # Stored again, to account for its new size and to refresh its ttl, unless
+        # deleted or evicted meanwhile, as it would then come back.
+        if self._sessions.get(session.id) is session:
+            self._sessions.set(session.id, session)
+
+    async def context(self, session: Session, budget: int, llm_client: AsyncOpenAI) -> list[dict]:
+        """History messages of `session` fitting in `budget` tokens."""
+        summary_budget = 0
+
+        if self.compaction == "summarize":
+            # Room for the summary, with its prefix and message overhead.
+            summary_budget = self.summary_max_tokens + 2 * MESSAGE_TOKEN_OVERHEAD
+
+        if session.total_tokens + max(session.summary_tokens, summary_budget) > budget:
+            dropped = []
+
+            while session.messages and session.total_tokens + summary_budget > budget:
+                dropped.append(session.pop_oldest())
+
+            # Turns are dropped whole, so the history never starts with an answer.
+            if session.messages and session.messages[0]["role"] == "assistant":
+                dropped.append(session.pop_oldest())
+
+            self.compactions += 1
+
+            if summary_budget:
+                await self._summarize(session, dropped, llm_client)
+            self._update(session)
+
+        if session.summary is not None:
+            return [session.summary, *session.messages]
+        return list(session.messages)
+
+    async def _summarize(self, session: Session, dropped: list[dict], llm_client: AsyncOpenAI) -> None:
+        earlier = [session.summary] if session.summary is not None else []
+
+        try:
+            response = await llm_client.responses.create(
+                instructions=SUMMARY_INSTRUCTIONS,
+                input=[*earlier, *dropped],
+                model=settings.llm.MODEL,
+                max_output_tokens=self.summary_max_tokens,
+            )
+        except Exception as exc:
+            # The turns are dropped anyway, the conversation just goes on without them.
+            logger.warning("Session summary failed, oldest turns trimmed: {!r}", exc)
+            return
+
+        session.set_summary(response.output_text)
+
+    def stats(self) -> dict:
+        return {**self._sessions.stats(), "compaction": self.compaction, "compactions": self.compactions}
+
+
+session_store = SessionStore(
+    max_bytes=settings.sessions.MAX_BYTES,
+    ttl=settings.sessions.TTL,
+    compaction=settings.sessions.COMPACTION,
+    summary_max_tokens=settings.sessions.SUMMARY_MAX_TOKENS,
+)
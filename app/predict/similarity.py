@@ -0,0 +1,155 @@
+import hashlib
+import operator
+import re
+from array import array
+from collections import Counter, OrderedDict
+from typing import Hashable
+
+
+_EMPTY = (1 << 64) - 1
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_prompt(text: str) -> str:
+    # Casing, punctuation and whitespace differences don't change the prompt.
+    return " ".join(_NON_WORD.sub(" ", text.casefold()).split())
+
+
+class MinHashLSHIndex:
+    """Local near-duplicate index over prompts, using MinHash signatures of
+    character shingles and LSH banding to find candidates.
+
+    Signatures use one-permutation hashing with rotation densification, so
+    each shingle is hashed once instead of once per signature slot.
+    The `max_candidates` sharing most bands are verified by estimated Jaccard
+    similarity against `threshold`; the index holds at most `max_entries`
+    prompts (LRU).
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        max_entries: int = 10_000,
+        num_perm: int = 64,
+        bands: int = 8,
+        shingle_size: int = 3,
+        max_candidates: int = 16,
+    ):
+        if num_perm % bands:
+            raise ValueError("`num_perm` must be divisible by `bands`.")
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_candidates = max_candidates
+        self._offset = _EMPTY // num_perm + 1  # above any genuine slot value
+        # entry id -> (signature, band keys, value)
+        self._entries: OrderedDict[int, tuple[array, list[int], Hashable]] = OrderedDict()
+        self._buckets: dict[int, list[int]] = {}
+        self._next_id = 0
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _signature(self, text: str) -> array:
+        text = normalize_prompt(text)
+        size, num_perm = self.shingle_size, self.num_perm
+        bins = [_EMPTY] * num_perm
+
+        for i in range(max(len(text) - size + 1, 1)):
+            digest = hashlib.blake2b(text[i : i + size].encode(), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            slot, value = h % num_perm, h // num_perm
+
+            if value < bins[slot]:
+                bins[slot] = value
+
+        # Empty slots borrow the value of the nearest non-empty slot to the right,
+        # offset by the distance, which keeps collision probability ~ Jaccard.
+        # Two right-to-left sweeps let slots at the end wrap around to the start.
+        signature = array("Q", bins)
+        nearest, distance = _EMPTY, 0
+
+        for slot in reversed(range(2 * num_perm)):
+            slot %= num_perm
+
+            if bins[slot] != _EMPTY:
+                nearest, distance = bins[slot], 0
+            else:
+                distance += 1
+
+                if nearest != _EMPTY:
+                    signature[slot] = (nearest + distance * self._offset) & _EMPTY
+
+        return signature
+
+    def _band_keys(self, signature: array, namespace: Hashable) -> list[int]:
+        rows = self.rows
+        return [
+            hash((namespace, band, signature[band * rows : (band + 1) * rows].tobytes()))
+            for band in range(self.bands)
+        ]
+
+    def add(self, text: str, value: Hashable, namespace: Hashable = None) -> None:
+        signature = self._signature(text)
+        band_keys = self._band_keys(signature, namespace)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (signature, band_keys, value)
+
+        for key in band_keys:
+            self._buckets.setdefault(key, []).append(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._evict()
+
+    def _evict(self) -> None:
+        entry_id, (_, band_keys, _) = self._entries.popitem(last=False)
+
+        for key in band_keys:
+            bucket = self._buckets[key]
+            bucket.remove(entry_id)
+
+            if not bucket:
+                del self._buckets[key]
+
+    def lookup(self, text: str, namespace: Hashable = None) -> Hashable | None:
+        """Return the value stored for the most similar prompt, if similar enough."""
+        self.lookups += 1
+        signature = self._signature(text)
+        shared_bands = Counter()
+
+        for key in self._band_keys(signature, namespace):
+            shared_bands.update(self._buckets.get(key, ()))
+
+        best_id, best_score = None, self.threshold
+
+        # Near duplicates share the most bands, so only the top candidates are
+        # verified, which bounds lookup cost when many prompts overlap a little.
+        for entry_id, _ in shared_bands.most_common(self.max_candidates):
+            other = self._entries[entry_id][0]
+            score = sum(map(operator.eq, signature, other)) / self.num_perm
+
+            if score >= best_score:
+                best_id, best_score = entry_id, score
+
+        if best_id is None:
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(best_id)
+        return self._entries[best_id][2]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+        }
@@ -0,0 +1,276 @@
+import contextlib
+import functools
+import json
+import time
+from typing import Any, AsyncGenerator
+
+from pydantic import BaseModel, TypeAdapter
+
+from app import metrics
+from app.logger import logger
+from app.predict.deps import format_sse
+from app.predict.schemas import User
+
+
+# Keywords strict structured outputs don't accept, kept in pydantic's schemas.
+_UNSUPPORTED_KEYWORDS = ("default", "example", "examples")
+# Keywords mapping names, which may be any word, to schemas.
+_SCHEMA_MAPS = ("properties", "patternProperties", "$defs", "definitions")
+# Keywords holding JSON values rather than schemas.
+_VALUE_KEYWORDS = ("enum", "const")
+
+
+class CompiledSchema:
+    """Everything derived from an output model, built once per model: its
+    strict JSON schema for the LLM api, and validators for the whole object
+    and for each of its fields on its own.
+    """
+
+    __slots__ = ("name", "model", "json_schema", "text_format", "field_validators")
+
+    def __init__(self, name: str, model: type[BaseModel]):
+        self.name = name
+        self.model = model
+        self.json_schema = _strict(model.model_json_schema())
+        self.text_format = {
+            "format": {
+                "type": "json_schema",
+                "name": name,
+                "schema": self.json_schema,
+                "strict": True,
+            }
+        }
+        self.field_validators = {
+            field_name: TypeAdapter(field.annotation)
+            for field_name, field in model.model_fields.items()
+        }
+
+    def validate_field(self, name: str, value: Any) -> Any:
+        """`value` of field `name`, validated and dumped back to JSON types."""
+        adapter = self.field_validators.get(name)
+
+        if adapter is None:
+            raise ValueError(f"Unexpected field {name!r}.")
+        return adapter.dump_python(adapter.validate_python(value), mode="json")
+
+    def validate(self, data: Any) -> dict:
+        return self.model.model_validate(data).model_dump(mode="json")
+
+
+def _strict(schema: Any) -> Any:
+    # Strict mode wants every property required and no extra ones.
+    if isinstance(schema, list):
+        return [_strict(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    strict = {}
+
+    for key, value in schema.items():
+        if key in _UNSUPPORTED_KEYWORDS:
+            continue
+
+        if key in _SCHEMA_MAPS and isinstance(value, dict):
+            strict[key] = {name: _strict(subschema) for name, subschema in value.items()}
+        elif key in _VALUE_KEYWORDS:
+            strict[key] = value
+        else:
+            strict[key] = _strict(value)
+    schema = strict
+
+    if "properties" in schema:
+        schema["required"] = list(schema["properties"])
+        schema["additionalProperties"] = False
+    return schema
+
+
+@functools.lru_cache(maxsize=None)
+def compile_schema(name: str, model: type[BaseModel]) -> CompiledSchema:
+    return CompiledSchema(name, model)
+
+
+class SchemaRegistry:
+    def __init__(self):
+        self._models: dict[str, type[BaseModel]] = {}
+
+    def register(self, name: str, model: type[BaseModel]) -> type[BaseModel]:
+        self._models[name] = model
+        return model
+
+    def get(self, name: str) -> CompiledSchema | None:
+        model = self._models.get(name)
+        return None if model is None else compile_schema(name, model)
+
+    def names(self) -> list[str]:
+        return list(self._models)
+
+
+class IncrementalJSONParser:
+    """Parser of a JSON object arriving in chunks, which returns each of its
+    top-level fields as soon as the field's value is complete.
+
+    Only the new characters of every chunk are scanned. Strings, objects and
+    arrays close with their last character; numbers, booleans and null with
+    the comma or brace after them.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._key: str | None = None
+        self._key_start: int | None = None
+        self._value_start: int | None = None
+        # Next in the object: "first key", "key", ":", "value" or ",".
+        self._expecting = "first key"
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        """Consume `chunk`, and return the fields it completed, in order.
+
+        Raises:
+            ValueError: If the text is not a valid JSON object.
+        """
+        self.text += chunk
+        text = self.text
+        fields = []
+        position = self._position
+
+        while position < len(text) and not self.done:
+            char = text[position]
+            position += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+
+                    if self._depth == 1 and self._value_start is None:
+                        self._key = json.loads(text[self._key_start : position])
+                        self._expecting = ":"
+                    elif self._depth == 1:
+                        fields.append(self._field(position))
+                continue
+
+            if char.isspace():
+                continue
+
+            if self._depth == 0:
+                if char != "{":
+                    raise ValueError("Expected a JSON object.")
+                self._depth = 1
+                continue
+
+            if self._depth > 1:
+                # Inside a field's object or array value.
+                if char == '"':
+                    self._in_string = True
+                elif char in "{[":
+                    self._depth += 1
+                elif char in "}]":
+                    self._depth -= 1
+
+                    if self._depth == 1:
+                        fields.append(self._field(position))
+                continue
+
+            if self._value_start is not None and char in ",}":
+                fields.append(self._field(position - 1))
+
+            if char == "}":
+                if self._expecting not in ("first key", ","):
+                    raise ValueError(f"Unexpected '}}' at position {position - 1}.")
+                self._depth = 0
+                self.done = True
+            elif self._value_start is not None:
+                continue  # the rest of a number, boolean or null
+            elif char == ":" and self._expecting == ":":
+                self._expecting = "value"
+            elif char == "," and self._expecting == ",":
+                self._expecting = "key"
+            elif char == '"' and self._expecting in ("first key", "key"):
+                self._in_string = True
+                self._key_start = position - 1
+            elif self._expecting == "value" and char not in ":,]":
+                self._value_start = position - 1
+
+                if char == '"':
+                    self._in_string = True
+                elif char in "{[":
+                    self._depth += 1
+            else:
+                raise ValueError(f"Unexpected {char!r} at position {position - 1}.")
+
+        self._position = position
+        return fields
+
+    def _field(self, end: int) -> tuple[str, Any]:
+        # `json.loads` raises `ValueError` on malformed values.
+        field = (self._key, json.loads(self.text[self._value_start : end]))
+        self._key = self._value_start = None
+        self._expecting = ","
+        return field
+
+
+async def stream_fields(
+    response: AsyncGenerator, schema: CompiledSchema, started: float
+) -> AsyncGenerator[str, None]:
+    """SSE frames of a structured output: a `field` event per top-level field
+    as soon as it is complete and valid, then `done` with the whole object.
+    """
+    parser = IncrementalJSONParser()
+    output_tokens = None
+    first_delta = True
+
+    async with contextlib.aclosing(response) as events:
+        try:
+            async for event in events:
+                if event.type in ("response.failed", "error"):
+                    yield format_sse({"message": "Generation failed."}, event="error")
+                    return
+
+                if event.type == "response.output_text.delta":
+                    if first_delta:
+                        first_delta = False
+                        metrics.LLM_TIME_TO_FIRST_TOKEN.observe(time.monotonic() - started)
+
+                    for name, value in parser.feed(event.delta):
+                        value = schema.validate_field(name, value)
+                        yield format_sse({"name": name, "value": value}, event="field")
+
+                elif event.type in ("response.completed", "response.incomplete"):
+                    usage = getattr(event.response, "usage", None)
+                    output_tokens = usage and usage.output_tokens
+                    break
+        except ValueError as exc:
+            # Malformed JSON, or a field failing validation; pydantic's errors included.
+            logger.warning("Invalid structured output for {}: {}", schema.name, exc)
+            yield format_sse({"message": "Invalid structured output."}, event="error")
+            return
+        except Exception as exc:
+            logger.error("Error occured during streaming: {!r}", exc)
+            yield format_sse({"message": "Generation failed."}, event="error")
+            return
+
+    if not parser.done:
+        # Most likely cut off by the output token limit.
+        yield format_sse({"message": "Incomplete structured output."}, event="error")
+        return
+
+    try:
+        result = schema.validate(json.loads(parser.text))
+    except ValueError as exc:
+        logger.warning("Invalid structured output for {}: {}", schema.name, exc)
+        yield format_sse({"message": "Invalid structured output."}, event="error")
+        return
+
+    yield format_sse({"result": result, "output_tokens": output_tokens}, event="done")
+
+
+schema_registry = SchemaRegistry()
+schema_registry.register("user", User)
@@ -1,12 +1,95 @@
+"""
+Prompt templates. Each `<name>.md.j2` is the static part of a system prompt:
+it is compiled and rendered once, without variables, so that it stays
+byte-stable and first in the prompt, where provider-side prompt caching keeps
+hitting on it. Per-request variables, like the date, locale or user profile,
+are rendered from `context.md.j2` and appended after it.
+
+"""
+
+import datetime
+import hashlib
 from pathlib import Path
 
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, Template
+
+from app.config import settings
+
 PROMPT_DIR = Path(__file__).resolve().parent
+CONTEXT_TEMPLATE = "context.md.j2"
+
+CUSTOM_SYSTEM_PROMPT = "custom_system_prompt"
+OWM_TOOL_SYSTEM_PROMPT = "owm_tool_system_prompt"
+STRUCTURED_OUTPUT_SYSTEM_PROMPT = "structured_output_system_prompt"
+
+
+class PromptTemplates:
+    """Compiled prompt templates, with the static parts rendered once.
+
+    With `auto_reload`, templates changed on disk are recompiled on next use.
+    With `include_date`, today's date is added to the context of each prompt.
+    """
+
+    def __init__(self, directory: Path, auto_reload: bool = False, include_date: bool = False):
+        self.include_date = include_date
+        self.env = Environment(
+            loader=FileSystemLoader(directory),
+            auto_reload=auto_reload,
+            # A variable in a static part would be rendered empty, and vary unnoticed.
+            undefined=StrictUndefined,
+            trim_blocks=True,
+        )
+        self._static: dict[str, tuple[Template, str, str]] = {}
+
+    def _load(self, name: str) -> tuple[Template, str, str]:
+        # `get_template` returns the compiled template, recompiled only when reloaded.
+        template = self.env.get_template(f"{name}.md.j2")
+        loaded = self._static.get(name)
+
+        if loaded is None or loaded[0] is not template:
+            text = template.render()
+            digest = hashlib.sha256(text.encode()).hexdigest()[:12]
+            loaded = self._static[name] = (template, text, f"{name}:{digest}")
+        return loaded
+
+    def static(self, name: str) -> str:
+        return self._load(name)[1]
+
+    def cache_key(self, name: str) -> str:
+        """`prompt_cache_key` of the static part, changing only with its text."""
+        return self._load(name)[2]
+
+    def render(self, name: str, **variables) -> str:
+        """The static part of `name`, followed by the context for `variables`.
+
+        With `include_date`, the date is filled in unless given, `None` leaves it
+        out. It is off by default: the prompt, and so the completion cache keys
+        made from it, would change every day.
+        """
+        if self.include_date:
+            variables.setdefault("date", datetime.date.today().isoformat())
+        variables = {key: value for key, value in variables.items() if value is not None}
+        context = self.env.get_template(CONTEXT_TEMPLATE).render(**variables).strip()
 
-with open(PROMPT_DIR / "custom_system_prompt.md.j2", "r") as file:
-    CUSTOM_SYSTEM_PROMPT = file.read()
+        if not context:
+            return self.static(name)
+        return f"{self.static(name)}\n\n{context}"
 
-with open(PROMPT_DIR / "owm_tool_system_prompt.md.j2", "r") as file:
-    OWM_TOOL_SYSTEM_PROMPT = file.read()
 
-__all__ = ["CUSTOM_SYSTEM_PROMPT", "OWM_TOOL_SYSTEM_PROMPT"]
+prompts = PromptTemplates(
+    PROMPT_DIR,
+    auto_reload=(
+        settings.prompts.AUTO_RELOAD
+        if settings.prompts.AUTO_RELOAD is not None
+        else settings.logging.PROFILE == "development"
+    ),
+    include_date=settings.prompts.INCLUDE_DATE,
+)
 
+__all__ = [
+    "CUSTOM_SYSTEM_PROMPT",
+    "OWM_TOOL_SYSTEM_PROMPT",
+    "STRUCTURED_OUTPUT_SYSTEM_PROMPT",
+    "PromptTemplates",
+    "prompts",
+]
@@ -1,4 +1,157 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+from fastapi import HTTPException, Request, status
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+from app.config import settings
+from app.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the app runs as a single worker anyway
+    fcntl = None
+
+
+def get_client_id(request: Request) -> str:
+    # Only known keys count, otherwise a new random key per request would get
+    # a fresh budget each time. Keys are hashed, never kept in limiter state.
+    api_key = request.headers.get(settings.rate_limit.CLIENT_ID_HEADER)
+
+    if api_key is None:
+        authorization = request.headers.get("Authorization", "")
+        api_key = authorization.removeprefix("Bearer ") if authorization else None
+
+    if api_key:
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+
+        if key_hash in settings.rate_limit.API_KEY_HASHES:
+            return "key:" + key_hash[:24]
+    return "ip:" + get_remote_address(request)
+
+
+limiter = Limiter(key_func=get_client_id, enabled=settings.rate_limit.ENABLED)
+
+
+# slot layout: client key hash, tokens left, last update (unix time)
+_SLOT = struct.Struct("<Qdd")
+
+
+class SharedTokenBucket:
+    """Per-client token buckets kept in a memory-mapped file, so that all
+    workers on the host share one budget per client. Only this token budget
+    is shared: the per-route request limits of `limiter` stay per worker.
+
+    Buckets live in a fixed-size open addressing table. A bucket that has
+    refilled completely carries no state, so its slot can be reused.
+    """
+
+    def __init__(
+        self, path: str, rate: float, capacity: float, slots: int, max_probes: int = 16
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.slots = slots
+        self.max_probes = max_probes
+        size = slots * _SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        with self._locked():
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+
+        self._map = mmap.mmap(self._fd, size)
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _find_slot(self, key_hash: int, now: float) -> int | None:
+        reusable = None
+        start = key_hash % self.slots
+
+        for probe in range(self.max_probes):
+            offset = (start + probe) % self.slots * _SLOT.size
+            stored_hash, tokens, updated_at = _SLOT.unpack_from(self._map, offset)
+
+            if stored_hash == key_hash:
+                return offset
+
+            if reusable is None and (
+                stored_hash == 0 or tokens + (now - updated_at) * self.rate >= self.capacity
+            ):
+                reusable = offset
+
+            # Keys are never stored past an empty slot.
+            if stored_hash == 0:
+                break
+
+        return reusable
+
+    def consume(self, key: str, cost: float) -> float:
+        """Charge `cost` tokens to `key`.
+
+        Returns 0 when charged, otherwise the seconds until the cost would fit.
+        """
+        # A request bigger than the bucket drains it, instead of never fitting.
+        cost = min(cost, self.capacity)
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest()) or 1
+        now = time.time()
+
+        with self._locked():
+            offset = self._find_slot(key_hash, now)
+
+            if offset is None:
+                logger.warning("Rate limiter table is saturated, request let through.")
+                return 0.0
+
+            stored_hash, tokens, updated_at = _SLOT.unpack_from(self._map, offset)
+
+            if stored_hash == key_hash:
+                tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            else:
+                tokens = self.capacity
+
+            if tokens >= cost:
+                _SLOT.pack_into(self._map, offset, key_hash, tokens - cost, now)
+                return 0.0
+
+            _SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+            return (cost - tokens) / self.rate
+
+
+token_limiter = SharedTokenBucket(
+    path=settings.rate_limit.SHM_PATH,
+    rate=settings.rate_limit.TOKENS_PER_MINUTE / 60,
+    capacity=settings.rate_limit.BURST_TOKENS,
+    slots=settings.rate_limit.SLOTS,
+)
+
+
+def charge_tokens(request: Request, tokens: int) -> None:
+    """Charge estimated prompt and output tokens to the client's budget."""
+    if not settings.rate_limit.ENABLED:
+        return
+
+    retry_after = token_limiter.consume(get_client_id(request), tokens)
+
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Token rate limit exceeded, request costs ~{tokens} tokens.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
@@ -0,0 +1,39 @@
+"""
+Production entrypoint: `python -m app.server`.
+
+Runs `SERVER_WORKERS` worker processes, on uvloop and httptools when they are
+installed. On SIGTERM the workers stop accepting connections and give
+in-flight requests, streams included, up to `SERVER_DRAIN_TIMEOUT` seconds to
+finish before shutting down.
+
+"""
+
+import importlib.util
+import os
+
+# Read by the settings of this process and of every worker it spawns.
+os.environ.setdefault("LOG_PROFILE", "production")
+
+import uvicorn  # noqa: E402
+
+from app.config import settings  # noqa: E402
+
+
+def main() -> None:
+    uvicorn.run(
+        "app.main:app",
+        host=settings.server.HOST,
+        port=settings.server.PORT,
+        workers=settings.server.WORKERS,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        timeout_graceful_shutdown=settings.server.DRAIN_TIMEOUT,
+        timeout_keep_alive=settings.server.KEEP_ALIVE_TIMEOUT,
+        # Requests are logged, with their ids, by the app itself.
+        access_log=False,
+        log_level=(settings.logging.LEVEL or "info").lower(),
+    )
+
+
+if __name__ == "__main__":
+    main()
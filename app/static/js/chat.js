@@ -0,0 +1,99 @@
+// All forms share one WebSocket, requests and replies are tagged with ids.
+const channel = {socket: null, nextId: 0, handlers: new Map(), active: new Map()}
+
+function connect() {
+    const url = new URL('api/v1/predict/ws', location.href)
+    url.protocol = location.protocol === 'https:' ? 'wss:' : 'ws:'
+    const socket = new WebSocket(url)
+
+    socket.addEventListener('message', (e) => {
+        const message = JSON.parse(e.data)
+        const handler = channel.handlers.get(message.id)
+
+        if (handler) {
+            handler(message.event, message.data)
+        }
+        if (['result', 'done', 'error', 'cancelled'].includes(message.event)) {
+            channel.handlers.delete(message.id)
+        }
+    })
+    socket.addEventListener('close', () => {
+        // Requests in flight are lost with the connection.
+        for (const handler of channel.handlers.values()) {
+            handler('error', {message: 'Connection closed.'})
+        }
+        channel.handlers.clear()
+        channel.socket = null
+    })
+    channel.socket = new Promise((resolve) => {
+        socket.addEventListener('open', () => resolve(socket))
+    })
+    return channel.socket
+}
+
+async function send(type, input, handler) {
+    const socket = await (channel.socket || connect())
+    const id = String(channel.nextId++)
+    channel.handlers.set(id, handler)
+    socket.send(JSON.stringify({id, type, input}))
+    return id
+}
+
+async function cancel(id) {
+    const socket = await channel.socket
+
+    if (socket && channel.handlers.has(id)) {
+        socket.send(JSON.stringify({id, type: 'cancel'}))
+    }
+}
+
+async function handleSubmit(event, formType = "batch") {
+    event.preventDefault()
+    const form = event.target
+    const formData = new FormData(form)
+    const input = {user_prompt: formData.get('user-prompt')}
+    const maxTokens = parseInt(formData.get('max-tokens'), 10)
+    const container = document.getElementById(formType + '-response')
+
+    if (!Number.isNaN(maxTokens)) {
+        input.max_tokens = maxTokens
+    }
+    // A new submission replaces the one still running for the same form.
+    if (channel.active.has(formType)) {
+        await cancel(channel.active.get(formType))
+    }
+    container.innerText = ''
+
+    try {
+        const id = await send(formType, input, (name, data) => {
+            if (name === 'result') {
+                setBatchText(data.output, container)
+            } else if (name === 'delta') {
+                container.innerText += data.text.replace(/\*\*/g, "")
+            } else if (name === 'tool' && data.status === 'started') {
+                container.innerText += '[' + data.message + ']\n'
+            } else if (name === 'error') {
+                container.innerText += '\n[' + data.message + ']'
+            }
+        })
+        channel.active.set(formType, id)
+    } catch (err) {
+        console.error("WebSocket error:", err)
+    }
+}
+
+const converter = new Showdown.converter()
+
+function setBatchText(text, container) {
+    container.innerHTML = converter.makeHtml(text)
+}
+
+document.getElementById('batch-chat-form').addEventListener('submit', (e) => {
+    handleSubmit(e)
+})
+document.getElementById('stream-chat-form').addEventListener('submit', (e) => {
+    handleSubmit(e, "stream")
+})
+document.getElementById('weather-chat-form').addEventListener('submit', (e) => {
+    handleSubmit(e, "weather")
+})
@@ -0,0 +1,92 @@
+import asyncio
+import functools
+import re
+
+import tiktoken
+
+from app.config import settings
+from app.logger import logger
+
+
+MESSAGE_TOKEN_OVERHEAD = 4  # role and separators added around each message
+
+# Same split as the GPT pre-tokenizers: contractions, words, numbers, symbols, spaces.
+_PIECES = re.compile(
+    r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+"""
+)
+
+
+class TokenCounter:
+    """Counts and truncates text in model tokens.
+
+    Uses the `tiktoken` encoding once `load` has run, at startup. `tiktoken`
+    downloads its encoding files on first use, into `TIKTOKEN_CACHE_DIR`, so
+    loading runs in a worker thread with a timeout. Until then, or if the
+    files can't be fetched, counts are an estimate over pre-tokenized pieces,
+    which slightly overcounts so that limits are enforced conservatively.
+    """
+
+    def __init__(self, encoding_name: str):
+        self.encoding_name = encoding_name
+        self.encoding = None
+
+    def _load(self) -> None:
+        try:
+            encoding = tiktoken.get_encoding(self.encoding_name)
+        except Exception as exc:
+            logger.warning(
+                "Tokenizer {!r} unavailable ({!r}), falling back to estimated token counts.",
+                self.encoding_name,
+                exc,
+            )
+            return
+
+        self.encoding = encoding
+        self.count_static.cache_clear()  # estimates of the constant texts
+        logger.info("Tokenizer {!r} loaded.", self.encoding_name)
+
+    async def load(self, timeout: float) -> None:
+        try:
+            async with asyncio.timeout(timeout):
+                await asyncio.to_thread(self._load)
+        except TimeoutError:
+            # The thread can't be stopped: counts switch to the encoding if it
+            # ever finishes loading, and stay estimated until then.
+            logger.warning(
+                "Tokenizer {!r} not loaded within {}s, estimating token counts meanwhile.",
+                self.encoding_name,
+                timeout,
+            )
+
+    @staticmethod
+    def _estimate(piece: str) -> int:
+        # Common short words are one token, longer ones split every ~5 chars.
+        return max(1, (len(piece.strip()) + 2) // 5)
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return sum(self._estimate(piece) for piece in _PIECES.findall(text))
+
+    @functools.lru_cache(maxsize=64)
+    def count_static(self, text: str) -> int:
+        """Memoized `count`, for system prompts and other constant texts."""
+        return self.count(text)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode(tokens[:max_tokens])
+
+        kept, used = [], 0
+
+        for piece in _PIECES.findall(text):
+            used += self._estimate(piece)
+
+            if used > max_tokens:
+                break
+            kept.append(piece)
+        return "".join(kept)
+
+
+token_counter = TokenCounter(settings.llm.TOKENIZER_ENCODING)
@@ -1,48 +1,123 @@
+import asyncio
 import json
-import requests
+import time
+import httpx
 
+from app import metrics
+from app.cache import TTLCache
 from app.config import settings
+from app.logger import logger
 
 
-def get_current_weather_from_owm(location: str, unit_sys: str = "metric") -> str:
+weather_cache = TTLCache(
+    max_entries=settings.weather_api.CACHE_MAX_ENTRIES,
+    ttl=settings.weather_api.CACHE_TTL,
+)
+
+
+def create_owm_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.weather_api.OWM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.weather_api.OWM_POOL_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(settings.weather_api.OWM_REQUEST_TIMEOUT),
+    )
+
+
+def _unknown_weather(location: str) -> str:
+    return json.dumps(
+        {
+            "location": location,
+            "temperature": "unknown",
+            "description": "unknown",
+        }
+    )
+
+
+def _normalize_location(location: str) -> str:
+    return " ".join(location.split()).casefold()
+
+
+async def _fetch_weather_from_owm(
+    location: str, unit_sys: str, client: httpx.AsyncClient | None
+) -> str:
+    params = {
+        "q": location,
+        "appid": settings.weather_api.OWM_API_KEY,
+        "units": unit_sys,
+    }
+
+    started = time.monotonic()
+
+    try:
+        async with asyncio.timeout(settings.weather_api.OWM_REQUEST_TIMEOUT):
+            if client is None:
+                async with create_owm_client() as own_client:
+                    response = await own_client.get(
+                        settings.weather_api.BASE_URL, params=params
+                    )
+            else:
+                response = await client.get(settings.weather_api.BASE_URL, params=params)
+
+        response.raise_for_status()
+    except BaseException:
+        metrics.OWM_REQUEST_DURATION.labels("error").observe(time.monotonic() - started)
+        raise
+
+    elapsed = time.monotonic() - started
+    metrics.OWM_REQUEST_DURATION.labels("ok").observe(elapsed)
+    metrics.record_timing("owm", elapsed)
+
+    data = response.json()
+    return json.dumps(
+        {
+            "location": data["name"],
+            "country": data["sys"]["country"],
+            "temperature": data["main"]["temp"],
+            "humidity": data["main"]["humidity"],
+            "pressure": data["main"]["pressure"],
+            "pressure_unit": "hPa" if unit_sys == "metric" else "inHg",
+            "feels_like": data["main"]["feels_like"],
+            "wind_speed": data["wind"]["speed"],
+            "description": data["weather"][0]["description"],
+            "temperature_unit": "°C"
+            if unit_sys == "metric"
+            else "°F"
+            if unit_sys == "imperial"
+            else "K",
+            "speed_unit": "m/s" if unit_sys == "metric" else "mph",
+        }
+    )
+
+
+async def get_current_weather_from_owm(
+    location: str, unit_sys: str = "metric", client: httpx.AsyncClient | None = None
+) -> str:
     """Get current weather information for a given location.
 
+    Results are cached per normalized location and unit system, and concurrent
+    lookups of the same location share a single OWM call.
+
     Args:
         location (str): The location for which to retrieve weather information.
         unit_sys (str, optional): The unit system for the weather data. Defaults to "metric".
+        client (httpx.AsyncClient, optional): Pooled http client to reuse connections with.
 
     Returns:
         str: A JSON string containing the weather information.
     """
-    base_url, api_key = settings.weather_api.BASE_URL, settings.weather_api.OWM_API_KEY
-    url = f"{base_url}q={location}&appid={api_key}&units={unit_sys}"
-    response = requests.get(url, timeout=10)
-
-    if response.status_code == 200:
-        data = response.json()
-        return json.dumps(
-            {
-                "location": data["name"],
-                "country": data["sys"]["country"],
-                "temperature": data["main"]["temp"],
-                "humidity": data["main"]["humidity"],
-                "pressure": data["main"]["pressure"],
-                "pressure_unit": "hPa" if unit_sys == "metric" else "inHg",
-                "feels_like": data["main"]["feels_like"],
-                "wind_speed": data["wind"]["speed"],
-                "description": data["weather"][0]["description"],
-                "temperature_unit": "°C"
-                if unit_sys == "metric"
-                else "°F"
-                if unit_sys == "imperial"
-                else "K",
-                "speed_unit": "m/s" if unit_sys == "metric" else "mph",
-            }
+    key = (_normalize_location(location), unit_sys)
+
+    try:
+        return await weather_cache.get_or_load(
+            key, lambda: _fetch_weather_from_owm(location, unit_sys, client)
         )
-    return json.dumps(
-        {
-            "location": location,
-            "temperature": "unknown",
-            "description": "unknown",
-        }
-    )
+    except (TimeoutError, httpx.HTTPError) as exc:
+        # The request url carries the api key, so it's kept out of the logs.
+        status_code = getattr(getattr(exc, "response", None), "status_code", None)
+        logger.warning(
+            "OWM lookup for {!r} failed: {} {}", location, type(exc).__name__, status_code or ""
+        )
+        return _unknown_weather(location)
+
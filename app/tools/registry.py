@@ -0,0 +1,189 @@
+"""
+Registry of the tools the model can call. Each tool declares its json-schema,
+a timeout, whether its results may be cached and whether it is async.
+Optionally a progress message, shown to streaming clients while it runs.
+
+"""
+
+import asyncio
+import inspect
+import json
+from typing import Any, Callable
+
+from app.cache import TTLCache
+from app.config import settings
+from app.logger import logger
+from app.tools.definitions import GET_CURRENT_WEATHER_FROM_OWM
+from app.tools.functions import get_current_weather_from_owm
+
+
+class Tool:
+    """A function the model can call, with its json-schema definition.
+
+    `context` maps keyword arguments filled in by the caller rather than by
+    the model, e.g. pooled http clients, to their keys in the call context.
+    Sync functions run in a thread.
+    """
+
+    __slots__ = (
+        "definition", "function", "timeout", "cacheable", "cache", "is_async",
+        "context", "semaphore", "return_direct", "progress",
+    )
+
+    def __init__(
+        self,
+        definition: dict,
+        function: Callable[..., Any],
+        timeout: float | None = None,
+        cacheable: bool = False,
+        cache_ttl: float | None = None,
+        is_async: bool | None = None,
+        context: dict[str, str] | None = None,
+        max_concurrency: int | None = None,
+        return_direct: bool = False,
+        progress: str | None = None,  # formatted with the call arguments
+    ):
+        self.definition = definition
+        self.function = function
+        self.timeout = timeout or settings.tools.DEFAULT_TIMEOUT
+        self.cacheable = cacheable
+        self.cache = (
+            TTLCache(
+                ttl=cache_ttl or settings.tools.CACHE_TTL,
+                max_entries=settings.tools.CACHE_MAX_ENTRIES,
+            )
+            if cacheable
+            else None
+        )
+        self.is_async = inspect.iscoroutinefunction(function) if is_async is None else is_async
+        self.context = context or {}
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.return_direct = return_direct or definition["name"] in settings.tools.RETURN_DIRECT
+        self.progress = progress
+
+    @property
+    def name(self) -> str:
+        return self.definition["name"]
+
+    async def __call__(self, arguments: dict, context: dict) -> str:
+        kwargs = {**arguments, **{arg: context.get(key) for arg, key in self.context.items()}}
+
+        async def call() -> str:
+            if self.is_async:
+                return await self.function(**kwargs)
+            return await asyncio.to_thread(self.function, **kwargs)
+
+        async def limited() -> str:
+            if self.semaphore is None:
+                return await call()
+            async with self.semaphore:
+                return await call()
+
+        async with asyncio.timeout(self.timeout):
+            if self.cache is None:
+                return await limited()
+            # Identical calls, in one turn or across requests, share the result.
+            key = json.dumps(arguments, sort_keys=True)
+            return await self.cache.get_or_load(key, limited)
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools: dict[str, Tool] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def register(self, tool: Tool) -> Tool:
+        self._tools[tool.name] = tool
+        return tool
+
+    def get(self, name: str) -> Tool | None:
+        return self._tools.get(name)
+
+    def definitions(self, names: list[str] | None = None) -> list[dict]:
+        """Json-schemas of the `names` tools, or of all of them, for the LLM api."""
+        return [
+            tool.definition
+            for name, tool in self._tools.items()
+            if names is None or name in names
+        ]
+
+    def describe(self, name: str, arguments: str) -> str:
+        """Human-readable progress message of a tool call."""
+        tool = self._tools.get(name)
+
+        if tool is None or tool.progress is None:
+            return f"Calling {name}…"
+
+        try:
+            return tool.progress.format(**json.loads(arguments or "{}"))
+        except (ValueError, TypeError, KeyError, IndexError):
+            return f"Calling {name}…"
+
+    async def call(self, name: str, arguments: str, context: dict | None = None) -> str:
+        """Run one tool call of the model. Failures are returned to the model as
+        an error output, so one bad call does not fail the others.
+        """
+        tool = self._tools.get(name)
+
+        if tool is None:
+            return json.dumps({"error": f"Unknown tool {name!r}."})
+
+        try:
+            parsed = json.loads(arguments or "{}")
+        except json.JSONDecodeError:
+            return json.dumps({"error": "Arguments are not valid JSON."})
+
+        if not isinstance(parsed, dict):
+            return json.dumps({"error": "Arguments must be a JSON object."})
+
+        try:
+            return await tool(parsed, context or {})
+        except TimeoutError:
+            logger.warning("Tool {} timed out after {}s", name, tool.timeout)
+            return json.dumps({"error": f"Tool {name!r} timed out."})
+        except TypeError as exc:
+            # Arguments that don't match the function signature.
+            return json.dumps({"error": f"Invalid arguments: {exc}"})
+        except Exception as exc:
+            logger.warning("Tool {} failed: {!r}", name, exc)
+            return json.dumps({"error": f"Tool {name!r} failed."})
+
+    async def call_many(
+        self, calls: list[tuple[str, str]], context: dict | None = None
+    ) -> list[str]:
+        """Run all tool calls of one model turn concurrently.
+
+        Args:
+            calls (list[tuple[str, str]]): Pairs of tool name and JSON arguments.
+            context (dict, optional): Caller-provided values, e.g. http clients.
+
+        Returns:
+            list[str]: Tool outputs, in the order of `calls`.
+        """
+        return await asyncio.gather(
+            *(self.call(name, arguments, context) for name, arguments in calls)
+        )
+
+    def stats(self) -> dict:
+        return {
+            name: tool.cache.stats() for name, tool in self._tools.items() if tool.cache is not None
+        }
+
+
+tool_registry = ToolRegistry()
+
+tool_registry.register(
+    Tool(
+        GET_CURRENT_WEATHER_FROM_OWM,
+        get_current_weather_from_owm,
+        # Lookups time out on their own and answer with unknown weather.
+        timeout=settings.weather_api.OWM_REQUEST_TIMEOUT + 1,
+        # Lookups are already cached, per normalized location, in `weather_cache`.
+        cacheable=False,
+        context={"client": "owm_client"},
+        max_concurrency=settings.weather_api.MAX_CONCURRENT_LOOKUPS,
+        progress="Looking up {location}…",
+    )
+)
@@ -0,0 +1,84 @@
+"""
+Benchmark of per-request overhead of logging: disabled, development profile,
+and production profile with sampled request logs. Requests go through the
+whole app in-process, against a stub LLM client answering at once.
+
+Run with: `PYTHONPATH=. python scripts/bench_logging.py`
+
+"""
+
+import asyncio
+import contextlib
+import os
+import statistics
+import tempfile
+import time
+import types
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("OWM_API_KEY", "bench")
+os.environ.setdefault("COMPLETION_CACHE_ENABLED", "false")
+os.environ.setdefault("RATE_LIMIT_TOKENS_PER_MINUTE", "1000000000")
+os.environ.setdefault("RATE_LIMIT_BURST_TOKENS", "1000000000")
+os.environ.setdefault("LOG_FILE_PATH", os.path.join(tempfile.mkdtemp(), "app.log"))
+
+import httpx  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.logger import init_logging, logger  # noqa: E402
+from app.main import app  # noqa: E402
+from app.predict.scheduler import ScheduledLLMClient, upstream_scheduler  # noqa: E402
+from app.rate_limiting import limiter  # noqa: E402
+
+
+class StubResponses:
+    async def create(self, **kwargs):
+        return types.SimpleNamespace(output_text="Nicolas Cage is an actor.")
+
+
+class StubClient:
+    responses = StubResponses()
+
+
+async def measure(name: str, requests: int = 3_000) -> None:
+    transport = httpx.ASGITransport(app=app)
+    timings = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(requests):
+            started = time.perf_counter_ns()
+            response = await client.post("/api/v1/predict/batch", json={})
+            timings.append(time.perf_counter_ns() - started)
+            assert response.status_code == 200, response.text
+
+    await logger.complete()
+    timings.sort()
+    print(
+        f"{name:<40} mean={statistics.mean(timings) / 1000:.0f}us "
+        f"p50={timings[len(timings) // 2] / 1000:.0f}us "
+        f"p99={timings[int(len(timings) * 0.99)] / 1000:.0f}us"
+    )
+
+
+async def main() -> None:
+    limiter.enabled = False
+    app.state.llm_client = ScheduledLLMClient(StubClient(), upstream_scheduler)
+    logger.remove()
+    await measure("warm-up")
+    await measure("logging off")
+
+    with open(os.devnull, "w") as devnull:
+        # Console sinks pick up `sys.stdout` when added, so they write to devnull.
+        with contextlib.redirect_stdout(devnull):
+            init_logging("development")
+        await measure("development profile")
+
+        settings.logging.REQUEST_SAMPLE_RATE = 0.01
+        with contextlib.redirect_stdout(devnull):
+            init_logging("production")
+        await measure("production profile, 1% request sample")
+        logger.remove()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+Benchmark of near-duplicate prompt lookups in `MinHashLSHIndex`.
+
+Run with: `PYTHONPATH=. python scripts/bench_near_duplicate_cache.py [entries]`
+
+"""
+
+import random
+import statistics
+import sys
+import time
+
+from app.predict.similarity import MinHashLSHIndex
+
+
+WORDS = (
+    "tell me about the history of weather in city river mountain music film actor "
+    "how why what when explain describe compare best worst famous small large old "
+    "new science art painting book novel war peace food wine coffee travel Paris "
+    "London Kyoto Bergamo Nicolas Cage ocean planet star galaxy code python rust"
+).split()
+
+
+def random_prompt(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 16))) + "?"
+
+
+def perturb(prompt: str, rng: random.Random) -> str:
+    # Casing, punctuation and whitespace only, i.e. what users retype.
+    words = prompt.rstrip("?").split()
+    words[0] = words[0].upper()
+    return "  ".join(words) + rng.choice([".", "!", " ?", ""])
+
+
+def main(entries: int = 100_000, queries: int = 2_000) -> None:
+    rng = random.Random(42)
+    index = MinHashLSHIndex(max_entries=entries)
+    prompts = [random_prompt(rng) for _ in range(entries)]
+
+    started = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        index.add(prompt, i)
+    build_time = time.perf_counter() - started
+
+    timings, hits = [], 0
+    for _ in range(queries):
+        if rng.random() < 0.5:
+            query = perturb(rng.choice(prompts), rng)
+        else:
+            query = random_prompt(rng)
+
+        started = time.perf_counter()
+        hits += index.lookup(query) is not None
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    print(f"entries: {len(index)}, build: {build_time:.1f}s")
+    print(f"lookups: {queries}, hits: {hits}")
+    print(
+        f"lookup ms: mean={statistics.mean(timings):.3f} "
+        f"p50={timings[len(timings) // 2]:.3f} "
+        f"p99={timings[int(len(timings) * 0.99)]:.3f}"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,72 @@
+"""
+Benchmark of the shared token-bucket rate limiter: overhead per request, and
+budget sharing between worker processes.
+
+Run with: `PYTHONPATH=. python scripts/bench_rate_limiter.py`
+
+"""
+
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("OWM_API_KEY", "bench")
+
+from app.rate_limiting import SharedTokenBucket  # noqa: E402
+
+
+def overhead(path: str, clients: int = 10_000, requests: int = 200_000) -> None:
+    bucket = SharedTokenBucket(path, rate=1e6, capacity=1e6, slots=65536)
+    keys = [f"key:{i}" for i in range(clients)]
+    timings = []
+
+    for i in range(requests):
+        started = time.perf_counter_ns()
+        bucket.consume(keys[i % clients], 150)
+        timings.append(time.perf_counter_ns() - started)
+
+    timings.sort()
+    print(
+        f"consume() over {clients} clients: mean={statistics.mean(timings) / 1000:.2f}us "
+        f"p50={timings[len(timings) // 2] / 1000:.2f}us "
+        f"p99={timings[int(len(timings) * 0.99)] / 1000:.2f}us"
+    )
+
+
+def worker(path: str, attempts: int, accepted) -> None:
+    # Refill is negligible, so only `capacity / cost` requests may pass in total.
+    bucket = SharedTokenBucket(path, rate=1e-9, capacity=10_000, slots=65536)
+    count = sum(bucket.consume("key:shared", 100) == 0 for _ in range(attempts))
+
+    with accepted.get_lock():
+        accepted.value += count
+
+
+def sharing(path: str, workers: int = 4, attempts: int = 1_000) -> None:
+    accepted = multiprocessing.Value("i", 0)
+    processes = [
+        multiprocessing.Process(target=worker, args=(path, attempts, accepted))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    print(
+        f"{workers} workers x {attempts} requests of 100 tokens, bucket of 10000: "
+        f"accepted={accepted.value} (expected 100)"
+    )
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        overhead(os.path.join(tmp, "overhead"))
+        sharing(os.path.join(tmp, "sharing"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Micro-benchmark of SSE frames produced by `stream_generator`, with and without
+delta coalescing, over a simulated upstream stream.
+
+Run with: `PYTHONPATH=. python scripts/bench_sse_coalescing.py`
+
+"""
+
+import asyncio
+import os
+import random
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("OWM_API_KEY", "bench")
+
+from app.config import settings  # noqa: E402
+from app.predict.deps import stream_generator  # noqa: E402
+
+
+async def fake_upstream(deltas: list[str], gap: float):
+    for delta in deltas:
+        if gap:
+            await asyncio.sleep(gap)
+        yield SimpleNamespace(type="response.output_text.delta", delta=delta)
+    yield SimpleNamespace(type="response.completed")
+
+
+async def run(deltas: list[str], gap: float, flush_bytes: int, flush_interval: float):
+    frames, size, first_frame_at = 0, 0, None
+    started = time.perf_counter()
+
+    async for frame in stream_generator(
+        fake_upstream(deltas, gap), flush_bytes=flush_bytes, flush_interval=flush_interval
+    ):
+        if first_frame_at is None:
+            first_frame_at = time.perf_counter()
+        frames += 1
+        size += len(frame.encode())
+
+    elapsed = time.perf_counter() - started
+    return frames, size, elapsed, first_frame_at - started
+
+
+def main() -> None:
+    rng = random.Random(0)
+    # Roughly token-sized deltas; the word count stays below OUTPUT_MAX_TOKENS.
+    deltas = ["".join(rng.choices("abcdefgh", k=rng.randint(2, 5))) for _ in range(600)]
+    modes = {
+        "frame per delta": (0, 0.0),
+        "coalesced": (settings.chat.SSE_FLUSH_BYTES, settings.chat.SSE_FLUSH_INTERVAL),
+    }
+
+    for gap in (0.0, 0.002):
+        print(f"upstream gap between deltas: {gap * 1000:.0f} ms")
+        for name, (flush_bytes, flush_interval) in modes.items():
+            frames, size, elapsed, ttft = asyncio.run(
+                run(deltas, gap, flush_bytes, flush_interval)
+            )
+            print(
+                f"  {name:>15}: frames={frames} frames/s={frames / elapsed:.0f} "
+                f"bytes/frame={size / frames:.1f} ttft_ms={ttft * 1000:.2f} "
+                f"total_ms={elapsed * 1000:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
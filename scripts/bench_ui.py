@@ -0,0 +1,110 @@
+"""
+Benchmark of `/ui` requests per second, in process: the page rendered with
+`TemplateResponse` on every request as before, and the pre-rendered page,
+sent gzipped or answered with a 304 for clients holding its ETag. The time
+spent building the response alone is measured too, as the middlewares and
+the transport take most of each request.
+
+Run with: `PYTHONPATH=. python scripts/bench_ui.py`
+
+"""
+
+import asyncio
+import os
+import time
+import timeit
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("OWM_API_KEY", "bench")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("LOG_FILE_PATH", "")
+os.environ.setdefault("LOG_PROFILE", "production")  # no per-request debug logs
+
+import httpx  # noqa: E402
+from fastapi import Request  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.main import STATIC_ASSETS, TEMPLATES, UI_PAGE, app  # noqa: E402
+
+
+def render(request: Request):
+    # `/ui` as it was, rendering the template on each request.
+    return TEMPLATES.TemplateResponse(
+        "index.html",
+        {
+            "request": request,
+            "asset": STATIC_ASSETS.url,
+            "minOutTokens": settings.chat.OUTPUT_MIN_TOKENS,
+            "maxOutTokens": settings.chat.OUTPUT_MAX_TOKENS,
+        },
+    )
+
+
+@app.get("/ui-rendered", include_in_schema=False)
+async def ui_rendered(request: Request):
+    return render(request)
+
+
+def make_request(headers: dict) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/ui",
+            "query_string": b"",
+            "headers": [(key.encode(), value.encode()) for key, value in headers.items()],
+        }
+    )
+
+
+def handlers(number: int = 20_000) -> None:
+    plain = make_request({})
+    gzipped = make_request({"accept-encoding": "gzip"})
+    conditional = make_request({"accept-encoding": "gzip", "if-none-match": UI_PAGE.etag("gzip")})
+
+    for name, build in (
+        ("rendered per request", lambda: render(plain)),
+        ("pre-rendered", lambda: UI_PAGE.response(plain)),
+        ("pre-rendered, gzip", lambda: UI_PAGE.response(gzipped)),
+        ("conditional, 304", lambda: UI_PAGE.response(conditional)),
+    ):
+        elapsed = timeit.timeit(build, number=number) / number
+        print(f"{name:<24} response built in {elapsed * 1e6:.1f}us")
+
+
+async def run(
+    client: httpx.AsyncClient, name: str, path: str, headers: dict, seconds: float = 3.0
+) -> None:
+    for _ in range(100):  # warm-up
+        await client.get(path, headers=headers)
+
+    requests, sent = 0, 0
+    started = time.perf_counter()
+
+    while time.perf_counter() - started < seconds:
+        response = await client.get(path, headers=headers)
+        requests += 1
+        sent += int(response.headers.get("content-length", 0))
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:<24} status={response.status_code} rps={requests / elapsed:>8.0f} "
+        f"bytes/response={sent // requests}"
+    )
+
+
+async def main() -> None:
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        etag = (await client.get("/ui", headers={"Accept-Encoding": "gzip"})).headers["etag"]
+
+        await run(client, "rendered per request", "/ui-rendered", {"Accept-Encoding": "identity"})
+        await run(client, "pre-rendered", "/ui", {"Accept-Encoding": "identity"})
+        await run(client, "pre-rendered, gzip", "/ui", {"Accept-Encoding": "gzip"})
+        await run(client, "conditional, 304", "/ui", {"Accept-Encoding": "gzip", "If-None-Match": etag})
+
+
+if __name__ == "__main__":
+    handlers()
+    asyncio.run(main())
@@ -0,0 +1,201 @@
+"""
+Load generator for `/batch`, `/stream`, `/weather` and `/weather/stream`. It keeps a target
+number of requests in flight and reports latency percentiles, time to first
+token and requests/sec per scenario. Results can be stored as a baseline, and
+later runs are compared against it, failing on regressions.
+
+Meant to run against the app backed by `scripts/mock_servers.py`:
+
+    PYTHONPATH=. python scripts/mock_servers.py --port 9000
+    BASE_URL=http://127.0.0.1:9000 OPENAI_API_KEY=mock OWM_API_KEY=mock \\
+        RATE_LIMIT_ENABLED=false LOG_PROFILE=production \\
+        uvicorn app.main:app --port 8000
+
+Run with: `PYTHONPATH=. python scripts/load_test.py --compare`
+
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "load_test.json"
+# Upper bounds for latencies, lower for throughput.
+LOWER_IS_BETTER = ("p50", "p95", "p99", "ttft_p50", "ttft_p95")
+HIGHER_IS_BETTER = ("rps",)
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def batch(client: httpx.AsyncClient, i: int) -> tuple[int, float | None]:
+    response = await client.post(
+        "/api/v1/predict/batch",
+        json={"user_prompt": f"Tell me about Nicolas Cage. ({i})", "use_cache": False},
+    )
+    return response.status_code, None
+
+
+async def read_sse(
+    client: httpx.AsyncClient, path: str, request: dict
+) -> tuple[int, float | None]:
+    started, first_token = time.monotonic(), None
+
+    async with client.stream("POST", path, json=request) as response:
+        async for chunk in response.aiter_text():
+            if first_token is None and "event: delta" in chunk:
+                first_token = time.monotonic() - started
+    return response.status_code, first_token
+
+
+async def stream(client: httpx.AsyncClient, i: int) -> tuple[int, float | None]:
+    request = {"user_prompt": f"Tell me about Nicolas Cage. ({i})", "use_cache": False}
+    return await read_sse(client, "/api/v1/predict/stream", request)
+
+
+async def weather(client: httpx.AsyncClient, i: int) -> tuple[int, float | None]:
+    response = await client.post(
+        "/api/v1/predict/weather", json={"user_prompt": "Bergamo, Italy and Warsaw, Poland"}
+    )
+    return response.status_code, None
+
+
+async def weather_stream(client: httpx.AsyncClient, i: int) -> tuple[int, float | None]:
+    request = {"user_prompt": "Bergamo, Italy and Warsaw, Poland"}
+    return await read_sse(client, "/api/v1/predict/weather/stream", request)
+
+
+SCENARIOS = {
+    "batch": batch,
+    "stream": stream,
+    "weather": weather,
+    "weather_stream": weather_stream,
+}
+
+
+async def run_scenario(name: str, url: str, concurrency: int, requests: int) -> dict:
+    send = SCENARIOS[name]
+    counter = itertools.count()
+    latencies, ttfts, errors = [], [], {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+
+        async def worker() -> None:
+            while (i := next(counter)) < requests:
+                started = time.monotonic()
+
+                try:
+                    status_code, ttft = await send(client, i)
+                except httpx.HTTPError as exc:
+                    status_code, ttft = type(exc).__name__, None
+
+                if status_code != 200:
+                    errors[str(status_code)] = errors.get(str(status_code), 0) + 1
+                    continue
+
+                latencies.append(time.monotonic() - started)
+                if ttft is not None:
+                    ttfts.append(ttft)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2),
+        **{f"p{q}": percentile(latencies, q / 100) for q in (50, 95, 99)},
+        "ttft_p50": percentile(ttfts, 0.5),
+        "ttft_p95": percentile(ttfts, 0.95),
+    }
+
+
+def compare(name: str, result: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+
+    if baseline.get("concurrency") != result["concurrency"]:
+        print(f"{name}: baseline was taken at another concurrency, not compared.")
+        return regressions
+
+    for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        current, reference = result.get(metric), baseline.get(metric)
+
+        if current is None or reference is None:
+            continue
+        if metric in LOWER_IS_BETTER and current > reference * (1 + tolerance):
+            regressions.append(f"{name} {metric}: {current:.3f} > baseline {reference:.3f}")
+        if metric in HIGHER_IS_BETTER and current < reference * (1 - tolerance):
+            regressions.append(f"{name} {metric}: {current:.2f} < baseline {reference:.2f}")
+
+    if result["errors"]:
+        regressions.append(f"{name} errors: {result['errors']}")
+    return regressions
+
+
+def format_result(name: str, result: dict) -> str:
+    def ms(value: float | None) -> str:
+        return "-" if value is None else f"{value * 1000:.0f}ms"
+
+    return (
+        f"{name:<14} rps={result['rps']:<8} p50={ms(result['p50'])} p95={ms(result['p95'])} "
+        f"p99={ms(result['p99'])} ttft_p50={ms(result['ttft_p50'])} "
+        f"ttft_p95={ms(result['ttft_p95'])} errors={result['errors'] or 0}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test of the chat endpoints.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="per scenario")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slack")
+    args = parser.parse_args()
+
+    results = {}
+
+    for name in args.scenarios:
+        results[name] = await run_scenario(name, args.url, args.concurrency, args.requests)
+        print(format_result(name, results[name]))
+
+    if args.save_baseline:
+        stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({**stored, **results}, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}.")
+
+    if args.compare:
+        baselines = json.loads(args.baseline.read_text())
+        regressions = [
+            regression
+            for name, result in results.items()
+            if name in baselines
+            for regression in compare(name, result, baselines[name], args.tolerance)
+        ]
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
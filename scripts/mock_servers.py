@@ -0,0 +1,238 @@
+"""
+Local stand-ins for the OpenAI Responses API and the OpenWeatherMap current
+weather endpoint, for load tests without paying for either.
+
+- `POST /responses` (and `/v1/responses`) answers batch and streamed requests,
+  generating tokens at `--token-rate` after `--first-token-delay`. Requests
+  with tools and no tool output yet get a function call per location in the
+  user prompt (split on "and", commas and semicolons), streamed or not.
+  Requests with a `json_schema` text format get a JSON object matching it.
+- `GET /data/2.5/weather?q=...` (and `GET /?q=...`) returns OWM-shaped weather
+  after `--owm-delay`.
+
+The app reads `BASE_URL` for both upstreams, so one server covers them:
+
+Run with: `PYTHONPATH=. python scripts/mock_servers.py --port 9000`
+and the app with: `BASE_URL=http://127.0.0.1:9000 OPENAI_API_KEY=mock OWM_API_KEY=mock ...`
+
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+app = FastAPI(title="Mock LLM and OWM servers")
+config = argparse.Namespace(
+    token_rate=50.0, first_token_delay=0.2, output_tokens=64, owm_delay=0.05
+)
+WORDS = (
+    "Nicolas Cage is an American actor known for his intense performances in films "
+    "such as Leaving Las Vegas, Face Off and National Treasure and the city offers "
+    "mild weather with a light breeze under a partly cloudy sky"
+).split()
+SEEN_CACHE_KEYS: set[str] = set()
+
+
+def _text(tokens: int) -> list[str]:
+    # One word per token, good enough for the app's token counting.
+    return [(" " if i else "") + WORDS[i % len(WORDS)] for i in range(tokens)]
+
+
+def _structured(schema: dict) -> list[str]:
+    # A JSON object matching the schema, split into token-sized chunks.
+    values = {"string": " ".join(WORDS[:3]), "number": 1.5, "integer": 1, "boolean": True}
+    text = json.dumps(
+        {
+            name: values.get(field.get("type"), None)
+            for name, field in schema.get("properties", {}).items()
+        }
+    )
+    return [text[i : i + 4] for i in range(0, len(text), 4)]
+
+
+def _usage(input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> dict:
+    return {
+        "input_tokens": input_tokens,
+        "input_tokens_details": {"cached_tokens": cached_tokens},
+        "output_tokens": output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": input_tokens + output_tokens,
+    }
+
+
+def _cached_tokens(body: dict) -> int:
+    # Like a provider's prefix cache: the system message is cached once its key was seen.
+    key = body.get("prompt_cache_key")
+    items = body.get("input", [])
+
+    if key is None or key not in SEEN_CACHE_KEYS or not items or not isinstance(items[0], dict):
+        SEEN_CACHE_KEYS.add(key)
+        return 0
+    return len(json.dumps(items[0])) // 4
+
+
+def _response(body: dict, output: list[dict], output_tokens: int | None) -> dict:
+    input_tokens = len(json.dumps(body.get("input", ""))) // 4
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "mock"),
+        "status": "completed",
+        "output": output,
+        "parallel_tool_calls": body.get("parallel_tool_calls", True),
+        "tool_choice": body.get("tool_choice", "auto"),
+        "tools": body.get("tools", []),
+        # Usage is only known once the response is done.
+        "usage": None
+        if output_tokens is None
+        else _usage(input_tokens, output_tokens, min(_cached_tokens(body), input_tokens)),
+    }
+
+
+def _message(text: str) -> dict:
+    return {
+        "type": "message",
+        "id": f"msg_{uuid.uuid4().hex}",
+        "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "text": text, "annotations": []}],
+    }
+
+
+def _function_calls(body: dict) -> list[dict] | None:
+    items = body.get("input", [])
+
+    if not body.get("tools") or any(
+        isinstance(item, dict) and item.get("type") == "function_call_output" for item in items
+    ):
+        return None
+
+    prompt = next(
+        (item["content"] for item in reversed(items) if isinstance(item, dict) and item.get("role") == "user"),
+        "",
+    )
+    locations = [part.strip() for part in re.split(r"\band\b|[,;]", prompt) if part.strip()]
+    return [
+        {
+            "type": "function_call",
+            "id": f"fc_{uuid.uuid4().hex}",
+            "call_id": f"call_{uuid.uuid4().hex}",
+            "name": "get_current_weather_from_owm",
+            "arguments": json.dumps({"location": location, "unit_sys": "metric"}),
+            "status": "completed",
+        }
+        for location in locations or ["Bergamo"]
+    ]
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def _stream(body: dict, tokens: list[str]):
+    sequence = iter(range(1_000_000))
+    item_id = f"msg_{uuid.uuid4().hex}"
+    yield _sse({"type": "response.created", "sequence_number": next(sequence), "response": _response(body, [], None)})
+    await asyncio.sleep(config.first_token_delay)
+    function_calls = _function_calls(body)
+
+    if function_calls is not None:
+        for index, item in enumerate(function_calls):
+            yield _sse(
+                {
+                    "type": "response.output_item.done",
+                    "sequence_number": next(sequence),
+                    "output_index": index,
+                    "item": item,
+                }
+            )
+
+        response = _response(body, function_calls, 16 * len(function_calls))
+        yield _sse({"type": "response.completed", "sequence_number": next(sequence), "response": response})
+        return
+
+    for i, token in enumerate(tokens):
+        if i:
+            await asyncio.sleep(1 / config.token_rate)
+        yield _sse(
+            {
+                "type": "response.output_text.delta",
+                "sequence_number": next(sequence),
+                "item_id": item_id,
+                "output_index": 0,
+                "content_index": 0,
+                "delta": token,
+                "logprobs": [],
+            }
+        )
+
+    response = _response(body, [_message("".join(tokens))], len(tokens))
+    yield _sse({"type": "response.completed", "sequence_number": next(sequence), "response": response})
+
+
+@app.post("/responses")
+@app.post("/v1/responses")
+async def responses(request: Request):
+    body = await request.json()
+    tokens = _text(min(body.get("max_output_tokens") or config.output_tokens, config.output_tokens))
+    text_format = (body.get("text") or {}).get("format") or {}
+
+    if text_format.get("type") == "json_schema":
+        tokens = _structured(text_format.get("schema", {}))
+
+    if body.get("stream"):
+        return StreamingResponse(_stream(body, tokens), media_type="text/event-stream")
+
+    function_calls = _function_calls(body)
+
+    if function_calls is not None:
+        await asyncio.sleep(config.first_token_delay)
+        return _response(body, function_calls, 16 * len(function_calls))
+
+    await asyncio.sleep(config.first_token_delay + (len(tokens) - 1) / config.token_rate)
+    return _response(body, [_message("".join(tokens))], len(tokens))
+
+
+@app.get("/models")
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+
+@app.get("/")
+@app.get("/data/2.5/weather")
+async def weather(q: str = "Bergamo", units: str = "metric"):
+    await asyncio.sleep(config.owm_delay)
+    return {
+        "name": q.split(",")[0].strip().title(),
+        "sys": {"country": "IT"},
+        "main": {"temp": 21.5, "humidity": 60, "pressure": 1015, "feels_like": 21.0},
+        "wind": {"speed": 3.1},
+        "weather": [{"description": "scattered clouds"}],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock LLM and OWM servers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--token-rate", type=float, default=config.token_rate, help="tokens/s")
+    parser.add_argument("--first-token-delay", type=float, default=config.first_token_delay)
+    parser.add_argument("--output-tokens", type=int, default=config.output_tokens)
+    parser.add_argument("--owm-delay", type=float, default=config.owm_delay)
+    args = parser.parse_args()
+    vars(config).update({k: v for k, v in vars(args).items() if k in vars(config)})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
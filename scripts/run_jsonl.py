@@ -0,0 +1,151 @@
+"""
+Offline bulk inference over a JSONL file of prompts, e.g. `requests.jsonl`.
+
+Input lines are read one at a time and results are appended to the output
+file as they complete, each tagged with its input line number. Progress is
+checkpointed next to the output, so an interrupted run picks up where it left
+off when started again with the same arguments.
+
+Run with: `PYTHONPATH=. python scripts/run_jsonl.py requests.jsonl results.jsonl --field body`
+
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+from typing import Iterator
+
+from app.config import settings
+from app.logger import logger
+from app.predict import deps
+from app.predict.service import get_chat_inference_batch
+
+
+class Checkpoint:
+    """Progress of a run: every input line before `line` (which starts at byte
+    `offset`) is done, plus the lines in `done` after it. Output written past
+    `output_size` belongs to no checkpoint, and is dropped on resume.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.line, self.offset, self.output_size = 0, 0, 0
+        self.done: set[int] = set()
+        self.offsets: dict[int, int] = {}  # of lines read, but not yet checkpointed
+
+        if os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            self.line, self.offset = state["line"], state["offset"]
+            self.output_size, self.done = state["output_size"], set(state["done"])
+
+    def mark_done(self, line: int, next_offset: int) -> None:
+        self.done.add(line)
+
+        while self.line in self.done:
+            self.done.remove(self.line)
+            self.offsets.pop(self.line, None)
+            self.line += 1
+            self.offset = self.offsets.get(self.line, next_offset)
+
+    def save(self, output_size: int) -> None:
+        self.output_size = output_size
+        state = {
+            "line": self.line,
+            "offset": self.offset,
+            "output_size": output_size,
+            "done": sorted(self.done),
+        }
+        # Written aside and renamed, so a crash never leaves a torn checkpoint.
+        with open(self.path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def read_lines(file, checkpoint: Checkpoint) -> Iterator[tuple[int, bytes]]:
+    file.seek(checkpoint.offset)
+
+    for line in itertools.count(checkpoint.line):
+        offset = file.tell()
+        raw = file.readline()
+
+        if not raw:
+            return
+        if line in checkpoint.done:
+            continue
+        checkpoint.offsets[line] = offset
+        yield line, raw
+
+
+async def run_line(line: int, raw: bytes, field: str, max_tokens: int, llm_client) -> dict:
+    try:
+        record = json.loads(raw)
+        output = await get_chat_inference_batch(
+            record[field], record.get("max_tokens", max_tokens), llm_client=llm_client
+        )
+    except Exception as exc:
+        logger.error("Line {} failed: {!r}", line, exc)
+        return {"line": line, "error": repr(exc)}
+    return {"line": line, "id": record.get("id", record.get("request_id")), "output": output}
+
+
+async def run(args: argparse.Namespace) -> None:
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint")
+    llm_client = deps.create_llm_client()
+    pending: dict[asyncio.Task, int] = {}
+    completed = 0
+
+    with open(args.input, "rb") as source, open(args.output, "a+b") as sink:
+        sink.truncate(checkpoint.output_size)
+        sink.seek(0, os.SEEK_END)
+        lines = read_lines(source, checkpoint)
+
+        try:
+            while True:
+                for line, raw in itertools.islice(lines, args.concurrency - len(pending)):
+                    if raw.strip():
+                        task = run_line(line, raw, args.field, args.max_tokens, llm_client)
+                        pending[asyncio.ensure_future(task)] = line
+                    else:
+                        checkpoint.mark_done(line, source.tell())
+
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    line = pending.pop(task)
+                    sink.write(json.dumps(task.result(), ensure_ascii=False).encode() + b"\n")
+                    checkpoint.mark_done(line, source.tell())
+                    completed += 1
+
+                    if completed % args.checkpoint_every == 0:
+                        sink.flush()
+                        checkpoint.save(sink.tell())
+        finally:
+            for task in pending:
+                task.cancel()
+            sink.flush()
+            checkpoint.save(sink.tell())
+            await llm_client.close()
+
+    logger.info("{} lines processed, results in {}.", completed, args.output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file with one prompt record per line")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--field", default="user_prompt", help="record field with the prompt")
+    parser.add_argument("--max-tokens", type=int, default=settings.llm.MAX_TOKENS)
+    parser.add_argument("--concurrency", type=int, default=settings.chat.MULTI_PROMPT_CONCURRENCY)
+    parser.add_argument("--checkpoint", help="defaults to `<output>.checkpoint`")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="completed lines")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Pre-compressed static assets: content negotiation, ETags and 304s, and the
+`/ui` page linking the vendored libraries under their hashed urls.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import gzip
+import os
+import re
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+import brotli  # noqa: E402
+import httpx  # noqa: E402
+from fastapi import Request  # noqa: E402
+
+from app.assets import Asset  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def request(**headers) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "headers": [
+                (key.replace("_", "-").encode(), value.encode()) for key, value in headers.items()
+            ],
+        }
+    )
+
+
+class AssetTest(unittest.TestCase):
+    def setUp(self):
+        self.body = b"body { margin: 0 }\n" * 100
+        self.asset = Asset(self.body, "text/css")
+
+    def test_smallest_accepted_encoding(self):
+        self.assertEqual(self.asset.negotiate("gzip, deflate, br"), "br")
+        self.assertEqual(self.asset.negotiate("gzip"), "gzip")
+        self.assertEqual(self.asset.negotiate("br;q=0, gzip;q=0.5"), "gzip")
+        self.assertEqual(self.asset.negotiate("*"), "br")
+        self.assertEqual(self.asset.negotiate(""), "identity")
+        self.assertEqual(self.asset.negotiate("gzip;q=oops"), "identity")
+
+    def test_bodies_decompress_to_the_original(self):
+        self.assertEqual(gzip.decompress(self.asset.bodies["gzip"]), self.body)
+        self.assertEqual(brotli.decompress(self.asset.bodies["br"]), self.body)
+
+    def test_encodings_that_do_not_save_bytes_are_dropped(self):
+        self.assertEqual(list(Asset(b"x", "text/plain").bodies), ["identity"])
+
+    def test_response_per_encoding(self):
+        response = self.asset.response(request(accept_encoding="gzip"))
+
+        self.assertEqual(response.body, self.asset.bodies["gzip"])
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["etag"], f'"{self.asset.digest}-gzip"')
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+
+    def test_not_modified_for_any_encoding_of_the_body(self):
+        for tag in (f'"{self.asset.digest}"', f'W/"{self.asset.digest}-br"', '"other", *'):
+            response = self.asset.response(request(accept_encoding="gzip", if_none_match=tag))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.body, b"")
+
+        response = self.asset.response(request(if_none_match='"other"'))
+        self.assertEqual(response.status_code, 200)
+
+
+class UIPageTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        transport = httpx.ASGITransport(app=app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.addAsyncCleanup(self.client.aclose)
+
+    async def test_vendored_libraries_are_served(self):
+        page = await self.client.get("/ui")
+        urls = re.findall(r'(?:href|src)="(/static/[^"]+)"', page.text)
+
+        self.assertEqual(len(urls), 5)
+        self.assertTrue(any("/vendor/showdown/showdown." in url for url in urls))
+
+        for url in urls:
+            response = await self.client.get(url, headers={"Accept-Encoding": "br"})
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn("immutable", response.headers["cache-control"])
+
+    async def test_revalidated_with_etag(self):
+        page = await self.client.get("/ui", headers={"Accept-Encoding": "gzip"})
+        cached = await self.client.get(
+            "/ui", headers={"Accept-Encoding": "gzip", "If-None-Match": page.headers["etag"]}
+        )
+
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(page.headers["cache-control"], "no-cache")
+
+    async def test_unknown_asset(self):
+        response = await self.client.get("/static/js/missing.0123456789.js")
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
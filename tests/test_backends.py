@@ -0,0 +1,164 @@
+"""
+The pool of LLM backends: selection by weighted EWMA latency, the circuit
+breaker and its half-open trial, and failover after hedged requests.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+import httpx  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from openai import APIConnectionError  # noqa: E402
+
+from app.config import LLMBackend, settings  # noqa: E402
+from app.predict import backends  # noqa: E402
+from app.predict.backends import Backend, BackendPool  # noqa: E402
+
+
+def connection_error() -> APIConnectionError:
+    return APIConnectionError(request=httpx.Request("POST", "http://backend/v1/responses"))
+
+
+def make_backend(name: str, ewma: float | None = None, weight: float = 1.0, **create) -> Backend:
+    client = SimpleNamespace(responses=SimpleNamespace(create=mock.AsyncMock(**create)))
+    backend = Backend(LLMBackend(name=name, base_url=f"http://{name}/v1", weight=weight), client)
+    backend.ewma = ewma
+    return backend
+
+
+class BackendTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(settings.llm, "CIRCUIT_FAILURE_THRESHOLD", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend = make_backend("a")
+
+    def test_ewma(self):
+        with mock.patch.object(settings.llm, "LATENCY_EWMA_ALPHA", 0.5):
+            self.backend.record_success(1.0)
+            self.backend.record_success(3.0)
+        self.assertEqual(self.backend.ewma, 2.0)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.backend.record_failure()
+        self.backend.record_success(1.0)
+        self.backend.record_failure()
+        self.assertEqual(self.backend.circuit, "closed")
+
+        with mock.patch.object(backends.logger, "warning"):
+            self.backend.record_failure()
+        self.assertEqual(self.backend.circuit, "open")
+        self.assertFalse(self.backend.is_available())
+
+    def test_half_open_after_cooldown(self):
+        with mock.patch.object(backends.time, "monotonic", return_value=100.0):
+            with mock.patch.object(backends.logger, "warning"):
+                self.backend.record_failure()
+                self.backend.record_failure()
+        cooled_down = 100.0 + settings.llm.CIRCUIT_COOLDOWN
+
+        with mock.patch.object(backends.time, "monotonic", return_value=cooled_down):
+            self.assertEqual(self.backend.circuit, "half-open")
+            self.assertTrue(self.backend.is_available())
+            # A failed trial opens the circuit again, for a whole cooldown.
+            with mock.patch.object(backends.logger, "warning"):
+                self.backend.record_failure()
+            self.assertEqual(self.backend.circuit, "open")
+
+
+class BackendPoolTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        for name, value in (("EXPLORE_RATIO", 0.0), ("CIRCUIT_FAILURE_THRESHOLD", 1)):
+            patcher = mock.patch.object(settings.llm, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(backends.logger, "warning")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lowest_weighted_latency_selected(self):
+        fast = make_backend("fast", 1.0)
+        heavy = make_backend("heavy", 3.0, weight=4.0)
+        pool = BackendPool([make_backend("slow", 2.0), fast, heavy])
+
+        self.assertIs(pool.select(), heavy)
+        self.assertIs(pool.select(exclude=[heavy]), fast)
+
+        # Unmeasured backends are tried first.
+        new = make_backend("new")
+        pool.backends.append(new)
+        self.assertIs(pool.select(), new)
+
+    async def test_failover(self):
+        primary = make_backend("primary", 1.0, side_effect=connection_error())
+        secondary = make_backend("secondary", 2.0, return_value="answer")
+        pool = BackendPool([primary, secondary])
+
+        self.assertEqual(await pool.create_response(input="hi"), "answer")
+        self.assertEqual((pool.failovers, primary.circuit), (1, "open"))
+        call = secondary.client.responses.create.call_args
+        self.assertEqual(call.kwargs["model"], secondary.model)
+
+    async def test_no_backend_available(self):
+        pool = BackendPool([make_backend("a", side_effect=connection_error())])
+
+        with self.assertRaises(APIConnectionError):
+            await pool.create_response(input="hi")
+        with self.assertRaises(HTTPException) as raised:
+            await pool.create_response(input="hi")
+        self.assertEqual(raised.exception.status_code, 503)
+
+    async def test_single_trial_while_half_open(self):
+        release = asyncio.Event()
+
+        async def create(**kwargs):
+            await release.wait()
+            return "answer"
+
+        backend = make_backend("a", side_effect=create)
+        backend.opened_at = 0.0  # long cooled down
+        pool = BackendPool([backend])
+        trial = asyncio.create_task(pool.create_response(input="hi"))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(HTTPException):
+            await pool.create_response(input="hi")
+
+        release.set()
+        self.assertEqual(await trial, "answer")
+        self.assertEqual(backend.circuit, "closed")
+
+    async def test_failover_skips_the_hedged_backend(self):
+        async def slow_failure(**kwargs):
+            await asyncio.sleep(0.05)
+            raise connection_error()
+
+        primary = make_backend("primary", 0.01, side_effect=slow_failure)
+        primary.latencies.append(0.01)
+        hedged = make_backend("hedged", 0.02, side_effect=connection_error())
+        last = make_backend("last", 0.03, return_value="answer")
+        pool = BackendPool([primary, hedged, last])
+
+        with (
+            mock.patch.object(settings.llm, "HEDGE_REQUESTS", True),
+            mock.patch.object(settings.llm, "HEDGE_MIN_SAMPLES", 1),
+            mock.patch.object(settings.llm, "CIRCUIT_FAILURE_THRESHOLD", 5),
+        ):
+            self.assertEqual(await pool.create_response(input="hi"), "answer")
+
+        self.assertEqual(hedged.client.responses.create.await_count, 1)
+        self.assertEqual((pool.hedged, pool.failovers), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
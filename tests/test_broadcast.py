@@ -0,0 +1,159 @@
+"""
+Fan-out of identical concurrent streams: late joiners replaying the prefix,
+subscribers leaving early, upstream failures, and subscriptions released
+explicitly, whether they were read or not.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from starlette.requests import ClientDisconnect  # noqa: E402
+
+from app.predict import broadcast, deps  # noqa: E402
+from app.predict.broadcast import StreamFanout  # noqa: E402
+
+
+class FakeStream:
+    """Upstream stream yielding the events put in `events`, `None` ends it."""
+
+    def __init__(self):
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.closed = False
+
+    async def __aenter__(self) -> "FakeStream":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.closed = True
+
+    def __aiter__(self) -> "FakeStream":
+        return self
+
+    async def __anext__(self):
+        event = await self.events.get()
+
+        if event is None:
+            raise StopAsyncIteration
+        if isinstance(event, Exception):
+            raise event
+        return event
+
+
+class StreamFanoutTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.fanout = StreamFanout()
+        self.stream = FakeStream()
+        self.opened = 0
+
+    async def open_source(self) -> FakeStream:
+        self.opened += 1
+        return self.stream
+
+    async def read(self, subscription, count: int) -> list:
+        return [await anext(subscription) for _ in range(count)]
+
+    async def test_late_joiner_replays_the_prefix(self):
+        first = await self.fanout.subscribe("key", self.open_source)
+        self.stream.events.put_nowait("a")
+        self.assertEqual(await self.read(first, 1), ["a"])
+
+        late = await self.fanout.subscribe("key", self.open_source)
+        self.stream.events.put_nowait("b")
+        self.stream.events.put_nowait(None)
+
+        self.assertEqual([event async for event in first], ["b"])
+        self.assertEqual([event async for event in late], ["a", "b"])
+        self.assertEqual(self.opened, 1)
+        await asyncio.sleep(0)
+        self.assertEqual(self.fanout.stats(), {"in_flight": 0, "opened": 1, "attached": 1})
+
+    async def test_early_leaver_does_not_stop_the_others(self):
+        leaving = await self.fanout.subscribe("key", self.open_source)
+        staying = await self.fanout.subscribe("key", self.open_source)
+        self.stream.events.put_nowait("a")
+        self.assertEqual(await self.read(leaving, 1), ["a"])
+
+        await leaving.aclose()
+        self.stream.events.put_nowait("b")
+        self.stream.events.put_nowait(None)
+        self.assertEqual([event async for event in staying], ["a", "b"])
+
+    async def test_last_leaver_cancels_the_upstream(self):
+        subscription = await self.fanout.subscribe("key", self.open_source)
+        self.stream.events.put_nowait("a")
+        self.assertEqual(await self.read(subscription, 1), ["a"])
+
+        await subscription.aclose()
+        await asyncio.sleep(0)
+        self.assertTrue(self.stream.closed)
+
+        # The next identical request opens a new upstream stream.
+        self.stream = FakeStream()
+        await self.fanout.subscribe("key", self.open_source)
+        self.assertEqual(self.opened, 2)
+
+    async def test_upstream_failure_reaches_every_subscriber(self):
+        subscriptions = [await self.fanout.subscribe("key", self.open_source) for _ in range(2)]
+        self.stream.events.put_nowait("a")
+        self.stream.events.put_nowait(RuntimeError("upstream failed"))
+
+        with mock.patch.object(broadcast.logger, "error") as error:
+            for subscription in subscriptions:
+                self.assertEqual(await self.read(subscription, 1), ["a"])
+                with self.assertRaises(RuntimeError):
+                    await anext(subscription)
+        error.assert_called_once()
+
+    async def test_failure_to_open_raised_to_every_caller(self):
+        async def open_source():
+            raise ConnectionError("refused")
+
+        callers = [self.fanout.subscribe("key", open_source) for _ in range(2)]
+        results = await asyncio.gather(*callers, return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(self.fanout.stats()["in_flight"], 0)
+
+    async def test_unread_subscription_released_by_its_owner(self):
+        subscription = await self.fanout.subscribe("key", self.open_source)
+
+        await subscription.release_unread()
+        await asyncio.sleep(0)
+        self.assertTrue(self.stream.closed)
+
+    async def test_subscription_read_is_left_to_its_reader(self):
+        reading = await self.fanout.subscribe("key", self.open_source)
+        aiter(reading)
+
+        await reading.release_unread()
+        await asyncio.sleep(0)
+        self.assertFalse(self.stream.closed)
+        await reading.aclose()
+
+
+    async def test_released_when_the_client_left_before_the_response(self):
+        subscription = await self.fanout.subscribe("key", self.open_source)
+        response = deps.ClosingStreamingResponse(
+            deps.stream_generator(subscription), on_close=subscription.release_unread
+        )
+
+        async def send(message):
+            raise OSError("Connection reset by peer.")
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        with self.assertRaises(ClientDisconnect):
+            await response(scope, mock.AsyncMock(), send)
+        await asyncio.sleep(0)
+        self.assertTrue(self.stream.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
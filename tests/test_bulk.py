@@ -0,0 +1,155 @@
+"""
+Many prompts at once: the `/multi` endpoint streaming results as they
+complete, and the offline JSONL runner resuming from its checkpoint.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from fastapi import HTTPException  # noqa: E402
+
+from app.predict import service  # noqa: E402
+from scripts import run_jsonl  # noqa: E402
+
+
+class FakeBatch:
+    """Stands in for `get_chat_inference_batch`, tracking concurrent calls."""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.prompts: list[str] = []
+
+    async def __call__(self, user_prompt: str, max_tokens: int, **kwargs) -> str:
+        self.prompts.append(user_prompt)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+
+        try:
+            await asyncio.sleep(0.01 if user_prompt == "slow" else 0)
+        finally:
+            self.running -= 1
+
+        if user_prompt == "refused":
+            raise HTTPException(status_code=429, detail="Too many tokens.")
+        if user_prompt == "broken":
+            raise RuntimeError("upstream failed")
+        return user_prompt.upper()
+
+
+class MultiPromptTest(unittest.IsolatedAsyncioTestCase):
+    async def test_results_as_they_complete(self):
+        batch = FakeBatch()
+        prompts = ["slow", "a", "refused", "broken", "b"]
+
+        with (
+            mock.patch.object(service, "get_chat_inference_batch", batch),
+            mock.patch.object(service.logger, "error"),
+        ):
+            response = await service.get_chat_inference_multi(prompts, 16, concurrency=2)
+            lines = [json.loads(line) async for line in response.body_iterator]
+
+        self.assertEqual(response.media_type, "application/x-ndjson")
+        self.assertEqual(batch.max_running, 2)
+        self.assertEqual(lines[-1], {"index": 0, "status_code": 200, "output": "SLOW"})
+        results = {line["index"]: line for line in lines}
+        self.assertEqual(results[2], {"index": 2, "status_code": 429, "error": "Too many tokens."})
+        self.assertEqual(results[3]["status_code"], 502)
+        self.assertEqual(results[4]["output"], "B")
+
+
+class JSONLRunnerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input = Path(directory.name) / "requests.jsonl"
+        self.output = Path(directory.name) / "results.jsonl"
+
+    async def run_script(self, batch: FakeBatch) -> list[dict]:
+        args = argparse.Namespace(
+            input=str(self.input),
+            output=str(self.output),
+            field="body",
+            max_tokens=16,
+            concurrency=2,
+            checkpoint=None,
+            checkpoint_every=1,
+        )
+        llm_client = SimpleNamespace(close=mock.AsyncMock())
+
+        with (
+            mock.patch.object(run_jsonl, "get_chat_inference_batch", batch),
+            mock.patch.object(run_jsonl.deps, "create_llm_client", return_value=llm_client),
+            mock.patch.object(run_jsonl.logger, "info"),
+            mock.patch.object(run_jsonl.logger, "error"),
+        ):
+            await run_jsonl.run(args)
+        return [json.loads(line) for line in self.output.read_text().splitlines()]
+
+    def write_input(self, *bodies: str | None) -> None:
+        lines = [
+            json.dumps({"request_id": f"r{i}", "body": body}) if body is not None else ""
+            for i, body in enumerate(bodies)
+        ]
+        self.input.write_text("\n".join(lines) + "\n")
+
+    async def test_run(self):
+        self.write_input("a", None, "broken", "b")
+        results = await self.run_script(FakeBatch())
+
+        self.assertEqual(sorted(result["line"] for result in results), [0, 2, 3])
+        self.assertIn({"line": 0, "id": "r0", "output": "A"}, results)
+        self.assertIn("upstream failed", next(r["error"] for r in results if r["line"] == 2))
+
+    async def test_resumed_from_the_checkpoint(self):
+        self.write_input("a", "b", "c", "d")
+        first_line = self.input.read_bytes().index(b"\n") + 1
+        done = json.dumps({"line": 0, "id": "r0", "output": "A"}) + "\n"
+        # Line 2 also completed, but the result past the checkpoint was never saved.
+        self.output.write_text(done + '{"line": 2, "torn')
+        checkpoint = {"line": 1, "offset": first_line, "output_size": len(done), "done": [2]}
+        Path(f"{self.output}.checkpoint").write_text(json.dumps(checkpoint))
+
+        batch = FakeBatch()
+        results = await self.run_script(batch)
+
+        self.assertEqual(sorted(batch.prompts), ["b", "d"])
+        self.assertEqual(sorted(result["line"] for result in results), [0, 1, 3])
+
+        # Everything is done, nothing runs again.
+        batch = FakeBatch()
+        self.assertEqual(len(await self.run_script(batch)), 3)
+        self.assertEqual(batch.prompts, [])
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_lines_done_out_of_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = run_jsonl.Checkpoint(str(Path(directory) / "checkpoint"))
+            checkpoint.offsets = {0: 0, 1: 10, 2: 20}
+
+            checkpoint.mark_done(1, 30)
+            self.assertEqual((checkpoint.line, checkpoint.offset, checkpoint.done), (0, 0, {1}))
+            checkpoint.mark_done(0, 30)
+            self.assertEqual((checkpoint.line, checkpoint.offset, checkpoint.done), (2, 20, set()))
+
+            checkpoint.save(123)
+            loaded = run_jsonl.Checkpoint(checkpoint.path)
+            self.assertEqual((loaded.line, loaded.offset, loaded.output_size), (2, 20, 123))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+The in-memory TTL cache: bounds and expiry, and single-flight loads shared by
+concurrent callers, cancelled with the last of them and never cached when
+they fail.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+from app import cache
+from app.cache import TTLCache
+
+
+class Loader:
+    """Loads `value` once released, counting the calls."""
+
+    def __init__(self, value="value", error: Exception | None = None):
+        self.value = value
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_expiry(self):
+        ttl_cache = TTLCache(ttl=10)
+
+        with mock.patch.object(cache.time, "monotonic", return_value=100.0):
+            ttl_cache.set("a", 1)
+        with mock.patch.object(cache.time, "monotonic", return_value=109.0):
+            self.assertEqual(ttl_cache.get("a"), 1)
+        with mock.patch.object(cache.time, "monotonic", return_value=110.0):
+            self.assertIsNone(ttl_cache.get("a"))
+        self.assertEqual(len(ttl_cache), 0)
+
+    def test_least_recently_used_evicted_first(self):
+        evicted = []
+        ttl_cache = TTLCache(ttl=60, max_entries=2, on_evict=lambda key, _: evicted.append(key))
+        ttl_cache.set("a", 1)
+        ttl_cache.set("b", 2)
+        ttl_cache.get("a")
+        ttl_cache.set("c", 3)
+
+        self.assertEqual(evicted, ["b"])
+        self.assertEqual(ttl_cache.get("a"), 1)
+        self.assertEqual(ttl_cache.evictions, 1)
+
+    def test_byte_bound(self):
+        ttl_cache = TTLCache(ttl=60, max_bytes=10, sizeof=len)
+        ttl_cache.set("a", "x" * 6)
+        ttl_cache.set("b", "x" * 6)
+
+        self.assertIsNone(ttl_cache.get("a"))
+        self.assertEqual(ttl_cache.bytes, 6)
+
+        ttl_cache.set("b", "x" * 2)
+        self.assertEqual(ttl_cache.bytes, 2)
+
+    def test_oversized_value_drops_the_old_one(self):
+        ttl_cache = TTLCache(ttl=60, max_bytes=10, sizeof=len)
+        ttl_cache.set("a", "old")
+        ttl_cache.set("a", "x" * 11)
+
+        self.assertIsNone(ttl_cache.get("a"))
+        self.assertEqual(ttl_cache.bytes, 0)
+
+
+class GetOrLoadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_callers_share_one_load(self):
+        ttl_cache = TTLCache(ttl=60)
+        loader = Loader()
+        callers = [asyncio.create_task(ttl_cache.get_or_load("a", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        loader.release.set()
+        self.assertEqual(await asyncio.gather(*callers), ["value"] * 3)
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual((ttl_cache.misses, ttl_cache.coalesced), (1, 2))
+
+        self.assertEqual(await ttl_cache.get_or_load("a", loader), "value")
+        self.assertEqual(ttl_cache.hits, 1)
+
+    async def test_cancelled_caller_leaves_the_load_to_others(self):
+        ttl_cache = TTLCache(ttl=60)
+        loader = Loader()
+        first = asyncio.create_task(ttl_cache.get_or_load("a", loader))
+        second = asyncio.create_task(ttl_cache.get_or_load("a", loader))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        loader.release.set()
+
+        self.assertEqual(await second, "value")
+        self.assertTrue(first.cancelled())
+        self.assertFalse(loader.cancelled)
+
+    async def test_last_caller_cancelled_cancels_the_load(self):
+        ttl_cache = TTLCache(ttl=60)
+        loader = Loader()
+        callers = [asyncio.create_task(ttl_cache.get_or_load("a", loader)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        self.assertTrue(loader.cancelled)
+        self.assertIsNone(ttl_cache.get("a"))
+        self.assertEqual(ttl_cache.stats()["in_flight"], 0)
+
+        # The next caller starts a new load.
+        loader.release.set()
+        self.assertEqual(await ttl_cache.get_or_load("a", loader), "value")
+        self.assertEqual(loader.calls, 2)
+
+    async def test_failed_load_is_not_cached(self):
+        ttl_cache = TTLCache(ttl=60)
+        loader = Loader(error=RuntimeError("upstream failed"))
+        callers = [asyncio.create_task(ttl_cache.get_or_load("a", loader)) for _ in range(2)]
+        await asyncio.sleep(0)
+        loader.release.set()
+
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual(len(ttl_cache), 0)
+
+        loader.error = None
+        self.assertEqual(await ttl_cache.get_or_load("a", loader), "value")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+The WebSocket chat channel: cancelling a request in the same burst that
+started it, duplicate request ids and the cap on requests in flight.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import json
+import os
+import unittest
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+from fastapi import WebSocketDisconnect  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.predict.channel import ChatChannel  # noqa: E402
+
+
+class PendingResponses:
+    # Calls that never answer, until cancelled.
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **request):
+        self.calls += 1
+        await asyncio.Event().wait()
+
+
+class FakeWebSocket:
+    """Messages queued up front are received without yielding to the loop,
+    as a burst read from one network packet would be.
+    """
+
+    def __init__(self, messages: list[dict]):
+        self.headers = {}
+        self.client = SimpleNamespace(host="127.0.0.1", port=1234)
+        llm_client = SimpleNamespace(responses=PendingResponses())
+        self.app = SimpleNamespace(state=SimpleNamespace(llm_client=llm_client))
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.sent: list[dict] = []
+
+        for message in messages:
+            self.inbox.put_nowait(json.dumps(message))
+
+    async def accept(self):
+        return None
+
+    async def receive_text(self) -> str:
+        message = await self.inbox.get()
+        if message is None:
+            raise WebSocketDisconnect()
+        return message
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    def disconnect(self):
+        self.inbox.put_nowait(None)
+
+
+def batch(request_id: str) -> dict:
+    return {"id": request_id, "type": "batch", "input": {"use_cache": False}}
+
+
+class ChatChannelTest(unittest.IsolatedAsyncioTestCase):
+    async def exchange(self, messages: list[dict], replies: int) -> FakeWebSocket:
+        websocket = FakeWebSocket(messages)
+        channel = asyncio.create_task(ChatChannel(websocket).run())
+
+        async with asyncio.timeout(5):
+            while len(websocket.sent) < replies:
+                await asyncio.sleep(0.01)
+
+        websocket.disconnect()
+        await channel
+        return websocket
+
+    async def test_cancel_in_same_burst_is_answered(self):
+        websocket = await self.exchange([batch("0"), {"id": "0", "type": "cancel"}], replies=1)
+
+        self.assertEqual(
+            websocket.sent, [{"id": "0", "event": "cancelled", "data": {"status_code": 499}}]
+        )
+        self.assertEqual(websocket.app.state.llm_client.responses.calls, 0)
+
+    async def test_cancel_of_running_request_is_answered_once(self):
+        websocket = FakeWebSocket([batch("0")])
+        channel = asyncio.create_task(ChatChannel(websocket).run())
+
+        async with asyncio.timeout(5):
+            while not websocket.app.state.llm_client.responses.calls:
+                await asyncio.sleep(0.01)
+            websocket.inbox.put_nowait(json.dumps({"id": "0", "type": "cancel"}))
+            while not websocket.sent:
+                await asyncio.sleep(0.01)
+
+        await asyncio.sleep(0.05)
+        websocket.disconnect()
+        await channel
+
+        self.assertEqual([reply["event"] for reply in websocket.sent], ["cancelled"])
+
+    async def test_duplicate_request_id(self):
+        websocket = await self.exchange([batch("0"), batch("0")], replies=1)
+
+        self.assertEqual(websocket.sent[0]["id"], "0")
+        self.assertEqual(websocket.sent[0]["data"]["status_code"], 409)
+
+    async def test_in_flight_cap(self):
+        limit = settings.chat.WS_MAX_IN_FLIGHT
+        websocket = await self.exchange([batch(str(i)) for i in range(limit + 1)], replies=1)
+
+        self.assertEqual(websocket.sent[0]["id"], str(limit))
+        self.assertEqual(websocket.sent[0]["data"]["status_code"], 429)
+
+    async def test_malformed_message(self):
+        websocket = await self.exchange([{"type": "batch"}], replies=1)
+
+        self.assertEqual(websocket.sent[0]["event"], "error")
+        self.assertEqual(websocket.sent[0]["data"]["status_code"], 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
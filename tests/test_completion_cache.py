@@ -0,0 +1,140 @@
+"""
+The completion cache: the in-memory tier bounded by UTF-8 size, and the
+SQLite tier shared by workers, with its expiry, pruning and failed reads.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from app.predict import cache  # noqa: E402
+from app.predict.cache import CompletionCache, SQLiteStore  # noqa: E402
+
+
+class Create:
+    """Creates numbered completions, counting the calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        return f"completion {self.calls}"
+
+
+class CompletionCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = str(Path(directory.name) / "completions.sqlite3")
+
+    def make_cache(self, **kwargs) -> CompletionCache:
+        completion_cache = CompletionCache(**{"max_bytes": 1024, "ttl": 60, **kwargs})
+        self.addCleanup(completion_cache.close)
+        return completion_cache
+
+    async def test_memory_bounded_by_utf8_size(self):
+        completion_cache = self.make_cache(max_bytes=10)
+        await completion_cache.get_or_create("a", mock.AsyncMock(return_value="ééé"))
+
+        self.assertEqual(completion_cache.memory.bytes, 6)
+        await completion_cache.get_or_create("b", mock.AsyncMock(return_value="ééé"))
+        self.assertIsNone(await completion_cache.get("a"))
+
+    async def test_disk_tier_shared_by_caches(self):
+        create = Create()
+        first = self.make_cache(disk_path=self.path)
+        self.assertEqual(await first.get_or_create("a", create), "completion 1")
+
+        # Another worker, with an empty memory tier.
+        second = self.make_cache(disk_path=self.path)
+        self.assertEqual(await second.get_or_create("a", create), "completion 1")
+        self.assertEqual(await second.get("a"), "completion 1")
+        self.assertEqual(create.calls, 1)
+        self.assertEqual(second.stats()["disk_hits"], 1)
+
+    async def test_expired_on_disk(self):
+        create = Create()
+        first = self.make_cache(disk_path=self.path, ttl=10)
+
+        with mock.patch.object(cache.time, "time", return_value=1000.0):
+            await first.get_or_create("a", create)
+        second = self.make_cache(disk_path=self.path, ttl=10)
+
+        with mock.patch.object(cache.time, "time", return_value=1010.0):
+            self.assertIsNone(await second.get("a"))
+            self.assertEqual(await second.get_or_create("a", create), "completion 2")
+
+    async def test_failed_disk_read_is_a_miss(self):
+        completion_cache = self.make_cache(disk_path=self.path)
+        error = sqlite3.OperationalError("database is locked")
+
+        with (
+            mock.patch.object(completion_cache.disk, "get", side_effect=error),
+            mock.patch.object(cache.logger, "warning") as warning,
+        ):
+            self.assertIsNone(await completion_cache.get("a"))
+            self.assertEqual(await completion_cache.get_or_create("a", Create()), "completion 1")
+        self.assertEqual(warning.call_count, 2)
+
+    async def test_failed_disk_write_keeps_the_completion(self):
+        completion_cache = self.make_cache(disk_path=self.path)
+        error = sqlite3.OperationalError("disk I/O error")
+
+        with (
+            mock.patch.object(completion_cache.disk, "set", side_effect=error),
+            mock.patch.object(cache.logger, "warning") as warning,
+        ):
+            self.assertEqual(await completion_cache.get_or_create("a", Create()), "completion 1")
+        self.assertEqual(await completion_cache.get("a"), "completion 1")
+        warning.assert_called_once()
+
+
+class SQLiteStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = str(Path(directory.name) / "completions.sqlite3")
+
+    def make_store(self, max_entries: int) -> SQLiteStore:
+        self.store = SQLiteStore(self.path, 60, max_entries)
+        self.addCleanup(self.store.close)
+        return self.store
+
+    def keys(self) -> list[str]:
+        return [row[0] for row in self.store._conn.execute("SELECT key FROM completions")]
+
+    def test_pruned_to_the_latest_entries(self):
+        self.make_store(max_entries=10)
+        for i in range(100):
+            with mock.patch.object(cache.time, "time", return_value=1000.0 + i):
+                self.store.set(str(i), "value")
+
+        self.assertEqual(len(self.keys()), 10)
+        with mock.patch.object(cache.time, "time", return_value=1100.0):
+            self.assertIsNone(self.store.get("89"))
+            self.assertEqual(self.store.get("99"), "value")
+
+    def test_expired_entries_pruned(self):
+        self.make_store(max_entries=1000)
+        with mock.patch.object(cache.time, "time", return_value=1000.0):
+            self.store.set("old", "value")
+        with mock.patch.object(cache.time, "time", return_value=2000.0):
+            for i in range(99):
+                self.store.set(str(i), "value")
+
+        self.assertEqual(len(self.keys()), 99)
+        self.assertNotIn("old", self.keys())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Requests cut short: upstream work cancelled when the client disconnects or
+the deadline passes, before and while the answer streams.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import os
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from fastapi import HTTPException  # noqa: E402
+
+from app.predict import deps  # noqa: E402
+from app.predict.deps import guard_stream, run_until_disconnected  # noqa: E402
+
+
+class FakeRequest:
+    """Request whose client disconnects once `disconnect` is called."""
+
+    def __init__(self):
+        self._disconnected = asyncio.Event()
+
+    def disconnect(self) -> None:
+        self._disconnected.set()
+
+    async def receive(self) -> dict:
+        await self._disconnected.wait()
+        return {"type": "http.disconnect"}
+
+
+class Upstream:
+    """Upstream call answering after `delay` seconds, noting cancellation."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.cancelled = False
+
+    async def __call__(self) -> str:
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return "answer"
+
+    async def frames(self, count: int = 3):
+        try:
+            for i in range(count):
+                await asyncio.sleep(self.delay)
+                yield f"frame {i}"
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled = True
+            raise
+
+
+def deadline_in(seconds: float) -> float:
+    return time.monotonic() + seconds
+
+
+class RunUntilDisconnectedTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = mock.patch.object(deps.logger, "info")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_result(self):
+        result = await run_until_disconnected(FakeRequest(), Upstream()(), deadline_in(1))
+        self.assertEqual(result, "answer")
+
+    async def test_disconnect_cancels_the_upstream(self):
+        request, upstream = FakeRequest(), Upstream(delay=10)
+        asyncio.get_running_loop().call_later(0.01, request.disconnect)
+
+        with self.assertRaises(HTTPException) as raised:
+            await run_until_disconnected(request, upstream(), deadline_in(10))
+        self.assertEqual(raised.exception.status_code, 499)
+        self.assertTrue(upstream.cancelled)
+
+    async def test_deadline_cancels_the_upstream(self):
+        upstream = Upstream(delay=10)
+
+        with self.assertRaises(HTTPException) as raised:
+            await run_until_disconnected(FakeRequest(), upstream(), deadline_in(0.01))
+        self.assertEqual(raised.exception.status_code, 504)
+        self.assertTrue(upstream.cancelled)
+
+    async def test_errors_are_raised(self):
+        async def failing():
+            raise ValueError("bad")
+
+        with self.assertRaises(ValueError):
+            await run_until_disconnected(FakeRequest(), failing(), deadline_in(1))
+
+
+class GuardStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = mock.patch.object(deps.logger, "info")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_frames_passed_through(self):
+        frames = guard_stream(FakeRequest(), Upstream().frames(), deadline_in(1))
+        self.assertEqual([frame async for frame in frames], ["frame 0", "frame 1", "frame 2"])
+
+    async def test_disconnect_closes_the_stream(self):
+        request, upstream = FakeRequest(), Upstream(delay=0.05)
+        frames = guard_stream(request, upstream.frames(), deadline_in(10))
+
+        self.assertEqual(await anext(frames), "frame 0")
+        request.disconnect()
+        self.assertEqual([frame async for frame in frames], [])
+        self.assertTrue(upstream.cancelled)
+
+    async def test_deadline_ends_with_a_timeout_frame(self):
+        upstream = Upstream(delay=0.1)
+        frames = guard_stream(FakeRequest(), upstream.frames(), deadline_in(0.15), "timeout")
+
+        self.assertEqual([frame async for frame in frames], ["frame 0", "timeout"])
+        self.assertTrue(upstream.cancelled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+The pooled LLM client shared by all requests: connection limits, HTTP/2,
+pool stats and the startup warm-up.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from app.config import settings  # noqa: E402
+from app.predict import deps  # noqa: E402
+
+
+class LLMClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_pool_limits(self):
+        client = deps.create_llm_client(base_url="http://127.0.0.1:9/v1", api_key="key")
+        self.addAsyncCleanup(client.close)
+        pool = client._client._transport._pool
+
+        self.assertEqual(pool._max_connections, settings.llm.POOL_MAX_CONNECTIONS)
+        self.assertEqual(pool._max_keepalive_connections, settings.llm.POOL_MAX_KEEPALIVE_CONNECTIONS)
+        self.assertEqual(str(client.base_url), "http://127.0.0.1:9/v1/")
+
+    async def test_http2(self):
+        with mock.patch.object(settings.llm, "HTTP2", True):
+            client = deps.create_llm_client()
+        self.addAsyncCleanup(client.close)
+
+        self.assertTrue(client._client._transport._pool._http2)
+
+    async def test_stats_of_unused_pool(self):
+        client = deps.create_llm_client()
+        self.addAsyncCleanup(client.close)
+
+        stats = deps.get_llm_pool_stats(client)
+        self.assertEqual((stats["connections"], stats["in_use"], stats["idle"]), (0, 0, 0))
+        self.assertEqual(stats["max_connections"], settings.llm.POOL_MAX_CONNECTIONS)
+
+    async def test_failed_warm_up_is_not_fatal(self):
+        # Nothing listens on the discard port.
+        client = deps.create_llm_client(base_url="http://127.0.0.1:9/v1")
+        self.addAsyncCleanup(client.close)
+
+        with mock.patch.object(deps.logger, "warning") as warning:
+            await deps.warm_up_llm_client(client)
+        self.assertEqual(warning.call_count, settings.llm.POOL_WARMUP_CONNECTIONS)
+        self.assertEqual(deps.get_llm_pool_stats(client)["connections"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Request logging: ids taken from the client when log-safe or generated, bound
+to every record of the request, and debug logs kept for sampled requests only.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+import httpx  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.logger import _keep_record, logger  # noqa: E402
+from app.main import app  # noqa: E402
+
+HEADER = settings.logging.REQUEST_ID_HEADER
+
+
+class RequestLoggingTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.records: list[str] = []
+        sink = logger.add(
+            self.records.append,
+            level="DEBUG",
+            format="{extra[request_id]} {level} {message}",
+            filter=_keep_record,
+        )
+        self.addCleanup(logger.remove, sink)
+
+        transport = httpx.ASGITransport(app=app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.addAsyncCleanup(self.client.aclose)
+
+    async def test_client_request_id_reused(self):
+        response = await self.client.get("/ui", headers={HEADER: "client-id.1"})
+
+        self.assertEqual(response.headers[HEADER], "client-id.1")
+        self.assertIn("client-id.1 DEBUG GET /ui\n", self.records)
+
+    async def test_unsafe_request_id_replaced(self):
+        for request_id in ("", "a b", "x" * 65, "id;user=admin"):
+            with self.subTest(request_id=request_id):
+                response = await self.client.get("/ui", headers={HEADER: request_id})
+                self.assertRegex(response.headers[HEADER], r"^[0-9a-f]{32}$")
+
+    async def test_debug_logs_of_unsampled_requests_dropped(self):
+        with mock.patch.object(settings.logging, "REQUEST_SAMPLE_RATE", 0.0):
+            response = await self.client.get("/ui")
+            logger.info("kept")
+            logger.bind(sampled=False).warning("kept too")
+
+        self.assertEqual(response.status_code, 200)
+        messages = [record.split(" ", 1)[1] for record in self.records]
+        self.assertEqual(messages, ["INFO kept\n", "WARNING kept too\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
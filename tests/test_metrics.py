@@ -0,0 +1,78 @@
+"""
+Prometheus metrics and `Server-Timing` breakdowns: values read from stats at
+scrape time, timings of the current request, and the `/metrics` endpoint.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import os
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+import httpx  # noqa: E402
+from prometheus_client import REGISTRY  # noqa: E402
+
+from app import metrics  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+class StatsCollectorTest(unittest.TestCase):
+    def test_values_read_at_scrape_time(self):
+        stats = {"hits": 1}
+        collector = metrics.StatsCollector(
+            "test_lookups_total", "Lookups.", "counter", lambda: {("a",): stats["hits"]}, ("name",)
+        )
+        self.addCleanup(REGISTRY.unregister, collector)
+
+        self.assertIn('test_lookups_total{name="a"} 1.0', metrics.render())
+        stats["hits"] = 5
+        self.assertIn('test_lookups_total{name="a"} 5.0', metrics.render())
+
+    def test_missing_values_are_zero(self):
+        collector = metrics.StatsCollector("test_size", "Size.", "gauge", lambda: {(): None})
+        self.addCleanup(REGISTRY.unregister, collector)
+
+        self.assertIn("# TYPE test_size gauge\ntest_size 0.0", metrics.render())
+
+
+class ServerTimingTest(unittest.TestCase):
+    def test_timings_add_up(self):
+        timings = {}
+        token = metrics.request_timings.set(timings)
+        self.addCleanup(metrics.request_timings.reset, token)
+
+        metrics.record_timing("upstream", 0.25)
+        metrics.record_timing("upstream", 0.5)
+        metrics.record_timing("cache", desc="miss")
+        with metrics.timed(metrics.LLM_QUEUE_WAIT, "queue"):
+            pass
+
+        header = metrics.format_server_timing(timings)
+        self.assertTrue(header.startswith('upstream;dur=750.0, cache;desc="miss", queue;dur='))
+
+    def test_outside_a_request(self):
+        metrics.record_timing("upstream", 1.0)  # no timings to add to, ignored
+        self.assertIsNone(metrics.request_timings.get())
+
+
+class MetricsEndpointTest(unittest.IsolatedAsyncioTestCase):
+    async def test_scrape(self):
+        transport = httpx.ASGITransport(app=app)
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            page = await client.get("/ui")
+            response = await client.get("/metrics")
+
+        self.assertIn("dur=", page.headers["server-timing"])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_requests_total{route="/ui",status="200"}', response.text)
+        self.assertIn('http_request_duration_seconds_bucket{le="0.005",route="/ui"}', response.text)
+        self.assertIn('cache_entries{cache="completion"}', response.text)
+        self.assertIn("llm_scheduler_in_flight", response.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
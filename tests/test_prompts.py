@@ -0,0 +1,71 @@
+"""
+Prompt templates: static parts rendered once and keyed by their text, and the
+per-request context appended after them.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import datetime
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from jinja2 import UndefinedError  # noqa: E402
+
+from app.prompts import PROMPT_DIR, PromptTemplates  # noqa: E402
+
+
+class PromptTemplatesTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        (self.directory / "context.md.j2").write_text((PROMPT_DIR / "context.md.j2").read_text())
+        (self.directory / "system.md.j2").write_text("You are helpful.\n")
+
+    def test_static_part_first_and_unchanged(self):
+        templates = PromptTemplates(self.directory)
+        prompt = templates.render("system", locale="fr_FR", user_profile=None)
+
+        self.assertTrue(prompt.startswith(templates.static("system")))
+        self.assertIn("fr_FR", prompt)
+        self.assertNotIn("About the user", prompt)
+        self.assertEqual(templates.render("system"), templates.static("system"))
+
+    def test_date_is_opt_in(self):
+        today = datetime.date.today().isoformat()
+
+        self.assertNotIn(today, PromptTemplates(self.directory).render("system"))
+        templates = PromptTemplates(self.directory, include_date=True)
+        self.assertIn(today, templates.render("system"))
+        self.assertNotIn(today, templates.render("system", date=None))
+        self.assertIn("2001-01-01", templates.render("system", date="2001-01-01"))
+
+    def test_cache_key_changes_with_the_static_text_only(self):
+        templates = PromptTemplates(self.directory, auto_reload=True, include_date=True)
+        key = templates.cache_key("system")
+        self.assertTrue(key.startswith("system:"))
+
+        templates.render("system", locale="de_DE")
+        self.assertEqual(templates.cache_key("system"), key)
+
+        path = self.directory / "system.md.j2"
+        path.write_text("You are terse.\n")
+        os.utime(path, (0, path.stat().st_mtime + 10))
+        self.assertNotEqual(templates.cache_key("system"), key)
+        self.assertEqual(templates.static("system"), "You are terse.")
+
+    def test_variables_are_not_allowed_in_static_parts(self):
+        (self.directory / "broken.md.j2").write_text("Hello {{ name }}\n")
+
+        with self.assertRaises(UndefinedError):
+            PromptTemplates(self.directory).static("broken")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Token buckets shared by all workers through a memory-mapped file: refill,
+the 429 with `Retry-After`, collisions and a full table, and several
+processes drawing on one budget.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from fastapi import HTTPException, Request  # noqa: E402
+
+from app import rate_limiting  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.rate_limiting import SharedTokenBucket, charge_tokens  # noqa: E402
+
+
+def key_hash(key: str) -> int:
+    # Same hash as the bucket table.
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest()) or 1
+
+
+def colliding_keys(slots: int, count: int) -> list[str]:
+    keys, i = [], 0
+    while len(keys) < count:
+        key = f"ip:10.0.0.{i}"
+        if key_hash(key) % slots == 0:
+            keys.append(key)
+        i += 1
+    return keys
+
+
+def drain(path: str, attempts: int) -> int:
+    # Runs in another process, with its own mapping of the same file.
+    bucket = SharedTokenBucket(path, rate=1e-9, capacity=100, slots=64)
+    return sum(bucket.consume("ip:shared", 1) == 0 for _ in range(attempts))
+
+
+class SharedTokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = str(Path(directory.name) / "buckets")
+        self.now = 1_000_000.0
+        clock = mock.patch.object(rate_limiting.time, "time", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def bucket(self, **kwargs) -> SharedTokenBucket:
+        options = {"rate": 10.0, "capacity": 100.0, "slots": 64} | kwargs
+        return SharedTokenBucket(self.path, **options)
+
+    def test_charge_then_refill(self):
+        bucket = self.bucket()
+
+        self.assertEqual(bucket.consume("ip:1", 80), 0)
+        # 20 tokens left, 30 more needed to fit 50, at 10 per second.
+        self.assertAlmostEqual(bucket.consume("ip:1", 50), 3.0)
+
+        self.now += 3
+        self.assertEqual(bucket.consume("ip:1", 50), 0)
+        self.now += 1000
+        self.assertEqual(bucket.consume("ip:1", 100), 0)
+        self.assertGreater(bucket.consume("ip:1", 1), 0)
+
+    def test_clients_have_their_own_budget(self):
+        bucket = self.bucket()
+
+        self.assertEqual(bucket.consume("ip:1", 100), 0)
+        self.assertEqual(bucket.consume("ip:2", 100), 0)
+
+    def test_cost_above_capacity_drains_the_bucket(self):
+        bucket = self.bucket()
+
+        self.assertEqual(bucket.consume("ip:1", 1000), 0)
+        self.assertAlmostEqual(bucket.consume("ip:1", 10), 1.0)
+
+    def test_colliding_keys_probe_on(self):
+        bucket = self.bucket(slots=8)
+        first, second = colliding_keys(8, 2)
+
+        self.assertEqual(bucket.consume(first, 100), 0)
+        self.assertEqual(bucket.consume(second, 60), 0)
+        self.assertGreater(bucket.consume(first, 1), 0)
+        self.assertAlmostEqual(bucket.consume(second, 50), 1.0)
+
+    def test_refilled_slot_is_reused(self):
+        bucket = self.bucket(slots=8, max_probes=1)
+        first, second = colliding_keys(8, 2)
+
+        self.assertEqual(bucket.consume(first, 100), 0)
+        # The only slot probed is held by a partly drained bucket: let through.
+        self.assertEqual(bucket.consume(second, 100), 0)
+        self.assertEqual(bucket.consume(second, 100), 0)
+
+        self.now += 10  # the first bucket has refilled, its slot is free again
+        self.assertEqual(bucket.consume(second, 100), 0)
+        self.assertGreater(bucket.consume(second, 100), 0)
+
+    def test_full_table_lets_requests_through(self):
+        bucket = self.bucket(slots=4, max_probes=4)
+
+        for i in range(4):
+            self.assertEqual(bucket.consume(f"ip:{i}", 100), 0)
+        with mock.patch.object(rate_limiting.logger, "warning") as warning:
+            self.assertEqual(bucket.consume("ip:new", 100), 0)
+            self.assertEqual(bucket.consume("ip:new", 100), 0)
+        self.assertEqual(warning.call_count, 2)
+
+    def test_buckets_outlive_the_mapping(self):
+        self.assertEqual(self.bucket().consume("ip:1", 100), 0)
+        self.assertGreater(self.bucket().consume("ip:1", 1), 0)
+
+    def test_processes_share_the_budget(self):
+        context = multiprocessing.get_context("spawn")
+
+        with context.Pool(4) as pool:
+            charged = pool.starmap(drain, [(self.path, 50)] * 4)
+
+        # 200 attempts at 1 token each, against one bucket of 100.
+        self.assertEqual(sum(charged), 100)
+
+
+class ChargeTokensTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        bucket = SharedTokenBucket(
+            str(Path(directory.name) / "buckets"), rate=10.0, capacity=100.0, slots=64
+        )
+        for patch in (
+            mock.patch.object(rate_limiting, "token_limiter", bucket),
+            mock.patch.object(settings.rate_limit, "ENABLED", True),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.request = Request(
+            {"type": "http", "method": "POST", "headers": [], "client": ("10.0.0.1", 1234)}
+        )
+
+    def test_429_with_retry_after(self):
+        charge_tokens(self.request, 95)
+
+        with self.assertRaises(HTTPException) as raised:
+            charge_tokens(self.request, 20)
+        self.assertEqual(raised.exception.status_code, 429)
+        # 15 tokens short at 10 per second, rounded up.
+        self.assertEqual(raised.exception.headers["Retry-After"], "2")
+
+    def test_disabled(self):
+        with mock.patch.object(settings.rate_limit, "ENABLED", False):
+            for _ in range(3):
+                charge_tokens(self.request, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
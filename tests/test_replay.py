@@ -0,0 +1,149 @@
+"""
+Replay buffers of resumable `/stream` answers: resuming after `Last-Event-ID`,
+generation outliving a disconnect for the grace period only, and eviction
+under memory pressure.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import os
+import time
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from app.predict.deps import format_sse  # noqa: E402
+from app.predict.replay import ReplayStore  # noqa: E402
+
+
+class Source:
+    """SSE frames, one every `gap` seconds, recording how the stream ended."""
+
+    def __init__(self, count: int, gap: float = 0.01):
+        self.count = count
+        self.gap = gap
+        self.sent = 0
+        self.cancelled = False
+
+    async def frames(self):
+        try:
+            for i in range(self.count):
+                await asyncio.sleep(self.gap)
+                self.sent += 1
+                yield format_sse({"text": str(i)}, event="delta")
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def frame_ids(frames: list[str]) -> list[str]:
+    return [frame.partition("\n")[0].removeprefix("id: ") for frame in frames]
+
+
+class ReplayTest(unittest.IsolatedAsyncioTestCase):
+    def deadline(self) -> float:
+        return time.monotonic() + 10
+
+    async def test_resume_after_last_event_id(self):
+        store = ReplayStore(max_bytes=1 << 20, ttl=60, grace=5)
+        source = Source(6)
+        buffer = store.start("ip:1", source.frames(), self.deadline())
+
+        reader = buffer.subscribe()
+        first = [await anext(reader), await anext(reader)]
+        await reader.aclose()
+
+        # Generation goes on without a reader, within the grace period.
+        await asyncio.sleep(0.15)
+        self.assertTrue(buffer.finished)
+        self.assertEqual(source.sent, 6)
+
+        resumed = store.resume(buffer.id, "ip:1", first[-1].partition("\n")[0].removeprefix("id: "))
+        rest = [frame async for frame in resumed]
+
+        self.assertEqual(frame_ids(first), [f"{buffer.id}:1", f"{buffer.id}:2"])
+        self.assertEqual(frame_ids(rest), [f"{buffer.id}:{n}" for n in range(3, 7)])
+        self.assertIn('"text": "2"', rest[0])
+
+    async def test_resume_with_bare_event_number(self):
+        store = ReplayStore(max_bytes=1 << 20, ttl=60, grace=5)
+        buffer = store.start("ip:1", Source(3, gap=0).frames(), self.deadline())
+        await asyncio.sleep(0.05)
+
+        rest = [frame async for frame in store.resume(buffer.id, "ip:1", "2")]
+        self.assertEqual(frame_ids(rest), [f"{buffer.id}:3"])
+
+    async def test_other_clients_streams_are_missing(self):
+        store = ReplayStore(max_bytes=1 << 20, ttl=60, grace=5)
+        buffer = store.start("ip:1", Source(1).frames(), self.deadline())
+
+        self.assertIsNone(store.resume(buffer.id, "ip:2", None))
+        self.assertIsNone(store.resume("unknown", "ip:1", None))
+
+    async def test_generation_stops_once_abandoned(self):
+        store = ReplayStore(max_bytes=1 << 20, ttl=60, grace=0.05)
+        source = Source(100)
+        buffer = store.start("ip:1", source.frames(), self.deadline())
+
+        reader = buffer.subscribe()
+        await anext(reader)
+        await reader.aclose()
+        await asyncio.sleep(0.2)
+
+        self.assertTrue(source.cancelled)
+        self.assertTrue(buffer.finished)
+        self.assertLess(source.sent, 100)
+        self.assertIn("Stream abandoned.", buffer.frames[-1])
+
+    async def test_stream_never_read_is_abandoned(self):
+        store = ReplayStore(max_bytes=1 << 20, ttl=60, grace=0.05)
+        source = Source(100)
+        store.start("ip:1", source.frames(), self.deadline())
+        await asyncio.sleep(0.2)
+
+        self.assertTrue(source.cancelled)
+
+    async def test_resume_within_grace_keeps_generating(self):
+        store = ReplayStore(max_bytes=1 << 20, ttl=60, grace=0.1)
+        source = Source(20)
+        buffer = store.start("ip:1", source.frames(), self.deadline())
+
+        reader = buffer.subscribe()
+        await anext(reader)
+        await reader.aclose()
+        await asyncio.sleep(0.05)
+
+        frames = [frame async for frame in store.resume(buffer.id, "ip:1", f"{buffer.id}:1")]
+        self.assertFalse(source.cancelled)
+        self.assertEqual(len(frames), 19)
+
+    async def test_eviction_cancels_running_stream(self):
+        frame_size = len(format_sse({"text": "0"}, event="delta"))
+        store = ReplayStore(max_bytes=1024 + 8 * frame_size, ttl=60, grace=5)
+        first, second = Source(100), Source(100)
+        evicted = store.start("ip:1", first.frames(), self.deadline())
+        reader = evicted.subscribe()
+        await anext(reader)
+
+        store.start("ip:1", second.frames(), self.deadline())
+        frames = [frame async for frame in reader]
+        await asyncio.sleep(0.05)
+
+        self.assertTrue(evicted.evicted)
+        self.assertTrue(first.cancelled)
+        self.assertIn("Stream evicted.", frames[-1])
+        self.assertIsNone(store.get(evicted.id, "ip:1"))
+
+    async def test_deadline_ends_stream_with_error(self):
+        store = ReplayStore(max_bytes=1 << 20, ttl=60, grace=5)
+        buffer = store.start("ip:1", Source(100, gap=0.05).frames(), time.monotonic() + 0.1)
+        frames = [frame async for frame in buffer.subscribe()]
+
+        self.assertIn("Request timed out.", frames[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+"""
+The upstream scheduler: serving waiters by priority then round-robin across
+clients, shedding with 503 and `Retry-After`, and streams holding their slot
+until they are closed, cancelled or fail.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from fastapi import HTTPException  # noqa: E402
+
+from app.predict.scheduler import (  # noqa: E402
+    Priority,
+    ScheduledLLMClient,
+    UpstreamScheduler,
+    upstream_context,
+)
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def queue(self, scheduler: UpstreamScheduler, order: list, *waiters) -> list:
+        # Queues the waiters in the given order, each recording its admission.
+        async def wait(name: str, client_id: str, priority: Priority):
+            await scheduler.acquire(client_id, priority)
+            order.append(name)
+
+        tasks = []
+        for waiter in waiters:
+            tasks.append(asyncio.create_task(wait(*waiter)))
+            await asyncio.sleep(0)
+        return tasks
+
+    async def test_priority_then_round_robin(self):
+        scheduler = UpstreamScheduler(max_in_flight=1, max_queued=10, max_queue_wait=60)
+        await scheduler.acquire("holder", Priority.INTERACTIVE)
+        order = []
+        tasks = await self.queue(
+            scheduler,
+            order,
+            ("a1", "a", Priority.BATCH),
+            ("a2", "a", Priority.BATCH),
+            ("a3", "a", Priority.BATCH),
+            ("b1", "b", Priority.BATCH),
+            ("c1", "c", Priority.INTERACTIVE),
+            ("c2", "c", Priority.INTERACTIVE),
+            ("d1", "d", Priority.INTERACTIVE),
+        )
+
+        for _ in tasks:
+            scheduler.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+        # Interactive first, then one request per client in turn.
+        self.assertEqual(order, ["c1", "d1", "c2", "a1", "b1", "a2", "a3"])
+        scheduler.release()
+        self.assertEqual((scheduler.in_flight, scheduler.queued), (0, 0))
+
+    async def test_free_slots_admit_at_once(self):
+        scheduler = UpstreamScheduler(max_in_flight=2, max_queued=0, max_queue_wait=60)
+        await scheduler.acquire("a", Priority.BATCH)
+        await scheduler.acquire("a", Priority.BATCH)
+
+        self.assertEqual(scheduler.in_flight, 2)
+        self.assertEqual(scheduler.admitted, 2)
+
+    async def test_shed_when_queue_full(self):
+        scheduler = UpstreamScheduler(max_in_flight=1, max_queued=1, max_queue_wait=60)
+        await scheduler.acquire("a", Priority.BATCH)
+        waiter = asyncio.create_task(scheduler.acquire("b", Priority.BATCH))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(HTTPException) as raised:
+            await scheduler.acquire("c", Priority.INTERACTIVE)
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(raised.exception.headers["Retry-After"], "1")
+        self.assertEqual(scheduler.shed, 1)
+
+        scheduler.release()
+        await waiter
+
+    async def test_shed_on_projected_wait(self):
+        scheduler = UpstreamScheduler(max_in_flight=2, max_queued=10, max_queue_wait=5)
+        scheduler.hold_time = 4.0  # two slots held for 4s each: 2s per slot turnover
+        await scheduler.acquire("a", Priority.BATCH)
+        await scheduler.acquire("a", Priority.BATCH)
+        waiters = [asyncio.create_task(scheduler.acquire("b", Priority.BATCH)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        # Third in line: (2 + 1) * 4 / 2 = 6s, above the 5s allowed.
+        with self.assertRaises(HTTPException) as raised:
+            await scheduler.acquire("c", Priority.BATCH)
+        self.assertEqual(raised.exception.headers["Retry-After"], "6")
+
+        # Interactive requests only wait behind their own level.
+        interactive = asyncio.create_task(scheduler.acquire("c", Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queued, 3)
+
+        for _ in range(3):
+            scheduler.release()
+        await asyncio.gather(interactive, *waiters)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        scheduler = UpstreamScheduler(max_in_flight=1, max_queued=10, max_queue_wait=60)
+        await scheduler.acquire("a", Priority.BATCH)
+        waiter = asyncio.create_task(scheduler.acquire("b", Priority.BATCH))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.queued, 0)
+
+        scheduler.release()
+        self.assertEqual(scheduler.in_flight, 0)
+
+    async def test_slot_handed_over_to_cancelled_waiter_is_released(self):
+        scheduler = UpstreamScheduler(max_in_flight=1, max_queued=10, max_queue_wait=60)
+        await scheduler.acquire("a", Priority.BATCH)
+        waiter = asyncio.create_task(scheduler.acquire("b", Priority.BATCH))
+        await asyncio.sleep(0)
+
+        scheduler.release()  # hands the slot over
+        waiter.cancel()  # before the waiter got to run
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.in_flight, 0)
+
+
+class ScriptedStream:
+    def __init__(self, events: list, error: Exception | None = None):
+        self.events = events
+        self.error = error
+        self.closed = False
+
+    async def __aiter__(self):
+        for event in self.events:
+            await asyncio.sleep(0)
+            yield event
+        if self.error is not None:
+            raise self.error
+        await asyncio.Event().wait()
+
+    async def close(self):
+        self.closed = True
+
+
+class StreamingClient:
+    def __init__(self, stream: ScriptedStream):
+        self.stream = stream
+        self.responses = SimpleNamespace(create=self.create)
+
+    async def create(self, **kwargs):
+        return self.stream
+
+
+def delta(text: str) -> SimpleNamespace:
+    return SimpleNamespace(type="response.output_text.delta", delta=text)
+
+
+class SlotStreamTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        upstream_context.set(("a", Priority.INTERACTIVE))
+        self.scheduler = UpstreamScheduler(max_in_flight=1, max_queued=10, max_queue_wait=60)
+
+    async def open(self, stream: ScriptedStream):
+        client = ScheduledLLMClient(StreamingClient(stream), self.scheduler)
+        return await client.responses.create(stream=True, prompt_cache_key="chat:1")
+
+    async def test_slot_held_until_close(self):
+        stream = ScriptedStream([delta("Hi")])
+
+        async with await self.open(stream) as events:
+            self.assertEqual(self.scheduler.in_flight, 1)
+            self.assertEqual((await anext(aiter(events))).delta, "Hi")
+            self.assertEqual(self.scheduler.in_flight, 1)
+
+        self.assertTrue(stream.closed)
+        self.assertEqual(self.scheduler.in_flight, 0)
+        self.assertIsNotNone(self.scheduler.hold_time)
+
+    async def test_slot_released_on_cancel(self):
+        stream = ScriptedStream([delta("Hi")])
+
+        async def consume():
+            async with await self.open(stream) as events:
+                async for _ in events:
+                    pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.scheduler.in_flight, 1)
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(stream.closed)
+        self.assertEqual(self.scheduler.in_flight, 0)
+
+    async def test_slot_released_on_error(self):
+        stream = ScriptedStream([delta("Hi")], error=RuntimeError("upstream failed"))
+
+        with self.assertRaises(RuntimeError):
+            async with await self.open(stream) as events:
+                async for _ in events:
+                    pass
+
+        self.assertEqual(self.scheduler.in_flight, 0)
+
+    async def test_slot_passes_to_waiter_once_closed(self):
+        stream = ScriptedStream([])
+        events = await self.open(stream)
+        waiter = asyncio.create_task(self.scheduler.acquire("b", Priority.BATCH))
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+
+        await events.close()
+        await events.close()  # released once only
+        await waiter
+        self.assertEqual(self.scheduler.in_flight, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+The production entrypoint and startup: uvicorn options, a lifespan that never
+waits on the network, and the weather client created on first use.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import importlib
+import importlib.util
+import os
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from fastapi import FastAPI, HTTPException  # noqa: E402
+
+from app import main  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.logger import init_logging  # noqa: E402
+from app.predict import deps  # noqa: E402
+
+
+class EntrypointTest(unittest.TestCase):
+    def test_uvicorn_options(self):
+        # The entrypoint defaults the profile of the processes it starts to production.
+        with mock.patch.dict(os.environ):
+            server = importlib.import_module("app.server")
+            self.assertEqual(os.environ["LOG_PROFILE"], "production")
+
+        with (
+            mock.patch.object(server.uvicorn, "run") as run,
+            mock.patch.object(settings.server, "WORKERS", 4),
+            mock.patch.object(settings.server, "DRAIN_TIMEOUT", 12.0),
+        ):
+            server.main()
+
+        (target,), options = run.call_args
+        self.assertEqual(target, "app.main:app")
+        self.assertEqual(options["workers"], 4)
+        self.assertEqual(options["timeout_graceful_shutdown"], 12.0)
+        self.assertFalse(options["access_log"])
+        uvloop = importlib.util.find_spec("uvloop") is not None
+        self.assertEqual(options["loop"], "uvloop" if uvloop else "asyncio")
+
+
+class LifespanTest(unittest.IsolatedAsyncioTestCase):
+    async def test_startup_does_not_wait_on_the_network(self):
+        app = FastAPI()
+        # The lifespan removes the log sinks of the worker on the way out.
+        self.addCleanup(init_logging)
+
+        with (
+            # Nothing listens on the discard port, warm-up fails in the background.
+            mock.patch.object(settings.llm, "BASE_URL", "http://127.0.0.1:9"),
+            mock.patch.object(main.token_counter, "load") as load,
+            mock.patch.object(deps.logger, "warning"),
+        ):
+            started = time.monotonic()
+
+            async with main.lifespan(app):
+                self.assertLess(time.monotonic() - started, 1.0)
+                self.assertIsNone(app.state.owm_client)
+                load.assert_awaited_once_with(settings.llm.TOKENIZER_LOAD_TIMEOUT)
+
+
+class OWMClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_created_on_first_use(self):
+        request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(owm_client=None)))
+        client = deps.get_owm_client(request)
+        self.addAsyncCleanup(client.aclose)
+
+        self.assertIs(deps.get_owm_client(request), client)
+
+    def test_unavailable_without_a_key(self):
+        request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(owm_client=None)))
+
+        with mock.patch.object(settings.weather_api, "OWM_API_KEY", None):
+            with self.assertRaises(HTTPException) as raised:
+                deps.get_owm_client(request)
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertIsNone(request.app.state.owm_client)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Conversation sessions: owners, compaction of histories outgrowing the context
+budget, by trimming or summarizing the oldest turns, and sessions deleted or
+evicted while in use.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from app.predict import sessions  # noqa: E402
+from app.predict.sessions import SessionStore  # noqa: E402
+
+# Each message of the turns below takes 10 tokens, with its overhead.
+MESSAGE_TOKENS = 10 - sessions.MESSAGE_TOKEN_OVERHEAD
+
+
+def make_llm_client(*results) -> SimpleNamespace:
+    create = mock.AsyncMock(
+        side_effect=[
+            result if isinstance(result, Exception) else SimpleNamespace(output_text=result)
+            for result in results
+        ]
+    )
+    return SimpleNamespace(responses=SimpleNamespace(create=create))
+
+
+class SessionStoreTest(unittest.IsolatedAsyncioTestCase):
+    def make_store(self, compaction: str = "trim", max_bytes: int = 1 << 20) -> SessionStore:
+        return SessionStore(
+            max_bytes=max_bytes, ttl=60, compaction=compaction, summary_max_tokens=10
+        )
+
+    def add_turns(self, store: SessionStore, session, count: int) -> None:
+        for i in range(count):
+            store.add_turn(session, f"question {i}", MESSAGE_TOKENS, f"answer {i}", MESSAGE_TOKENS)
+
+    def test_sessions_of_other_owners_are_missing(self):
+        store = self.make_store()
+        session = store.create("alice")
+
+        self.assertIs(store.get(session.id, "alice"), session)
+        self.assertIsNone(store.get(session.id, "bob"))
+        self.assertFalse(store.delete(session.id, "bob"))
+        self.assertTrue(store.delete(session.id, "alice"))
+
+    async def test_history_within_budget_is_kept(self):
+        store = self.make_store()
+        session = store.create("alice")
+        self.add_turns(store, session, 3)
+
+        self.assertEqual(len(await store.context(session, 60, make_llm_client())), 6)
+        self.assertEqual(store.compactions, 0)
+
+    async def test_trim_drops_whole_turns(self):
+        store = self.make_store()
+        session = store.create("alice")
+        self.add_turns(store, session, 3)
+
+        messages = await store.context(session, 45, make_llm_client())
+        self.assertEqual([m["content"] for m in messages][:2], ["question 1", "answer 1"])
+        self.assertEqual(len(messages), 4)
+
+        # Not to start with an answer, the turn it belongs to is dropped entirely.
+        messages = await store.context(session, 35, make_llm_client())
+        self.assertEqual([m["content"] for m in messages], ["question 2", "answer 2"])
+        self.assertEqual((session.total_tokens, store.compactions), (20, 2))
+
+    async def test_summarize_folds_dropped_turns_into_the_summary(self):
+        store = self.make_store("summarize")
+        session = store.create("alice")
+        self.add_turns(store, session, 3)
+        llm_client = make_llm_client("Alice asked about 0.", "Alice asked about 0 and 1.")
+
+        messages = await store.context(session, 60, llm_client)
+        self.assertEqual(messages[0]["role"], "system")
+        self.assertIn("Alice asked about 0.", messages[0]["content"])
+        self.assertEqual(messages[1]["content"], "question 1")
+        dropped = llm_client.responses.create.call_args.kwargs["input"]
+        self.assertEqual([m["content"] for m in dropped], ["question 0", "answer 0"])
+
+        # The earlier summary is extended with the next dropped turns.
+        self.add_turns(store, session, 1)
+        messages = await store.context(session, 60, llm_client)
+        earlier, *dropped = llm_client.responses.create.call_args.kwargs["input"]
+        self.assertIn("Alice asked about 0.", earlier["content"])
+        self.assertEqual([m["content"] for m in dropped], ["question 1", "answer 1"])
+        self.assertIn("Alice asked about 0 and 1.", messages[0]["content"])
+
+    async def test_failed_summary_trims(self):
+        store = self.make_store("summarize")
+        session = store.create("alice")
+        self.add_turns(store, session, 3)
+
+        with mock.patch.object(sessions.logger, "warning") as warning:
+            messages = await store.context(session, 60, make_llm_client(RuntimeError("down")))
+        warning.assert_called_once()
+        self.assertEqual(len(messages), 4)
+        self.assertIsNone(session.summary)
+
+    def test_deleted_session_is_not_stored_again(self):
+        store = self.make_store()
+        session = store.create("alice")
+        store.delete(session.id, "alice")
+
+        self.add_turns(store, session, 1)
+        self.assertIsNone(store.get(session.id, "alice"))
+        self.assertEqual(store.stats()["entries"], 0)
+
+    def test_evicted_session_is_not_stored_again(self):
+        store = self.make_store(max_bytes=2 * sessions.SESSION_OVERHEAD_BYTES)
+        evicted = store.create("alice")
+        store.create("bob")
+        store.create("carol")
+
+        self.add_turns(store, evicted, 1)
+        self.assertIsNone(store.get(evicted.id, "alice"))
+        self.assertEqual(store.stats()["entries"], 2)
+
+    async def test_session_deleted_while_summarizing(self):
+        store = self.make_store("summarize")
+        session = store.create("alice")
+        self.add_turns(store, session, 3)
+
+        async def create(**kwargs):
+            store.delete(session.id, "alice")
+            return SimpleNamespace(output_text="summary")
+
+        llm_client = SimpleNamespace(responses=SimpleNamespace(create=create))
+        await store.context(session, 60, llm_client)
+        self.assertIsNone(store.get(session.id, "alice"))
+
+
+if __name__ == "__main__":
+    unittest.main()
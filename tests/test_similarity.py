@@ -0,0 +1,70 @@
+"""
+The MinHash LSH index of the near-duplicate cache: matches of reworded
+prompts above the threshold only, namespaces and LRU bounds.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import unittest
+
+from app.predict.similarity import MinHashLSHIndex, normalize_prompt
+
+PROMPT = "What is the capital city of France, and what is it best known for?"
+
+
+class NormalizePromptTest(unittest.TestCase):
+    def test_case_punctuation_and_whitespace(self):
+        self.assertEqual(normalize_prompt("  Hello,\n WORLD_again!! "), "hello world again")
+
+
+class MinHashLSHIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = MinHashLSHIndex(threshold=0.8, num_perm=128, bands=32)
+        self.index.add(PROMPT, "paris")
+
+    def test_near_duplicates_match(self):
+        self.assertEqual(self.index.lookup(PROMPT), "paris")
+        self.assertEqual(self.index.lookup(PROMPT.upper().replace(",", "")), "paris")
+        self.assertEqual(self.index.lookup(PROMPT.replace("city ", "")), "paris")
+        self.assertEqual((self.index.lookups, self.index.hits), (3, 3))
+
+    def test_different_prompts_do_not(self):
+        self.assertIsNone(self.index.lookup("What is the capital city of Italy?"))
+        self.assertIsNone(self.index.lookup("How do I sort a list in Python?"))
+        self.assertIsNone(self.index.lookup(""))
+
+    def test_signatures_estimate_jaccard_similarity(self):
+        first = self.index._signature("the quick brown fox jumps over the lazy dog")
+        second = self.index._signature("the quick brown fox jumped over a lazy dog")
+        same = sum(a == b for a, b in zip(first, second)) / self.index.num_perm
+
+        self.assertEqual(self.index._signature(PROMPT), self.index._signature(PROMPT))
+        self.assertGreater(same, 0.4)
+        self.assertLess(same, 0.95)
+
+    def test_namespaces_are_separate(self):
+        self.index.add(PROMPT, "other model", namespace="other")
+
+        self.assertEqual(self.index.lookup(PROMPT, namespace="other"), "other model")
+        self.assertIsNone(self.index.lookup(PROMPT, namespace="unknown"))
+
+    def test_least_recently_used_evicted(self):
+        index = MinHashLSHIndex(max_entries=2)
+        index.add("first prompt about the weather", 1)
+        index.add("second prompt about databases", 2)
+        index.lookup("first prompt about the weather")
+        index.add("third prompt about cooking pasta", 3)
+
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.lookup("second prompt about databases"))
+        self.assertEqual(index.lookup("first prompt about the weather"), 1)
+        self.assertEqual(sum(map(len, index._buckets.values())), 2 * index.bands)
+
+    def test_bands_must_divide_permutations(self):
+        with self.assertRaises(ValueError):
+            MinHashLSHIndex(num_perm=64, bands=10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+SSE framing of streamed answers: the first delta sent at once, the next ones
+coalesced by size or time, and the final frames of completed, failed and
+cut-off streams.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import json
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from app.predict import deps  # noqa: E402
+from app.predict.deps import format_sse, stream_generator  # noqa: E402
+
+
+def delta(text: str) -> SimpleNamespace:
+    return SimpleNamespace(type="response.output_text.delta", delta=text)
+
+
+def completed(output_tokens: int | None = None) -> SimpleNamespace:
+    usage = None if output_tokens is None else SimpleNamespace(output_tokens=output_tokens)
+    return SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage))
+
+
+async def events(*items):
+    # Numbers are pauses of the upstream, in seconds.
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+def parse(frame: str) -> tuple[str, dict]:
+    event, data = frame.rstrip("\n").split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+async def collect(response, **kwargs) -> list[tuple[str, dict]]:
+    return [parse(frame) async for frame in stream_generator(response, **kwargs)]
+
+
+class FormatSSETest(unittest.TestCase):
+    def test_newlines_do_not_break_the_framing(self):
+        frame = format_sse({"text": "two\n\nlines"}, event="delta")
+        self.assertEqual(frame, 'event: delta\ndata: {"text": "two\\n\\nlines"}\n\n')
+
+
+class StreamGeneratorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_deltas_coalesced_by_size(self):
+        frames = await collect(
+            events(delta("Hi"), *(delta("abcd") for _ in range(5)), completed(7)),
+            flush_bytes=8,
+            flush_interval=10.0,
+        )
+
+        self.assertEqual(
+            frames,
+            [
+                ("delta", {"text": "Hi"}),
+                ("delta", {"text": "abcdabcd"}),
+                ("delta", {"text": "abcdabcd"}),
+                ("delta", {"text": "abcd"}),
+                ("done", {"output_tokens": 7}),
+            ],
+        )
+
+    async def test_deltas_flushed_while_the_upstream_stalls(self):
+        frames = await collect(
+            events(delta("a"), delta("b"), delta("c"), 0.1, delta("d"), completed()),
+            flush_bytes=1024,
+            flush_interval=0.01,
+        )
+
+        texts = [data["text"] for event, data in frames if event == "delta"]
+        self.assertEqual(texts, ["a", "bc", "d"])
+
+    async def test_failure_after_the_buffered_deltas(self):
+        failed = SimpleNamespace(type="response.failed")
+        frames = await collect(events(delta("a"), delta("b"), failed), flush_interval=10.0)
+
+        self.assertEqual(frames[-2], ("delta", {"text": "b"}))
+        self.assertEqual(frames[-1], ("error", {"message": "Generation failed."}))
+
+    async def test_upstream_error(self):
+        async def broken():
+            yield delta("a")
+            raise ConnectionError("reset")
+
+        with mock.patch.object(deps.logger, "error"):
+            frames = await collect(broken())
+        self.assertEqual(frames[-1][0], "error")
+
+    async def test_estimated_tokens_capped_and_text_passed_on(self):
+        on_done = mock.Mock()
+        words = [delta(" word") for _ in range(20)]
+        frames = await collect(events(*words), max_tokens=5, on_done=on_done)
+
+        # Cut off without a completed event: the estimate stands, within the limit.
+        self.assertEqual(frames[-1], ("done", {"output_tokens": 5}))
+        on_done.assert_called_once_with(" word" * 20, 5)
+
+    async def test_tool_progress(self):
+        progress = SimpleNamespace(type="tool.progress", data={"status": "started"})
+        frames = await collect(events(delta("a"), delta("b"), progress, completed()))
+
+        self.assertEqual([event for event, _ in frames], ["delta", "delta", "tool", "done"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Structured outputs: strict schemas for the LLM api, and the incremental
+parser returning each top-level field as soon as it is complete.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import os
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from pydantic import BaseModel, Field  # noqa: E402
+
+from app.predict.structured import CompiledSchema, IncrementalJSONParser  # noqa: E402
+
+
+class Address(BaseModel):
+    street: str = Field("", examples=["123 Main St"])
+
+
+class Setting(BaseModel):
+    # Fields named after keywords strict mode drops from schemas.
+    default: str
+    examples: list[str] = Field(default_factory=list)
+    address: Address
+    mode: dict = Field({"default": True}, json_schema_extra={"const": {"default": True}})
+
+
+class StrictSchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.schema = CompiledSchema("setting", Setting).json_schema
+
+    def test_keywords_dropped_from_schemas_only(self):
+        self.assertEqual(list(self.schema["properties"]), ["default", "examples", "address", "mode"])
+        self.assertEqual(self.schema["required"], ["default", "examples", "address", "mode"])
+        self.assertNotIn("default", self.schema["properties"]["examples"])
+        self.assertNotIn("default", self.schema["properties"]["mode"])
+
+    def test_values_kept_as_they_are(self):
+        self.assertEqual(self.schema["properties"]["mode"]["const"], {"default": True})
+
+    def test_definitions_made_strict(self):
+        address = self.schema["$defs"]["Address"]
+
+        self.assertEqual(address["required"], ["street"])
+        self.assertFalse(address["additionalProperties"])
+        self.assertNotIn("examples", address["properties"]["street"])
+        self.assertFalse(self.schema["additionalProperties"])
+
+
+def feed_all(chunks: list[str]) -> tuple[IncrementalJSONParser, list[list]]:
+    parser = IncrementalJSONParser()
+    return parser, [parser.feed(chunk) for chunk in chunks]
+
+
+class IncrementalJSONParserTest(unittest.TestCase):
+    def test_fields_as_they_complete(self):
+        parser, fields = feed_all(['{"name": "Jo', 'hn", "age"', ": 4", "2, ", '"ok": true}'])
+
+        self.assertEqual(fields, [[], [("name", "John")], [], [("age", 42)], [("ok", True)]])
+        self.assertTrue(parser.done)
+
+    def test_tokens_split_anywhere(self):
+        text = '{"a": 1.5e3, "b": null, "c": "x", "d": [1, 2], "e": false}'
+        expected = [("a", 1500.0), ("b", None), ("c", "x"), ("d", [1, 2]), ("e", False)]
+
+        for size in (1, 2, 3, 7):
+            chunks = [text[i : i + size] for i in range(0, len(text), size)]
+            parser, fields = feed_all(chunks)
+            self.assertEqual([field for chunk in fields for field in chunk], expected)
+            self.assertTrue(parser.done)
+
+    def test_escapes(self):
+        text = r'{"say \"hi\"": "a \"quoted\" }, {\\", "path": "C:\\dir\\"}'
+        chunks = list(text)  # escapes split from what they escape
+        _, fields = feed_all(chunks)
+
+        self.assertEqual(
+            [field for chunk in fields for field in chunk],
+            [('say "hi"', 'a "quoted" }, {\\'), ("path", "C:\\dir\\")],
+        )
+
+    def test_nested_values_complete_with_their_closing(self):
+        _, fields = feed_all(['{"user": {"name": "a", "tags": ["x", {"y": "}"}]', "}", ', "n": 1}'])
+
+        self.assertEqual(fields[0], [])
+        self.assertEqual(fields[1], [("user", {"name": "a", "tags": ["x", {"y": "}"}]})])
+        self.assertEqual(fields[2], [("n", 1)])
+
+    def test_text_after_the_object_is_ignored(self):
+        parser, fields = feed_all(['{"a": 1}', "\n"])
+
+        self.assertEqual(fields, [[("a", 1)], []])
+        self.assertTrue(parser.done)
+
+    def test_empty_object(self):
+        parser, fields = feed_all(["  {", "}"])
+        self.assertEqual(fields, [[], []])
+        self.assertTrue(parser.done)
+
+    def test_truncated(self):
+        parser, fields = feed_all(['{"a": 1, "b": "cut o'])
+
+        self.assertEqual(fields, [[("a", 1)]])
+        self.assertFalse(parser.done)
+
+    def test_malformed(self):
+        for text in (
+            '["a"]',
+            'x{"a": 1}',
+            '{"a": tru}',
+            '{"a": 1 2}',
+            '{"a": [1}',
+            '{1: 2}',
+            '{"a" 1}',
+            '{"a":}',
+            '{"a": 1,}',
+            '{"a": "b" "c"}',
+            '{"a": 1 "b": 2}',
+        ):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                IncrementalJSONParser().feed(text)
+
+
+if __name__ == "__main__":
+    unittest.main()
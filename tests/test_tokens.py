@@ -0,0 +1,143 @@
+"""
+Token counting with the estimate used until the `tiktoken` encoding loads,
+loading it off the event loop, and fitting prompts to the context window.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from fastapi import HTTPException  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.predict.service import context_budget, fit_context_window  # noqa: E402
+from app.tokens import TokenCounter, token_counter  # noqa: E402
+
+
+class FakeEncoding:
+    # One token per character.
+    def encode(self, text: str, disallowed_special=()) -> list[str]:
+        return list(text)
+
+    def decode(self, tokens: list[str]) -> str:
+        return "".join(tokens)
+
+
+class ByteEncoding:
+    # One token per UTF-8 byte, as byte-level encodings do for rare characters.
+    def encode(self, text: str, disallowed_special=()) -> bytes:
+        return text.encode()
+
+    def decode(self, tokens: bytes) -> str:
+        return tokens.decode(errors="ignore")
+
+
+class TokenCounterTest(unittest.IsolatedAsyncioTestCase):
+    def test_estimate(self):
+        counter = TokenCounter("o200k_base")
+
+        self.assertEqual(counter.count(""), 0)
+        self.assertEqual(counter.count("Hi"), 1)
+        self.assertEqual(counter.count("Tell me about Bergamo."), 5)
+        # Long words count as several tokens.
+        self.assertGreater(counter.count("internationalization"), 1)
+
+    def test_truncate_keeps_whole_pieces(self):
+        counter = TokenCounter("o200k_base")
+        text = "one two three four five six"
+
+        truncated = counter.truncate(text, 3)
+        self.assertEqual(truncated, "one two three")
+        self.assertLessEqual(counter.count(truncated), 3)
+        self.assertEqual(counter.truncate(text, 100), text)
+
+    async def test_load_runs_off_the_event_loop(self):
+        counter = TokenCounter("o200k_base")
+        threads = []
+
+        def get_encoding(name):
+            threads.append(threading.current_thread())
+            return FakeEncoding()
+
+        with mock.patch("tiktoken.get_encoding", side_effect=get_encoding):
+            await counter.load(timeout=5)
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertEqual(counter.count("abc"), 3)
+        self.assertEqual(counter.truncate("abcdef", 2), "ab")
+
+    async def test_load_failure_keeps_the_estimate(self):
+        counter = TokenCounter("o200k_base")
+
+        with mock.patch("tiktoken.get_encoding", side_effect=OSError("offline")):
+            await counter.load(timeout=5)
+        self.assertIsNone(counter.encoding)
+        self.assertEqual(counter.count("Hi"), 1)
+
+    async def test_load_timeout(self):
+        counter = TokenCounter("o200k_base")
+
+        def slow(name):
+            time.sleep(0.2)
+            return FakeEncoding()
+
+        with mock.patch("tiktoken.get_encoding", side_effect=slow):
+            started = time.monotonic()
+            await counter.load(timeout=0.05)
+            self.assertLess(time.monotonic() - started, 0.15)
+            self.assertIsNone(counter.encoding)
+
+            # Used once the download finishes after all.
+            await asyncio.sleep(0.3)
+        self.assertIsInstance(counter.encoding, FakeEncoding)
+
+    async def test_static_counts_are_recounted_once_loaded(self):
+        counter = TokenCounter("o200k_base")
+        text = "A constant system prompt."
+        estimated = counter.count_static(text)
+
+        with mock.patch("tiktoken.get_encoding", side_effect=lambda name: FakeEncoding()):
+            await counter.load(timeout=5)
+        self.assertNotEqual(counter.count_static(text), estimated)
+        self.assertEqual(counter.count_static(text), len(text))
+
+
+class FitContextWindowTest(unittest.TestCase):
+    system_prompt = "You are a helpful assistant."
+
+    def setUp(self):
+        self.assertIsNone(token_counter.encoding)  # counts are the estimate
+        self.budget = context_budget(self.system_prompt, 128)
+
+    def test_prompt_within_budget(self):
+        prompt = "word " * (self.budget - 1)
+        self.assertIs(fit_context_window(self.system_prompt, prompt, 128), prompt)
+
+    def test_short_prompt_of_many_tokens_is_rejected(self):
+        # Fewer characters than the budget, but four tokens each.
+        prompt = "\N{GRINNING FACE}" * self.budget
+
+        with mock.patch.object(token_counter, "encoding", ByteEncoding()):
+            with self.assertRaises(HTTPException) as raised:
+                fit_context_window(self.system_prompt, prompt, 128)
+        self.assertEqual(raised.exception.status_code, 413)
+
+    def test_oversized_prompt_is_truncated(self):
+        prompt = "word " * (self.budget * 2)
+
+        with mock.patch.object(settings.llm, "TRUNCATE_OVERSIZED_PROMPTS", True):
+            fitted = fit_context_window(self.system_prompt, prompt, 128)
+        self.assertLessEqual(token_counter.count(fitted), self.budget)
+        self.assertTrue(prompt.startswith(fitted))
+
+
+if __name__ == "__main__":
+    unittest.main()
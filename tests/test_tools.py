@@ -0,0 +1,230 @@
+"""
+The tool registry: argument and failure handling returned to the model,
+concurrent calls of one turn, cached and limited tools, and the loop of tool
+rounds before the answer.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+from app.config import settings  # noqa: E402
+from app.predict import service  # noqa: E402
+from app.tools import registry  # noqa: E402
+from app.tools.registry import Tool, ToolRegistry  # noqa: E402
+
+
+def definition(name: str) -> dict:
+    return {"type": "function", "name": name, "parameters": {"type": "object"}}
+
+
+class Echo:
+    """Async tool function echoing its arguments, counting calls in flight.
+
+    Instances aren't detected as coroutine functions, so their tools are marked async.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, **kwargs) -> str:
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        return json.dumps(kwargs, sort_keys=True)
+
+
+def echo_tool(name: str, echo: Echo | None = None, **kwargs) -> Tool:
+    return Tool(definition(name), echo or Echo(), is_async=True, **kwargs)
+
+
+class ToolRegistryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.registry = ToolRegistry()
+        self.echo = Echo()
+        self.registry.register(echo_tool("echo", self.echo))
+
+        patcher = mock.patch.object(registry.logger, "warning")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_errors_returned_to_the_model(self):
+        def fails(**kwargs):
+            raise RuntimeError("boom")
+
+        async def hangs():
+            await asyncio.sleep(10)
+
+        self.registry.register(Tool(definition("fails"), fails))
+        self.registry.register(Tool(definition("hangs"), hangs, timeout=0.01))
+        self.registry.register(Tool(definition("strict"), lambda city: city))
+
+        for name, arguments, error in (
+            ("missing", "{}", "Unknown tool 'missing'."),
+            ("echo", "{not json", "Arguments are not valid JSON."),
+            ("echo", "[1, 2]", "Arguments must be a JSON object."),
+            ("fails", "{}", "Tool 'fails' failed."),
+            ("hangs", "", "Tool 'hangs' timed out."),
+        ):
+            with self.subTest(name=name, arguments=arguments):
+                output = json.loads(await self.registry.call(name, arguments))
+                self.assertEqual(output, {"error": error})
+
+        output = json.loads(await self.registry.call("strict", '{"town": "Rome"}'))
+        self.assertTrue(output["error"].startswith("Invalid arguments:"))
+
+    async def test_sync_tools_run_in_a_thread(self):
+        self.registry.register(
+            Tool(definition("thread"), lambda: threading.current_thread().name)
+        )
+        name = await self.registry.call("thread", "{}")
+        self.assertNotEqual(name, threading.current_thread().name)
+
+    async def test_context_filled_in_by_the_caller(self):
+        tool = echo_tool("client", context={"client": "owm_client"})
+        self.registry.register(tool)
+
+        output = await self.registry.call("client", '{"city": "Rome"}', {"owm_client": "pool"})
+        self.assertEqual(json.loads(output), {"city": "Rome", "client": "pool"})
+
+    async def test_calls_of_one_turn_run_concurrently(self):
+        self.echo.delay = 0.05
+        calls = [("echo", json.dumps({"n": n})) for n in range(4)]
+
+        started = time.monotonic()
+        outputs = await self.registry.call_many(calls)
+
+        self.assertLess(time.monotonic() - started, 0.15)
+        self.assertEqual([json.loads(output)["n"] for output in outputs], [0, 1, 2, 3])
+        self.assertEqual(self.echo.max_running, 4)
+
+    async def test_concurrency_limit(self):
+        echo = Echo(delay=0.01)
+        self.registry.register(echo_tool("limited", echo, max_concurrency=2))
+
+        await self.registry.call_many([("limited", json.dumps({"n": n})) for n in range(5)])
+        self.assertEqual(echo.max_running, 2)
+
+    async def test_cacheable_tools_share_results(self):
+        echo = Echo()
+        self.registry.register(echo_tool("cached", echo, cacheable=True))
+
+        # Identical arguments, in any order.
+        await self.registry.call_many(
+            [("cached", '{"a": 1, "b": 2}'), ("cached", '{"b": 2, "a": 1}')]
+        )
+        await self.registry.call("cached", '{"a": 1, "b": 2}')
+        self.assertEqual(echo.calls, 1)
+        self.assertEqual(self.registry.stats()["cached"]["entries"], 1)
+
+    def test_progress_messages(self):
+        self.registry.register(echo_tool("owm", progress="Looking up {location}…"))
+
+        progress = self.registry.describe("owm", '{"location": "Rome"}')
+        self.assertEqual(progress, "Looking up Rome…")
+        self.assertEqual(self.registry.describe("owm", '{"city": "Rome"}'), "Calling owm…")
+        self.assertEqual(self.registry.describe("echo", "{}"), "Calling echo…")
+
+    def test_definitions(self):
+        self.registry.register(echo_tool("other"))
+
+        self.assertEqual([d["name"] for d in self.registry.definitions()], ["echo", "other"])
+        self.assertEqual([d["name"] for d in self.registry.definitions(["other"])], ["other"])
+
+
+def function_call(name: str, arguments: dict, call_id: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        type="function_call", name=name, arguments=json.dumps(arguments), call_id=call_id
+    )
+
+
+class ScriptedResponses:
+    # One response per round: a list of tool calls, or the answer.
+    def __init__(self, rounds: list):
+        self.rounds = rounds
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append({**request, "input": list(request["input"])})
+        result = self.rounds[len(self.requests) - 1]
+
+        if isinstance(result, str):
+            message = SimpleNamespace(type="message")
+            return SimpleNamespace(output=[message], output_text=result)
+        return SimpleNamespace(output=result, output_text="")
+
+
+class ToolRoundsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.registry = ToolRegistry()
+        self.registry.register(echo_tool("echo"))
+        patcher = mock.patch.object(service, "tool_registry", self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def run_rounds(self, rounds: list) -> tuple[str, ScriptedResponses]:
+        responses = ScriptedResponses(rounds)
+        llm_client = SimpleNamespace(responses=responses)
+        answer = await service.get_chat_inference_weather(
+            "Rome and Paris?", 64, llm_client=llm_client
+        )
+        return answer, responses
+
+    async def test_rounds_until_the_answer(self):
+        answer, responses = await self.run_rounds(
+            [
+                [
+                    function_call("echo", {"city": "Rome"}, "1"),
+                    function_call("echo", {"city": "Paris"}, "2"),
+                ],
+                [function_call("echo", {"city": "Lyon"}, "3")],
+                "Sunny everywhere.",
+            ]
+        )
+
+        self.assertEqual(answer, "Sunny everywhere.")
+        self.assertEqual(responses.requests[0]["tool_choice"], "required")
+        self.assertEqual(responses.requests[1]["tool_choice"], "auto")
+        # Each round sees the earlier calls and their outputs, in order.
+        messages = responses.requests[2]["input"]
+        outputs = [m for m in messages if isinstance(m, dict) and "call_id" in m]
+        self.assertEqual([m["call_id"] for m in outputs], ["1", "2", "3"])
+        self.assertEqual(json.loads(outputs[1]["output"]), {"city": "Paris"})
+
+    async def test_answer_once_out_of_rounds(self):
+        rounds = range(settings.tools.MAX_ROUNDS)
+        calls = [[function_call("echo", {"n": n}, str(n))] for n in rounds]
+        answer, responses = await self.run_rounds([*calls, "Best effort."])
+
+        self.assertEqual(answer, "Best effort.")
+        self.assertNotIn("tools", responses.requests[-1])
+
+    async def test_direct_answer(self):
+        self.registry.register(echo_tool("direct", return_direct=True))
+        answer, responses = await self.run_rounds([[function_call("direct", {"a": 1}, "1")]])
+
+        self.assertEqual(json.loads(answer), {"a": 1})
+        self.assertEqual(len(responses.requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+OWM weather lookups over a pooled client: cached per normalized location,
+shared by concurrent callers, and answered with unknown weather on failures.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import asyncio
+import json
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+import httpx  # noqa: E402
+
+from app.cache import TTLCache  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.tools import functions  # noqa: E402
+from app.tools.functions import get_current_weather_from_owm  # noqa: E402
+
+
+class OWM:
+    """Mocked OWM api, answering with `status_code` after `delay` seconds."""
+
+    def __init__(self, status_code: int = 200, delay: float = 0.0):
+        self.status_code = status_code
+        self.delay = delay
+        self.requests: list[httpx.Request] = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        await asyncio.sleep(self.delay)
+
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, json={"message": "city not found"})
+        return httpx.Response(
+            200,
+            json={
+                "name": request.url.params["q"].strip().title(),
+                "sys": {"country": "IT"},
+                "main": {"temp": 21.0, "humidity": 40, "pressure": 1013, "feels_like": 20.5},
+                "wind": {"speed": 2.0},
+                "weather": [{"description": "clear sky"}],
+            },
+        )
+
+
+class WeatherLookupTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = mock.patch.object(functions, "weather_cache", TTLCache(ttl=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def make_client(self, owm: OWM) -> httpx.AsyncClient:
+        client = httpx.AsyncClient(transport=httpx.MockTransport(owm))
+        self.addAsyncCleanup(client.aclose)
+        return client
+
+    async def test_lookup(self):
+        owm = OWM()
+        client = await self.make_client(owm)
+        weather = json.loads(await get_current_weather_from_owm("Rome", "imperial", client))
+
+        self.assertEqual(weather["location"], "Rome")
+        self.assertEqual(weather["temperature_unit"], "°F")
+        self.assertEqual(weather["speed_unit"], "mph")
+        self.assertEqual(owm.requests[0].url.params["units"], "imperial")
+
+    async def test_cached_per_normalized_location(self):
+        owm = OWM()
+        client = await self.make_client(owm)
+
+        for location in ("Rome", "  rome ", "ROME"):
+            await get_current_weather_from_owm(location, client=client)
+        await get_current_weather_from_owm("Rome", "imperial", client)
+
+        self.assertEqual(len(owm.requests), 2)
+
+    async def test_concurrent_lookups_share_one_call(self):
+        owm = OWM(delay=0.01)
+        client = await self.make_client(owm)
+        lookups = [get_current_weather_from_owm(city, client=client) for city in ("Rome", "rome")]
+
+        first, second = await asyncio.gather(*lookups)
+        self.assertEqual(first, second)
+        self.assertEqual(len(owm.requests), 1)
+
+    async def test_unknown_weather_on_errors(self):
+        for owm in (OWM(status_code=404), OWM(status_code=401), OWM(delay=1.0)):
+            client = await self.make_client(owm)
+
+            with (
+                self.subTest(status_code=owm.status_code, delay=owm.delay),
+                mock.patch.object(settings.weather_api, "OWM_REQUEST_TIMEOUT", 0.01),
+                mock.patch.object(functions.logger, "warning") as warning,
+            ):
+                weather = json.loads(await get_current_weather_from_owm("Atlantis", client=client))
+
+                self.assertEqual(weather["temperature"], "unknown")
+                # The request url carries the api key.
+                self.assertNotIn(settings.weather_api.OWM_API_KEY, str(warning.call_args))
+
+    async def test_failures_are_not_cached(self):
+        owm = OWM(status_code=500)
+        client = await self.make_client(owm)
+
+        with mock.patch.object(functions.logger, "warning"):
+            await get_current_weather_from_owm("Rome", client=client)
+        owm.status_code = 200
+
+        weather = json.loads(await get_current_weather_from_owm("Rome", client=client))
+        self.assertEqual(weather["description"], "clear sky")
+
+
+if __name__ == "__main__":
+    unittest.main()
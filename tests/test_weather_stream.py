@@ -0,0 +1,99 @@
+"""
+A `/weather/stream` tool round, against a scripted LLM stream and a mocked OWM
+transport, so that it runs on every supported Python version.
+
+Run with: `PYTHONPATH=. python -m unittest discover tests`
+
+"""
+
+import os
+import unittest
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OWM_API_KEY", "test")
+
+import httpx  # noqa: E402
+
+from app.predict.service import get_chat_inference_weather_stream  # noqa: E402
+
+
+class ScriptedStream:
+    def __init__(self, events: list):
+        self.events = events
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    async def __aiter__(self):
+        for event in self.events:
+            yield event
+
+
+class ScriptedResponses:
+    # One list of events per round, in order.
+    def __init__(self, rounds: list[list]):
+        self.rounds = rounds
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append(request)
+        return ScriptedStream(self.rounds[len(self.requests) - 1])
+
+
+def completed() -> SimpleNamespace:
+    return SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=None))
+
+
+def owm_response(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(
+        200,
+        json={
+            "name": request.url.params["q"],
+            "sys": {"country": "IT"},
+            "main": {"temp": 21.0, "humidity": 40, "pressure": 1013, "feels_like": 21.0},
+            "wind": {"speed": 2.0},
+            "weather": [{"description": "clear sky"}],
+        },
+    )
+
+
+class WeatherStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def test_tool_round_then_answer(self):
+        call = SimpleNamespace(
+            type="function_call",
+            name="get_current_weather_from_owm",
+            arguments='{"location": "Bergamo"}',
+            call_id="call_1",
+        )
+        responses = ScriptedResponses(
+            [
+                [SimpleNamespace(type="response.output_item.done", item=call), completed()],
+                [SimpleNamespace(type="response.output_text.delta", delta="Sunny."), completed()],
+            ]
+        )
+        llm_client = SimpleNamespace(responses=responses)
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(owm_response)) as owm_client:
+            response = await get_chat_inference_weather_stream(
+                "Bergamo, Italy", 64, llm_client=llm_client, owm_client=owm_client
+            )
+            frames = [frame async for frame in response.body_iterator]
+
+        events = [frame.partition("\n")[0].removeprefix("event: ") for frame in frames]
+        self.assertEqual(events, ["tool", "tool", "delta", "done"])
+        self.assertIn('"status": "started"', frames[0])
+        self.assertIn('"status": "done"', frames[1])
+        self.assertIn("Sunny.", frames[2])
+
+        # The second round gets the tool call and its output.
+        tool_output = responses.requests[1]["input"][-1]
+        self.assertEqual(tool_output["call_id"], "call_1")
+        self.assertIn("clear sky", tool_output["output"])
+
+
+if __name__ == "__main__":
+    unittest.main()